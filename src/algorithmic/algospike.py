@@ -53,7 +53,7 @@ def bin_search(list, item, min, max):
     @param   max:int         The index of the last element (inclusive) in `list` for which to serach
     @return  :int            The index of `item` in `list`, if missing `~x` is returned were `x` is the position it would have if it existed
     '''
-    mid = 0
+    mid = min
     while min <= max:
         mid = (min + max) >> 1
         elem = list[mid]
@@ -80,17 +80,16 @@ def multibin_search(rc, list, items):
         minomax = [(0, count - 1, 0, len(list) - 1)]
         while len(minomax) > 0:
             (min, max, lmin, lmax) = minomax.pop()
-            while max != min:
-                (lastmax, lastlmax) = (max, lmax)
-                max = min + ((max - min) >> 1)
-                lmax = bin_search(list, items[max], lmin, lmax)
-                rc.append((max, lmax))
-                if lmax < 0:
-                    lmax = ~lmax
-                minomax.append((max + 1, lastmax, lmax + 1, lastlmax))
-        max = count - 1
-        lmax = bin_search(list, items[max], lmin, lmax)
-        rc.append((max, lmax))
+            while min <= max:
+                mid = (min + max) >> 1
+                lmid = bin_search(list, items[mid], lmin, lmax)
+                rc.append((mid, lmid))
+                if lmid < 0:
+                    minomax.append((mid + 1, max, ~lmid, lmax))
+                    (max, lmax) = (mid - 1, ~lmid - 1)
+                else:
+                    minomax.append((mid + 1, max, lmid + 1, lmax))
+                    (max, lmax) = (mid - 1, lmid - 1)
 
 
 def lb128(x):
@@ -20,6 +20,42 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import sys
 import os
+import struct
+
+
+
+KECCAK_ROUND_CONSTANTS = (0x0000000000000001,
+                          0x0000000000008082,
+                          0x800000000000808A,
+                          0x8000000080008000,
+                          0x000000000000808B,
+                          0x0000000080000001,
+                          0x8000000080008081,
+                          0x8000000000008009,
+                          0x000000000000008A,
+                          0x0000000000000088,
+                          0x0000000080008009,
+                          0x000000008000000A,
+                          0x000000008000808B,
+                          0x800000000000008B,
+                          0x8000000000008089,
+                          0x8000000000008003,
+                          0x8000000000008002,
+                          0x8000000000000080,
+                          0x000000000000800A,
+                          0x800000008000000A,
+                          0x8000000080008081,
+                          0x8000000000008080,
+                          0x0000000080000001,
+                          0x8000000080008008)
+'''
+The round constants of Keccak-f[1600]
+'''
+
+KECCAK_LANES = struct.Struct('<16Q')
+'''
+Reads the 16 lanes of a 128 byte block
+'''
 
 
 
@@ -35,150 +71,155 @@ class SHA3:
         self.S = None
         # :list<int>  The current state
         self.M = None
-        # :bytes  Left over water to fill the sponge with at next update
-        self.B = [0] * 25
-        # :list<int>  Keccak-f round temporary
-        self.C = [0] * 5
-        # :list<int>  Keccak-f round temporary
+        # :bytes  Left over water to fill the sponge with at next update, shorter than a block
         self.reinitialise()
     
     
     
-    def rotate(self, x, n):
+    def absorb(self, message, start, end):
         '''
-        Rotate a 64-bit word
+        Absorb whole blocks of a message to the Keccak sponge
         
-        @param   x:int  The value to rotate
-        @param   n:int  Rotation steps
-        @return   :int  The value rotated
-        '''
-        return ((x >> (64 - n)) + (x << n)) & 0xFFFFFFFFFFFFFFFF
-    
-    
-    def keccak_f_round(self, rc):
-        '''
-        Perform one round of computation
+        The state is kept in local variables and the lanes of a block are read all at
+        once, rather than through the state list and one byte at a time, for speed.
         
-        @param  rc:int  Round constant
+        @param  message:bytes|memoryview  The message
+        @param  start:int                 The offset of the first block in the message
+        @param  end:int                   The offset of the end of the last block, `end - start` must be a multiple of 128
         '''
-        # θ step (step 1 and 2 of 3)
-        self.C[0] = (self.S[0]  ^ self.S[1])  ^ (self.S[2]  ^ self.S[3])  ^ self.S[4]
-        self.C[2] = (self.S[10] ^ self.S[11]) ^ (self.S[12] ^ self.S[13]) ^ self.S[14]
-        db = self.C[0] ^ self.rotate(self.C[2], 1)
-        self.C[4] = (self.S[20] ^ self.S[21]) ^ (self.S[22] ^ self.S[23]) ^ self.S[24]
-        dd = self.C[2] ^ self.rotate(self.C[4], 1)
-        self.C[1] = (self.S[5]  ^ self.S[6])  ^ (self.S[7]  ^ self.S[8])  ^ self.S[9]
-        da = self.C[4] ^ self.rotate(self.C[1], 1)
-        self.C[3] = (self.S[15] ^ self.S[16]) ^ (self.S[17] ^ self.S[18]) ^ self.S[19]
-        dc = self.C[1] ^ self.rotate(self.C[3], 1)
-        de = self.C[3] ^ self.rotate(self.C[0], 1)
-        
-        # ρ and π steps, with last part of θ
-        self.B[0] = self.rotate(self.S[0] ^ da, 0)
-        self.B[1] = self.rotate(self.S[15] ^ dd, 28)
-        self.B[2] = self.rotate(self.S[5] ^ db, 1)
-        self.B[3] = self.rotate(self.S[20] ^ de, 27)
-        self.B[4] = self.rotate(self.S[10] ^ dc, 62)
-        
-        self.B[5] = self.rotate(self.S[6] ^ db, 44)
-        self.B[6] = self.rotate(self.S[21] ^ de, 20)
-        self.B[7] = self.rotate(self.S[11] ^ dc, 6)
-        self.B[8] = self.rotate(self.S[1] ^ da, 36)
-        self.B[9] = self.rotate(self.S[16] ^ dd, 55)
-        
-        self.B[10] = self.rotate(self.S[12] ^ dc, 43)
-        self.B[11] = self.rotate(self.S[2] ^ da, 3)
-        self.B[12] = self.rotate(self.S[17] ^ dd, 25)
-        self.B[13] = self.rotate(self.S[7] ^ db, 10)
-        self.B[14] = self.rotate(self.S[22] ^ de, 39)
-        
-        self.B[15] = self.rotate(self.S[18] ^ dd, 21)
-        self.B[16] = self.rotate(self.S[8] ^ db, 45)
-        self.B[17] = self.rotate(self.S[23] ^ de, 8)
-        self.B[18] = self.rotate(self.S[13] ^ dc, 15)
-        self.B[19] = self.rotate(self.S[3] ^ da, 41)
-        
-        self.B[20] = self.rotate(self.S[24] ^ de, 14)
-        self.B[21] = self.rotate(self.S[14] ^ dc, 61)
-        self.B[22] = self.rotate(self.S[4] ^ da, 18)
-        self.B[23] = self.rotate(self.S[19] ^ dd, 56)
-        self.B[24] = self.rotate(self.S[9] ^ db, 2)
-        
-        # ξ step
-        self.S[0] = self.B[0] ^ ((~(self.B[5])) & self.B[10])
-        self.S[1] = self.B[1] ^ ((~(self.B[6])) & self.B[11])
-        self.S[2] = self.B[2] ^ ((~(self.B[7])) & self.B[12])
-        self.S[3] = self.B[3] ^ ((~(self.B[8])) & self.B[13])
-        self.S[4] = self.B[4] ^ ((~(self.B[9])) & self.B[14])
-        
-        self.S[5] = self.B[5] ^ ((~(self.B[10])) & self.B[15])
-        self.S[6] = self.B[6] ^ ((~(self.B[11])) & self.B[16])
-        self.S[7] = self.B[7] ^ ((~(self.B[12])) & self.B[17])
-        self.S[8] = self.B[8] ^ ((~(self.B[13])) & self.B[18])
-        self.S[9] = self.B[9] ^ ((~(self.B[14])) & self.B[19])
-        
-        self.S[10] = self.B[10] ^ ((~(self.B[15])) & self.B[20])
-        self.S[11] = self.B[11] ^ ((~(self.B[16])) & self.B[21])
-        self.S[12] = self.B[12] ^ ((~(self.B[17])) & self.B[22])
-        self.S[13] = self.B[13] ^ ((~(self.B[18])) & self.B[23])
-        self.S[14] = self.B[14] ^ ((~(self.B[19])) & self.B[24])
-        
-        self.S[15] = self.B[15] ^ ((~(self.B[20])) & self.B[0])
-        self.S[16] = self.B[16] ^ ((~(self.B[21])) & self.B[1])
-        self.S[17] = self.B[17] ^ ((~(self.B[22])) & self.B[2])
-        self.S[18] = self.B[18] ^ ((~(self.B[23])) & self.B[3])
-        self.S[19] = self.B[19] ^ ((~(self.B[24])) & self.B[4])
-        
-        self.S[20] = self.B[20] ^ ((~(self.B[0])) & self.B[5])
-        self.S[21] = self.B[21] ^ ((~(self.B[1])) & self.B[6])
-        self.S[22] = self.B[22] ^ ((~(self.B[2])) & self.B[7])
-        self.S[23] = self.B[23] ^ ((~(self.B[3])) & self.B[8])
-        self.S[24] = self.B[24] ^ ((~(self.B[4])) & self.B[9])
-        
-        # ι step
-        self.S[0] ^= rc
+        (S0,  S1,  S2,  S3,  S4,  S5,  S6,  S7,  S8,  S9,  S10, S11, S12,
+         S13, S14, S15, S16, S17, S18, S19, S20, S21, S22, S23, S24) = self.S
+        (MASK, unpack, constants) = (0xFFFFFFFFFFFFFFFF, KECCAK_LANES.unpack_from, KECCAK_ROUND_CONSTANTS)
+        for off in range(start, end, 128):
+            (m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15) = unpack(message, off)
+            S0  ^= m0
+            S5  ^= m1
+            S10 ^= m2
+            S15 ^= m3
+            S20 ^= m4
+            S1  ^= m5
+            S6  ^= m6
+            S11 ^= m7
+            S16 ^= m8
+            S21 ^= m9
+            S2  ^= m10
+            S7  ^= m11
+            S12 ^= m12
+            S17 ^= m13
+            S22 ^= m14
+            S3  ^= m15
+            
+            # Keccak-f
+            for rc in constants:
+                # θ step (step 1 and 2 of 3)
+                C0 = (S0  ^ S1)  ^ (S2  ^ S3)  ^ S4
+                C2 = (S10 ^ S11) ^ (S12 ^ S13) ^ S14
+                db = C0 ^ (((C2 << 1) & MASK) | (C2 >> 63))
+                C4 = (S20 ^ S21) ^ (S22 ^ S23) ^ S24
+                dd = C2 ^ (((C4 << 1) & MASK) | (C4 >> 63))
+                C1 = (S5  ^ S6)  ^ (S7  ^ S8)  ^ S9
+                da = C4 ^ (((C1 << 1) & MASK) | (C1 >> 63))
+                C3 = (S15 ^ S16) ^ (S17 ^ S18) ^ S19
+                dc = C1 ^ (((C3 << 1) & MASK) | (C3 >> 63))
+                de = C3 ^ (((C0 << 1) & MASK) | (C0 >> 63))
+                
+                # ρ and π steps, with last part of θ
+                B0 = S0 ^ da
+                x = S15 ^ dd
+                B1 = ((x << 28) & MASK) | (x >> 36)
+                x = S5 ^ db
+                B2 = ((x << 1) & MASK) | (x >> 63)
+                x = S20 ^ de
+                B3 = ((x << 27) & MASK) | (x >> 37)
+                x = S10 ^ dc
+                B4 = ((x << 62) & MASK) | (x >> 2)
+                
+                x = S6 ^ db
+                B5 = ((x << 44) & MASK) | (x >> 20)
+                x = S21 ^ de
+                B6 = ((x << 20) & MASK) | (x >> 44)
+                x = S11 ^ dc
+                B7 = ((x << 6) & MASK) | (x >> 58)
+                x = S1 ^ da
+                B8 = ((x << 36) & MASK) | (x >> 28)
+                x = S16 ^ dd
+                B9 = ((x << 55) & MASK) | (x >> 9)
+                
+                x = S12 ^ dc
+                B10 = ((x << 43) & MASK) | (x >> 21)
+                x = S2 ^ da
+                B11 = ((x << 3) & MASK) | (x >> 61)
+                x = S17 ^ dd
+                B12 = ((x << 25) & MASK) | (x >> 39)
+                x = S7 ^ db
+                B13 = ((x << 10) & MASK) | (x >> 54)
+                x = S22 ^ de
+                B14 = ((x << 39) & MASK) | (x >> 25)
+                
+                x = S18 ^ dd
+                B15 = ((x << 21) & MASK) | (x >> 43)
+                x = S8 ^ db
+                B16 = ((x << 45) & MASK) | (x >> 19)
+                x = S23 ^ de
+                B17 = ((x << 8) & MASK) | (x >> 56)
+                x = S13 ^ dc
+                B18 = ((x << 15) & MASK) | (x >> 49)
+                x = S3 ^ da
+                B19 = ((x << 41) & MASK) | (x >> 23)
+                
+                x = S24 ^ de
+                B20 = ((x << 14) & MASK) | (x >> 50)
+                x = S14 ^ dc
+                B21 = ((x << 61) & MASK) | (x >> 3)
+                x = S4 ^ da
+                B22 = ((x << 18) & MASK) | (x >> 46)
+                x = S19 ^ dd
+                B23 = ((x << 56) & MASK) | (x >> 8)
+                x = S9 ^ db
+                B24 = ((x << 2) & MASK) | (x >> 62)
+                
+                # ξ step
+                S0 = B0 ^ ((B5 ^ MASK) & B10)
+                S1 = B1 ^ ((B6 ^ MASK) & B11)
+                S2 = B2 ^ ((B7 ^ MASK) & B12)
+                S3 = B3 ^ ((B8 ^ MASK) & B13)
+                S4 = B4 ^ ((B9 ^ MASK) & B14)
+                
+                S5 = B5 ^ ((B10 ^ MASK) & B15)
+                S6 = B6 ^ ((B11 ^ MASK) & B16)
+                S7 = B7 ^ ((B12 ^ MASK) & B17)
+                S8 = B8 ^ ((B13 ^ MASK) & B18)
+                S9 = B9 ^ ((B14 ^ MASK) & B19)
+                
+                S10 = B10 ^ ((B15 ^ MASK) & B20)
+                S11 = B11 ^ ((B16 ^ MASK) & B21)
+                S12 = B12 ^ ((B17 ^ MASK) & B22)
+                S13 = B13 ^ ((B18 ^ MASK) & B23)
+                S14 = B14 ^ ((B19 ^ MASK) & B24)
+                
+                S15 = B15 ^ ((B20 ^ MASK) & B0)
+                S16 = B16 ^ ((B21 ^ MASK) & B1)
+                S17 = B17 ^ ((B22 ^ MASK) & B2)
+                S18 = B18 ^ ((B23 ^ MASK) & B3)
+                S19 = B19 ^ ((B24 ^ MASK) & B4)
+                
+                S20 = B20 ^ ((B0 ^ MASK) & B5)
+                S21 = B21 ^ ((B1 ^ MASK) & B6)
+                S22 = B22 ^ ((B2 ^ MASK) & B7)
+                S23 = B23 ^ ((B3 ^ MASK) & B8)
+                S24 = B24 ^ ((B4 ^ MASK) & B9)
+                
+                # ι step
+                S0 ^= rc
+        self.S = [S0,  S1,  S2,  S3,  S4,  S5,  S6,  S7,  S8,  S9,  S10, S11, S12,
+                  S13, S14, S15, S16, S17, S18, S19, S20, S21, S22, S23, S24]
     
     
     def keccak_f(self):
         '''
         Perform Keccak-f function
         '''
-        self.keccak_f_round(0x0000000000000001)
-        self.keccak_f_round(0x0000000000008082)
-        self.keccak_f_round(0x800000000000808A)
-        self.keccak_f_round(0x8000000080008000)
-        self.keccak_f_round(0x000000000000808B)
-        self.keccak_f_round(0x0000000080000001)
-        self.keccak_f_round(0x8000000080008081)
-        self.keccak_f_round(0x8000000000008009)
-        self.keccak_f_round(0x000000000000008A)
-        self.keccak_f_round(0x0000000000000088)
-        self.keccak_f_round(0x0000000080008009)
-        self.keccak_f_round(0x000000008000000A)
-        self.keccak_f_round(0x000000008000808B)
-        self.keccak_f_round(0x800000000000008B)
-        self.keccak_f_round(0x8000000000008089)
-        self.keccak_f_round(0x8000000000008003)
-        self.keccak_f_round(0x8000000000008002)
-        self.keccak_f_round(0x8000000000000080)
-        self.keccak_f_round(0x000000000000800A)
-        self.keccak_f_round(0x800000008000000A)
-        self.keccak_f_round(0x8000000080008081)
-        self.keccak_f_round(0x8000000000008080)
-        self.keccak_f_round(0x0000000080000001)
-        self.keccak_f_round(0x8000000080008008)
-    
-    
-    def to_lane(self, message, n, off):
-        '''
-        Convert a chunk of char:s to a 64-bit word
-        
-        @param   message:bytes  The message
-        @param         n:int    `min(len(message), 128)`
-        @param       off:int    The offset in the message
-        @return         :int    Lane
-        '''
-        return ((message[off + 7] << 56) if (off + 7 < n) else 0) | ((message[off + 6] << 48) if (off + 6 < n) else 0) | ((message[off + 5] << 40) if (off + 5 < n) else 0) | ((message[off + 4] << 32) if (off + 4 < n) else 0) | ((message[off + 3] << 24) if (off + 3 < n) else 0) | ((message[off + 2] << 16) if (off + 2 < n) else 0) | ((message[off + 1] <<  8) if (off + 1 < n) else 0) | ((message[off]) if (off < n) else 0)
+        self.absorb(bytes(128), 0, 128) # Absorbing nothing leaves only the permutation
     
     
     def pad_10star1(self, msg):
@@ -224,42 +265,17 @@ class SHA3:
         
         @param  msg:bytes  The partial message
         '''
-        self.M += msg
-        nnn = len(self.M)
-        nnn -= nnn % 204800
-        message = self.M[:nnn]
-        self.M = self.M[nnn:]
-        
-        # Absorbing phase
-        for i in range(0, nnn, 128):
-            n = min(len(message), 128)
-            self.S[ 0] ^= self.to_lane(message, n, 0)
-            self.S[ 5] ^= self.to_lane(message, n, 8)
-            self.S[10] ^= self.to_lane(message, n, 16)
-            self.S[15] ^= self.to_lane(message, n, 24)
-            self.S[20] ^= self.to_lane(message, n, 32)
-            self.S[ 1] ^= self.to_lane(message, n, 40)
-            self.S[ 6] ^= self.to_lane(message, n, 48)
-            self.S[11] ^= self.to_lane(message, n, 56)
-            self.S[16] ^= self.to_lane(message, n, 64)
-            self.S[21] ^= self.to_lane(message, n, 72)
-            self.S[ 2] ^= self.to_lane(message, n, 80)
-            self.S[ 7] ^= self.to_lane(message, n, 88)
-            self.S[12] ^= self.to_lane(message, n, 96)
-            self.S[17] ^= self.to_lane(message, n, 104)
-            self.S[22] ^= self.to_lane(message, n, 112)
-            self.S[ 3] ^= self.to_lane(message, n, 120)
-            self.S[ 8] ^= self.to_lane(message, n, 128)
-            self.S[13] ^= self.to_lane(message, n, 136)
-            self.S[18] ^= self.to_lane(message, n, 144)
-            self.S[23] ^= self.to_lane(message, n, 152)
-            self.S[ 4] ^= self.to_lane(message, n, 160)
-            self.S[ 9] ^= self.to_lane(message, n, 168)
-            self.S[14] ^= self.to_lane(message, n, 176)
-            self.S[19] ^= self.to_lane(message, n, 184)
-            self.S[24] ^= self.to_lane(message, n, 192)
-            self.keccak_f()
-            message = message[128:]
+        message = memoryview(msg).cast('B')
+        start = 0
+        if len(self.M) > 0:
+            start = min(128 - len(self.M), len(message))
+            self.M += message[:start]
+            if len(self.M) < 128:
+                return
+            self.absorb(self.M, 0, 128)
+        end = start + ((len(message) - start) & ~127)
+        self.absorb(message, start, end)
+        self.M = message[end:].tobytes()
     
     
     def digest(self, msg = None):
@@ -272,52 +288,12 @@ class SHA3:
             msg = bytes([])
         message = self.pad_10star1(self.M + msg)
         self.M = None
-        nnn = len(message)
-        rc = [0] * 72
         
         # Absorbing phase
-        for i in range(0, nnn, 128):
-            n = min(len(message), 128)
-            self.S[ 0] ^= self.to_lane(message, n, 0)
-            self.S[ 5] ^= self.to_lane(message, n, 8)
-            self.S[10] ^= self.to_lane(message, n, 16)
-            self.S[15] ^= self.to_lane(message, n, 24)
-            self.S[20] ^= self.to_lane(message, n, 32)
-            self.S[ 1] ^= self.to_lane(message, n, 40)
-            self.S[ 6] ^= self.to_lane(message, n, 48)
-            self.S[11] ^= self.to_lane(message, n, 56)
-            self.S[16] ^= self.to_lane(message, n, 64)
-            self.S[21] ^= self.to_lane(message, n, 72)
-            self.S[ 2] ^= self.to_lane(message, n, 80)
-            self.S[ 7] ^= self.to_lane(message, n, 88)
-            self.S[12] ^= self.to_lane(message, n, 96)
-            self.S[17] ^= self.to_lane(message, n, 104)
-            self.S[22] ^= self.to_lane(message, n, 112)
-            self.S[ 3] ^= self.to_lane(message, n, 120)
-            self.S[ 8] ^= self.to_lane(message, n, 128)
-            self.S[13] ^= self.to_lane(message, n, 136)
-            self.S[18] ^= self.to_lane(message, n, 144)
-            self.S[23] ^= self.to_lane(message, n, 152)
-            self.S[ 4] ^= self.to_lane(message, n, 160)
-            self.S[ 9] ^= self.to_lane(message, n, 168)
-            self.S[14] ^= self.to_lane(message, n, 176)
-            self.S[19] ^= self.to_lane(message, n, 184)
-            self.S[24] ^= self.to_lane(message, n, 192)
-            self.keccak_f()
-            message = message[128:]
+        self.absorb(message, 0, len(message))
         
         # Squeezing phase
-        ptr = 0
-        i = 0
-        while i < 9:
-            v = self.S[(i % 5) * 5 + i // 5]
-            for _ in range(8):
-                rc[ptr] = v & 255
-                ptr += 1
-                v >>= 8
-            i += 1
-        
-        return bytes(rc)
+        return struct.pack('<9Q', *[self.S[(i % 5) * 5 + i // 5] for i in range(9)])
     
     
     def digest_file(self, filename):
@@ -334,16 +310,13 @@ class SHA3:
                 blksize = 8192
         except:
             pass
-        rc = ''
+        # Read many blocks at a time, so that the file is hashed with few calls
+        blksize *= max(1, (1 << 20) // blksize)
         with open(filename, 'rb') as file:
             while True:
                 chunk = file.read(blksize)
                 if len(chunk) == 0:
                     break
                 self.update(chunk)
-            bs = self.digest()
-            for b in bs:
-                rc += "0123456789ABCDEF"[b >> 4]
-                rc += "0123456789ABCDEF"[b & 15]
-        return rc
+            return self.digest().hex().upper()
 
@@ -68,6 +68,23 @@ error('algospike.multibin_search, searching for non-existing, does not work',
       got[0] == ~0 and 2 <= got[1] <= 10 and got[2] == ~12 and 12 <= got[3] <= 16 and
       19 <= got[4] <= 21 and got[5] == 23 and got[6] == ~len(items))
 
+got = []
+multibin_search(got, items, 'a b c d e f g h i j k l m n o p q r s t u v w'.split(' '))
+error('algospike.multibin_search, every item reported once, does not work',
+      sorted(item[0] for item in got) == list(range(23)))
+got = dict(got)
+error('algospike.multibin_search, searching for all, does not work',
+      all(((got[i] >= 0) and (items[got[i]] == chr(ord('a') + i))) or
+          ((got[i] < 0) and (chr(ord('a') + i) not in items) and (items[:~got[i]] == [c for c in items if c < chr(ord('a') + i)]))
+          for i in range(23)))
+
+got = []
+multibin_search(got, ['a', 'c', 'e'], ['b', 'c'])
+error('algospike.multibin_search, two items, does not work', sorted(got) == [(0, ~1), (1, 1)])
+got = []
+multibin_search(got, ['a', 'b'], ['a', 'b', 'c'])
+error('algospike.multibin_search, past the end, does not work', sorted(got) == [(0, 0), (1, 1), (2, ~2)])
+
 
 
 items = [0, 1, 2, 3, 4, 5, 6, 7, 8, 10, 12, 16, 100, 1000, 10000, 1 << 10, (1 << 20) + 4, (1 << 20) - 4, (1 << 32) - 1]
@@ -142,6 +159,21 @@ got = sha3.digest_file('../../LICENSE')
 ref = '827821773FDCE6F142E8C0446530DA596369AB63D5230E2A7D786AEAC0BDC406F1A50D8550F718A70384526980FEEADBF43348ADDBC50A13478B1A958C0E9218DC172DA2CB7591ED'
 error('sha3sum does not work', got == ref)
 
+sha3 = SHA3()
+got = sha3.digest().hex().upper()
+ref = '6753E3380C09E385D0339EB6B050A68F66CFD60A73476E6FD6ADEB72F5EDD7C6F04A5D017A19CBE291935855B4860F69DF04C98AA78B407A9BA9826F7266EF14BA6D3F90C4FE154D'
+error('sha3sum, empty message, does not work', got == ref)
+
+for size in (1, 127, 128, 129, 255, 256, 1000):
+    message = bytes((i * 7) & 255 for i in range(size))
+    sha3 = SHA3()
+    ref = sha3.digest(message)
+    for step in (1, 3, 64, 127, 128, 200):
+        sha3 = SHA3()
+        for i in range(0, size, step):
+            sha3.update(message[i : i + step])
+        error('sha3sum, %i bytes in %i byte chunks, does not work' % (size, step), sha3.digest() == ref)
+
 
 
 scroll = ScrollVersion('test=1')
@@ -20,6 +20,39 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import os
+import ast
+import marshal
+import operator
+import hashlib
+import importlib.util
+
+
+BYTECODE_CACHE = 'var/cache/bytecode/'
+'''
+The directory, relative to Spike's location, in which compiled scrolls and add-ons are cached
+'''
+
+EXTRACT_OPERATORS = {ast.Add : (operator.add, operator.iadd),
+                     ast.Sub : (operator.sub, operator.isub),
+                     ast.Mod : (operator.mod, operator.imod),
+                     ast.BitOr : (operator.or_, operator.ior),
+                     ast.BitAnd : (operator.and_, operator.iand),
+                     ast.BitXor : (operator.xor, operator.ixor),
+                     ast.USub : (operator.neg, None),
+                     ast.UAdd : (operator.pos, None),
+                     ast.Invert : (operator.invert, None),
+                     ast.Not : (operator.not_, None)}
+'''
+Map from operator to its function and its in-place function, for the operators that may be
+used in fields extracted without executing the scroll, operators that can create huge values
+are not included
+'''
+
+EXTRACT_UNSAFE = {'globals', 'locals', 'vars', 'exec', 'eval', 'getattr', 'setattr', '__builtins__'}
+'''
+Names and attributes that, if used in a scroll, allow the scroll to modify its fields in ways
+that cannot be seen without executing the scroll
+'''
 
 
 SOFTWARE_SHAREABLE = 1
@@ -84,11 +117,154 @@ class ScrollMagick():
         @param  scroll:str              The scroll file
         @param  globals:dict<str, any>  Should be `globals()`
         '''
+        exec(ScrollMagick.compile_scroll(scroll), globals)
+    
+    
+    @staticmethod
+    def compile_scroll(scroll):
+        '''
+        Opens and compiles a scroll, or an add-on, the compiled code is cached in
+        `ScrollMagick.bytecode_cache` if it is set
+        
+        The cached code is used if the file's path, size and modification time and
+        the interpreter's magic number are unchanged, without reading the file
+        
+        @param   scroll:str  The scroll file
+        @return  :code       The compiled scroll
+        '''
+        (cache, header) = (None, None)
+        if ScrollMagick.bytecode_cache is not None:
+            stat = os.stat(scroll)
+            cache = ScrollMagick.bytecode_cache + hashlib.blake2b(scroll.encode('utf-8'), digest_size = 16).hexdigest()
+            header = importlib.util.MAGIC_NUMBER
+            header += stat.st_mtime_ns.to_bytes(8, 'big', signed = True) + stat.st_size.to_bytes(8, 'big')
+            header += scroll.encode('utf-8') + bytes([0])
+            try:
+                with open(cache, 'rb') as file:
+                    data = file.read()
+                if data.startswith(header):
+                    return marshal.loads(data[len(header):])
+            except:
+                pass
+        
         code = None
         with open(scroll, 'rb') as file:
             code = file.read().decode('utf8', 'replace') + '\n'
             code = compile(code, scroll, 'exec')
-        exec(code, globals)
+        
+        if cache is not None:
+            try:
+                if not os.path.exists(ScrollMagick.bytecode_cache):
+                    os.makedirs(ScrollMagick.bytecode_cache)
+                temporary = '%s~%i' % (cache, os.getpid())
+                with open(temporary, 'wb') as file:
+                    file.write(header + marshal.dumps(code))
+                os.rename(temporary, cache)
+            except OSError:
+                pass # You cannot write to the cache, the scroll will be compiled again next time
+        return code
+    
+    
+    @staticmethod
+    def extract_fields(scroll):
+        '''
+        Get the fields of a scroll without executing it, this is only possible if
+        all fields are assigned with literals and constants
+        
+        @param   scroll:str        The scroll file
+        @return  :dict<str, ¿E?>?  The fields of the scroll, `None` if a field is computed, in which case the scroll must be executed
+        '''
+        with open(scroll, 'rb') as file:
+            code = file.read().decode('utf8', 'replace') + '\n'
+        try:
+            tree = ast.parse(code, scroll)
+        except SyntaxError:
+            return None
+        
+        # Start with the default values of the fields and the constants available to scrolls
+        fields = {}
+        ScrollMagick.init_fields(fields)
+        env = dict((name, value) for (name, value) in globals().items() if name.isupper() and isinstance(value, int))
+        env.update(fields)
+        
+        # Anything that could modify the fields indirectly requires the scroll to be executed
+        for node in ast.walk(tree):
+            if isinstance(node, ast.NamedExpr) and (node.target.id in fields):
+                return None
+            if isinstance(node, (ast.Global, ast.Nonlocal)) and (len(set(node.names) & set(fields.keys())) > 0):
+                return None
+            if isinstance(node, ast.Name) and (node.id in EXTRACT_UNSAFE):
+                return None
+            if isinstance(node, ast.Attribute) and (node.attr in EXTRACT_UNSAFE):
+                return None
+            if isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.value, ast.Name):
+                if (node.value.id in fields) and (isinstance(node, ast.Attribute) or not isinstance(node.ctx, ast.Load)):
+                    return None
+        
+        # Evaluate the assignments, in order
+        defined = set() # Functions and classes defined by the scroll, which may do anything when called
+        for statement in tree.body:
+            if isinstance(statement, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+                value = statement.value
+                if value is None:
+                    continue # Annotation without assignment
+                targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+                # Assigning to an item or attribute of a computed value may modify anything
+                if any(ScrollMagick.__calls(target, defined) for target in targets):
+                    return None
+                if any(isinstance(node, ast.Name) and (node.id in defined) for node in ast.walk(value)):
+                    return None
+                # A field that is bound to another name can be modified through that name
+                if ScrollMagick.__aliases(value, fields):
+                    if not all(isinstance(target, ast.Name) and (target.id in fields) for target in targets):
+                        return None
+                try:
+                    value = ScrollMagick.__evaluate(value, env)
+                    if isinstance(statement, ast.AugAssign):
+                        if not isinstance(statement.target, ast.Name):
+                            raise ValueError()
+                        function = EXTRACT_OPERATORS.get(type(statement.op), (None, None))[1]
+                        if (function is None) or (statement.target.id not in env):
+                            raise ValueError()
+                        value = function(env[statement.target.id], value)
+                    for target in targets:
+                        ScrollMagick.__bind(target, value, env)
+                except ValueError:
+                    # The value is computed
+                    for target in targets:
+                        for node in ast.walk(target):
+                            if isinstance(node, ast.Name):
+                                if node.id in fields:
+                                    return None
+                                env.pop(node.id, None)
+            elif isinstance(statement, (ast.Import, ast.ImportFrom)):
+                for alias in statement.names:
+                    env.pop((alias.asname or alias.name).split('.')[0], None)
+            elif isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if statement.name in fields:
+                    return None
+                # Decorators, default values, annotations and class bodies are evaluated at the definition
+                if isinstance(statement, ast.ClassDef):
+                    evaluated = [statement]
+                else:
+                    evaluated = statement.decorator_list + [statement.args] + [statement.returns]
+                for node in evaluated:
+                    if (node is not None) and (ScrollMagick.__calls(node, defined) or ScrollMagick.__aliases(node, fields)):
+                        return None
+                env.pop(statement.name, None)
+                defined.add(statement.name)
+            else:
+                # Top level code that is not an assignment, fields may only be read in assignments,
+                # and calls may modify the fields indirectly
+                if ScrollMagick.__calls(statement, defined):
+                    return None
+                for node in ast.walk(statement):
+                    if isinstance(node, ast.Name) and (node.id in fields):
+                        return None
+                    if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                        env.pop(node.id, None)
+        
+        return dict((field, env[field]) for field in fields)
     
     
     @staticmethod
@@ -315,4 +491,107 @@ class ScrollMagick():
                 if 0 <= value < 3:
                     return ('Unsupported', 'Supported', 'Manditory')[value]
         return value
+    
+    
+    
+    @staticmethod
+    def __evaluate(node, env):
+        '''
+        Evaluate an expression that only uses literals, operators in `EXTRACT_OPERATORS` and known variables
+        
+        @param   node:ast.expr       The expression
+        @param   env:dict<str, ¿E?>  The known variables
+        @return  :¿E?                The value of the expression, `ValueError` is raised if it cannot be evaluated
+        '''
+        evaluate = lambda n : ScrollMagick.__evaluate(n, env)
+        if isinstance(node, ast.Constant):
+            return node.value
+        elif isinstance(node, ast.Name):
+            if node.id not in env:
+                raise ValueError()
+            return env[node.id]
+        elif isinstance(node, ast.List):
+            return [evaluate(elem) for elem in node.elts]
+        elif isinstance(node, ast.Tuple):
+            return tuple(evaluate(elem) for elem in node.elts)
+        elif isinstance(node, ast.Set):
+            return set(evaluate(elem) for elem in node.elts)
+        elif isinstance(node, ast.Dict):
+            if None in node.keys:
+                raise ValueError()
+            return dict((evaluate(key), evaluate(value)) for (key, value) in zip(node.keys, node.values))
+        elif isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            function = EXTRACT_OPERATORS.get(type(node.op), (None, None))[0]
+            if function is None:
+                raise ValueError()
+            try:
+                if isinstance(node, ast.UnaryOp):
+                    return function(evaluate(node.operand))
+                return function(evaluate(node.left), evaluate(node.right))
+            except (TypeError, ArithmeticError):
+                raise ValueError()
+        raise ValueError()
+    
+    
+    @staticmethod
+    def __calls(node, defined):
+        '''
+        Check whether a piece of code may have side effects, that is, whether it contains a
+        call or an attribute, or uses a function or class defined in the scroll
+        
+        @param   node:ast.AST      The code
+        @param   defined:set<str>  The functions and classes defined in the scroll
+        @return  :bool             Whether the code may have side effects
+        '''
+        for n in ast.walk(node):
+            if isinstance(n, (ast.Call, ast.Attribute)):
+                return True
+            if isinstance(n, ast.Name) and (n.id in defined):
+                return True
+        return False
+    
+    
+    @staticmethod
+    def __aliases(node, fields):
+        '''
+        Check whether an expression may evaluate to, or contain, the value of a field itself rather than a copy
+        
+        @param   node:ast.expr          The expression
+        @param   fields:dict<str, ¿E?>  The fields
+        @return  :bool                  Whether the value of the expression may share a value with a field
+        '''
+        if isinstance(node, ast.Name):
+            return node.id in fields
+        children = list(ast.iter_child_nodes(node))
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)) and (type(node.op) in EXTRACT_OPERATORS):
+            # The operators create new values, but their operands may alias fields in other ways
+            children = [child for child in children if not isinstance(child, ast.Name)]
+        return any(ScrollMagick.__aliases(child, fields) for child in children)
+    
+    
+    @staticmethod
+    def __bind(target, value, env):
+        '''
+        Assign a value to a target, as in an assignment statement, `ValueError` is raised if it cannot be evaluated
+        
+        @param  target:ast.expr     The target
+        @param  value:¿E?           The value
+        @param  env:dict<str, ¿E?>  The known variables, will be updated
+        '''
+        if isinstance(target, ast.Name):
+            env[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)) and not any(isinstance(t, ast.Starred) for t in target.elts):
+            try:
+                values = list(value)
+            except TypeError:
+                raise ValueError()
+            if len(values) != len(target.elts):
+                raise ValueError()
+            for (t, v) in zip(target.elts, values):
+                ScrollMagick.__bind(t, v, env)
+        else:
+            raise ValueError()
+
+
+ScrollMagick.bytecode_cache = None
 
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Test for this directory
+'''
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, '..')
+
+from auxiliary.scrollmagick import *
+
+
+errno = 0
+def error(message, ok = False):
+    global errno
+    if not ok:
+        errno = 2
+        print('\033[31m%s\033[00m' % message)
+
+
+tmpdir = tempfile.mkdtemp()
+
+
+def execute(scroll):
+    fields = {}
+    ScrollMagick.init_fields(fields)
+    globs = dict(vars(sys.modules['auxiliary.scrollmagick']))
+    globs.update(fields)
+    ScrollMagick.execute_scroll(scroll, globs)
+    return dict((field, globs[field]) for field in fields)
+
+
+
+# Fields that are extracted without executing the scroll must be those the scroll gets when executed
+scrolls = [('literals', "pkgname = 'a'\npkgver = '1'\ndepends = ['b', 'c']\nfreedom = SOFTWARE | MEDIA\n"),
+           ('augmented', "depends = ['b']\ndepends += ['c']\nprovides = depends\nprovides += ['d']\n"),
+           ('alias', "depends = ['b']\nl = depends\nl.append('c')\n"),
+           ('nested alias', "depends = ['b']\nl = [depends]\nl[0].append('c')\n"),
+           ('alias through default', "depends = ['b']\ndef f(l = depends):\n    l.append('c')\n_ = f()\n"),
+           ('builtins', "import builtins\nbuiltins.globals()['pkgver'] = '9'\n"),
+           ('builtins in statement', "import builtins\nbuiltins.globals().update(pkgver = '9')\n"),
+           ('class body', "import builtins\nclass C:\n    builtins.globals()['pkgver'] = '9'\n"),
+           ('decorator', "depends = ['b']\ndef g(f):\n    f().append('c')\n    return f\n@g\ndef h():\n    return depends\n"),
+           ('function', "depends = ['b']\ndef h():\n    return depends\n_ = h().append('c')\n"),
+           ('example', open('../../doc/example.scroll', 'rb').read().decode('utf-8'))]
+for (name, code) in scrolls:
+    scroll = tmpdir + '/' + name.replace(' ', '-') + '.scroll'
+    with open(scroll, 'wb') as file:
+        file.write(code.encode('utf-8'))
+    got = ScrollMagick.extract_fields(scroll)
+    error('scrollmagick.ScrollMagick.extract_fields, %s, does not work' % name, (got is None) or (got == execute(scroll)))
+    if name in ('literals', 'augmented', 'example'):
+        error('scrollmagick.ScrollMagick.extract_fields, %s, is not extracted' % name, got is not None)
+
+
+
+shutil.rmtree(tmpdir)
+
+
+if errno == 0:
+    print('\033[32m%s\033[00m' % 'Everyting seems to be working')
+exit(errno)
+
@@ -19,8 +19,11 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import shutil
 
 from database.spikedb import *
+from database.intdb import *
+from database.hashdb import *
 import dragonsuite
 
 
@@ -63,6 +66,54 @@ The maximum length of lb(file name length)
 '''
 
 
+DB_JOURNAL = 'journal'
+'''
+The name of the file, in the database directories, to which transactions are journaled
+'''
+
+DB_ENGINES_FILE = 'engines'
+'''
+The name of the file, in the database directories, in which the storage engines selected for databases are recorded
+'''
+
+DB_SNAPSHOTS = 'snapshots'
+'''
+The name of the directory, in the database directories, in which the generations of the databases are stored
+'''
+
+DB_CURRENT = 'current'
+'''
+The name of the symbolic link, in the snapshot directories, to the current generation of the databases
+'''
+
+DB_LOCK = 'lock'
+'''
+The name of the file, in the snapshot directories, that is locked by writers, exclusively if they modify all databases
+'''
+
+
+DB_ENGINE_SPIKE = 'spike'
+'''
+Storage engine: sorted string keyed database files (`SpikeDB`), not selectable for databases keyed by integers
+'''
+
+DB_ENGINE_INT = 'int'
+'''
+Storage engine: sorted integer keyed database file (`IntDB`), only for databases keyed by integers
+'''
+
+DB_ENGINE_HASH = 'hash'
+'''
+Storage engine: hash indexed database files (`HashDB`), for databases that are only used for point lookups,
+not selectable for databases keyed by integers
+'''
+
+DB_ENGINE_ALL = (DB_ENGINE_SPIKE, DB_ENGINE_INT, DB_ENGINE_HASH)
+'''
+All storage engines
+'''
+
+
 ## Value/key type, these are (type_name:str, value_size:int, value_type:int)-tuples
 
 DB_FILE_NAME   = lambda n : ('file'          if n < 0 else ('file%i' % n),
@@ -100,6 +151,16 @@ Value/key type for pony ID dependency
 '''
 
 
+DB_ENGINES = {(DB_PONY_ID[0], DB_FILE_ID[0])       : DB_ENGINE_INT,
+              (DB_FILE_ID[0], DB_PONY_ID[0])       : DB_ENGINE_INT,
+              (DB_FILE_ID[0], DB_FILE_NAME(-1)[0]) : DB_ENGINE_INT,
+              (DB_FILE_ID[0], DB_FILE_ENTIRE[0])   : DB_ENGINE_INT}
+'''
+The default storage engines for databases, as (key type name, value type name), that do not use `DB_ENGINE_SPIKE`,
+the defaults are overridden by the storage engines selected with `DBCtrl.convert`
+'''
+
+
 
 class DBCtrl():
     '''
@@ -112,25 +173,232 @@ class DBCtrl():
         
         @param  spike_path:str  The path for Spike
         '''
-        self.syspath = (spike_path + os.sep + 'var' + os.sep).replace('%', '%%')
-        self.homepath = (os.environ['HOME'] + '/.local/var/spike/var'.replace('/', os.sep)).replace('%', '%%')
+        (syspath, homepath) = DBCtrl.prefixes(spike_path)
+        self.syspath = DBSnapshot.resolve(syspath).replace('%', '%%')
+        self.homepath = DBSnapshot.resolve(homepath).replace('%', '%%')
+        for path in (self.syspath, self.homepath):
+            path = path.replace('%%', '%')
+            # Empty journals are left alone so that readers do not write to the databases
+            if os.path.exists(path + DB_JOURNAL) and (os.path.getsize(path + DB_JOURNAL) > 0):
+                DBTransaction.recover(path)
+        self.engines = {}
+        self.stored = {}
+    
+    
+    @staticmethod
+    def prefixes(spike_path):
+        '''
+        Gets the prefixes of the database files, without the generation selected by `DBSnapshot`
+        
+        @param   spike_path:str  The path for Spike
+        @return  :(str, str)     The prefix for the public databases and the prefix for the private databases
+        '''
+        syspath = spike_path + os.sep + 'var' + os.sep
+        homepath = os.environ['HOME'] + '/.local/var/spike/var'.replace('/', os.sep)
+        return (syspath, homepath)
     
     
-    def open_db(self, private, key, value):
+    def open_db(self, private, key, value, modify = False):
         '''
         Open a database
         
+        A database that is stored with another storage engine than the selected is opened
+        with that storage engine, and is only converted when it is about to be modified
+        
         @param   private:bool           Whether to open a private database
         @param   key:(str, int, int)    The key type of the database
         @param   value:(str, int, int)  The value type of the database
-        @return  :SpikeDB               The database instance
+        @param   modify:bool            Whether the database is about to be modified, it must be locked for modifications
+        @return  :SpikeDB|IntDB|HashDB  The database instance
         '''
         path = self.homepath if private else self.syspath
-        pre = '' if not private else 'priv_'
-        db  = '%s%s%s_%s.%%i' % (path, pre, key[0], value[0])
         if not os.path.exists(path):
             dragonsuite.mkdir_p(path)
-        return SpikeDB(db, value[1])
+        engine = self.engine(private, key, value)
+        stored = self.__stored(private, key, value, engine)
+        if stored == engine:
+            return self.__open_engine(private, key, value, engine)
+        if not modify:
+            # Readers do not hold any lock, so they must not modify the databases
+            return self.__open_engine(private, key, value, stored)
+        db = self.__open_engine(private, key, value, engine)
+        DBCtrl.migrate(self.__open_engine(private, key, value, stored), db)
+        self.stored[(private, key[0], value[0])] = engine
+        return db
+    
+    
+    def engine(self, private, key, value):
+        '''
+        Gets the storage engine that is used for a database
+        
+        @param   private:bool           Whether the database is private
+        @param   key:(str, int, int)    The key type of the database
+        @param   value:(str, int, int)  The value type of the database
+        @return  :str                   The storage engine, one of `DB_ENGINE_ALL`
+        '''
+        table = '%s_%s' % (key[0], value[0])
+        return self.__engines(private).get(table, DB_ENGINES.get((key[0], value[0]), DB_ENGINE_SPIKE))
+    
+    
+    def convert(self, private, key, value, engine):
+        '''
+        Select the storage engine for a database, and convert the database to it
+        
+        Databases keyed by integers can only use `DB_ENGINE_INT`, the other storage engines
+        pad the keys with NUL:s, so raw integers that only differ in trailing zero bytes,
+        such as 65536 and 16777216, would be merged
+        
+        @param  private:bool           Whether the database is private
+        @param  key:(str, int, int)    The key type of the database
+        @param  value:(str, int, int)  The value type of the database
+        @param  engine:str             The storage engine, one of `DB_ENGINE_ALL`
+        '''
+        if engine not in DB_ENGINE_ALL:
+            raise Exception('Unknown storage engine: %s' % engine)
+        if (engine == DB_ENGINE_INT) and (key[2] != CONVERT_INT):
+            raise Exception('Database is not keyed by integers: %s_%s' % (key[0], value[0]))
+        if (engine != DB_ENGINE_INT) and (key[2] == CONVERT_INT):
+            raise Exception('Database is keyed by integers: %s_%s' % (key[0], value[0]))
+        stored = self.__stored(private, key, value, self.engine(private, key, value))
+        engines = self.__engines(private)
+        engines['%s_%s' % (key[0], value[0])] = engine
+        path = (self.homepath if private else self.syspath).replace('%%', '%')
+        with open(path + DB_ENGINES_FILE + '~', 'wb') as file:
+            for table in sorted(engines.keys()):
+                file.write(('%s %s\n' % (table, engines[table])).encode('utf-8'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(path + DB_ENGINES_FILE + '~', path + DB_ENGINES_FILE)
+        if engine != stored:
+            DBCtrl.migrate(self.__open_engine(private, key, value, stored), self.__open_engine(private, key, value, engine))
+        self.stored[(private, key[0], value[0])] = engine
+    
+    
+    @staticmethod
+    def types(table):
+        '''
+        Gets the key type and value type of a database from its name
+        
+        @param   table:str                             The name of the database, ‘<key type name>_<value type name>’
+        @return  :((str, int, int), (str, int, int))?  The key type and the value type, `None` if the name is not valid
+        '''
+        if table.count('_') != 1:
+            return None
+        rc = []
+        for name in table.split('_'):
+            for type in (DB_FILE_NAME(-1), DB_FILE_ID, DB_FILE_ENTIRE, DB_PONY_NAME, DB_PONY_ID, DB_PONY_DEPS):
+                if type[0] == name:
+                    rc.append(type)
+            if name.startswith('file') and name[4:].isdigit():
+                rc.append(DB_FILE_NAME(int(name[4:])))
+        return tuple(rc) if len(rc) == 2 else None
+    
+    
+    @staticmethod
+    def lock_name(key, value):
+        '''
+        Gets the name of the lock for a database, the databases of file names of all lengths share one lock
+        
+        @param   key:(str, int, int)    The key type of the database
+        @param   value:(str, int, int)  The value type of the database
+        @return  :str                   The name of the lock
+        '''
+        names = [key[0], value[0]]
+        for i in range(2):
+            if names[i].startswith('file') and names[i][4:].isdigit():
+                names[i] = DB_FILE_NAME(-1)[0]
+        return '%s_%s' % tuple(names)
+    
+    
+    @staticmethod
+    def migrate(old, new):
+        '''
+        Move all values from a database to another database, for example from a
+        string keyed database (`SpikeDB`) to an integer keyed database (`IntDB`)
+        
+        @param  old:SpikeDB|IntDB|HashDB  The database to empty and remove
+        @param  new:SpikeDB|IntDB|HashDB  The database to which to add the values
+        '''
+        if len(old.files()) == 0:
+            return
+        pairs = new.list([])
+        old.list(pairs)
+        new.make(pairs)
+        old.destroy_database()
+    
+    
+    def __open_engine(self, private, key, value, engine):
+        '''
+        Open a database with a specific storage engine
+        
+        @param   private:bool           Whether to open a private database
+        @param   key:(str, int, int)    The key type of the database
+        @param   value:(str, int, int)  The value type of the database
+        @param   engine:str             The storage engine, one of `DB_ENGINE_ALL`
+        @return  :SpikeDB|IntDB|HashDB  The database instance
+        '''
+        path = self.homepath if private else self.syspath
+        pre = '' if not private else 'priv_'
+        db  = '%s%s%s_%s' % (path, pre, key[0], value[0])
+        if engine == DB_ENGINE_INT:
+            return IntDB(db.replace('%%', '%') + '.int', key[1], value[1])
+        if engine == DB_ENGINE_HASH:
+            return HashDB(db + '.hash.%i', value[1])
+        return SpikeDB(db + '.%i', value[1])
+    
+    
+    def __stored(self, private, key, value, engine):
+        '''
+        Gets the storage engine with which a database is stored, the storage
+        engines are only looked for once
+        
+        @param   private:bool           Whether the database is private
+        @param   key:(str, int, int)    The key type of the database
+        @param   value:(str, int, int)  The value type of the database
+        @param   engine:str             The selected storage engine
+        @return  :str                   The storage engine with which the database is stored, `engine` if it is not stored
+        '''
+        table = (private, key[0], value[0])
+        if table not in self.stored:
+            self.stored[table] = engine
+            if len(self.__open_engine(private, key, value, engine).files()) == 0:
+                # The database may have been stored with another storage engine
+                for other in DB_ENGINE_ALL:
+                    if (other != engine) and ((other != DB_ENGINE_INT) or (key[2] == CONVERT_INT)):
+                        if len(self.__open_engine(private, key, value, other).files()) > 0:
+                            self.stored[table] = other
+                            break
+        return self.stored[table]
+    
+    
+    def __engines(self, private):
+        '''
+        Gets the storage engines that have been selected for databases
+        
+        @param   private:bool     Whether to get the selections for private databases
+        @return  :dict<str, str>  Map from database name to storage engine
+        '''
+        if private not in self.engines:
+            engines = {}
+            path = (self.homepath if private else self.syspath).replace('%%', '%')
+            if os.path.exists(path + DB_ENGINES_FILE):
+                with open(path + DB_ENGINES_FILE, 'rb') as file:
+                    for line in file.read().decode('utf-8', 'replace').split('\n'):
+                        line = line.split(' ')
+                        if (len(line) == 2) and (line[1] in DB_ENGINE_ALL):
+                            engines[line[0]] = line[1]
+            self.engines[private] = engines
+        return self.engines[private]
+    
+    
+    def transaction(self):
+        '''
+        Start a transaction, in which modifications to any number of databases are collected
+        and then applied at once
+        
+        @return  :DBTransaction  The transaction
+        '''
+        return DBTransaction(self)
     
     
     def joined_fetch(self, aggregator, input, types, private = None):
@@ -336,6 +604,25 @@ class DBCtrl():
         return rc
     
     
+    @staticmethod
+    def foreign_below(files_db, directory, fileids):
+        '''
+        Check whether a directory holds files, below it, other than some files
+        
+        @param   files_db:SpikeDB|IntDB|HashDB  The file name → file ID database
+        @param   directory:str                  The directory
+        @param   fileids:itr<str>               The file ID:s of the files, converted with `CONVERT_INT`
+        @return  :bool                          Whether any file below the directory is not among the files
+        '''
+        # The file ID:s are compared as integers so that their padding does not matter
+        owned = set(DBCtrl.raw_int(fileid) for fileid in fileids)
+        prefix = directory if directory.endswith(os.sep) else (directory + os.sep)
+        for (_, fileid) in files_db.scan(prefix):
+            if DBCtrl.raw_int(DBCtrl.value_convert(fileid, CONVERT_INT)) not in owned:
+                return True
+        return False
+    
+    
     @staticmethod
     def value_convert(value, method):
         '''
@@ -412,3 +699,500 @@ class DBCtrl():
             value >>= 8
         return bytes(reversed(rc))
 
+
+
+class DBTransaction():
+    '''
+    Modifications to any number of databases that are applied at once
+    
+    The modifications are written to new delta segments, the segments are
+    published by renaming them into place after a journal of the renames
+    has been written, so that an interrupted commit can be completed by
+    `recover`.
+    '''
+    
+    def __init__(self, dbctrl):
+        '''
+        Constructor
+        
+        @param  dbctrl:DBCtrl  The database controller
+        '''
+        self.dbctrl = dbctrl
+        self.tables = {}
+    
+    
+    def insert(self, private, key, value, pairs):
+        '''
+        Insert, but do not override, values in a database
+        
+        @param  private:bool              Whether to modify a private database
+        @param  key:(str, int, int)       The key type of the database
+        @param  value:(str, int, int)     The value type of the database
+        @param  pairs:list<(str, bytes)>  Key–value-pairs
+        '''
+        operations = self.__operations(private, key, value)
+        for (k, v) in pairs:
+            operations.append((k, DELTA_INSERT, v))
+    
+    
+    def remove(self, private, key, value, keys):
+        '''
+        Remove all values for keys in a database
+        
+        @param  private:bool           Whether to modify a private database
+        @param  key:(str, int, int)    The key type of the database
+        @param  value:(str, int, int)  The value type of the database
+        @param  keys:itr<str>          Keys to remove
+        '''
+        operations = self.__operations(private, key, value)
+        for k in keys:
+            operations.append((k, DELTA_REMOVE, None))
+    
+    
+    def update(self, private, key, value, remove_keys, insert_pairs):
+        '''
+        Update a database by removing old keys and inserting new pairs
+        
+        @param  private:bool                     Whether to modify a private database
+        @param  key:(str, int, int)              The key type of the database
+        @param  value:(str, int, int)            The value type of the database
+        @param  remove_keys:itr<str>             Keys to remove
+        @param  insert_pairs:list<(str, bytes)>  Key–value pairs to insert
+        '''
+        self.remove(private, key, value, remove_keys)
+        self.insert(private, key, value, insert_pairs)
+    
+    
+    def commit(self):
+        '''
+        Apply all modifications, the transaction is empty afterwards
+        '''
+        tables = self.tables
+        self.tables = {}
+        if len(tables) == 0:
+            return
+        
+        # Make sure that the journal is empty, and exists so that it does not require the directory to be synchronised
+        (private, key, value) = list(tables.values())[0][:3]
+        path = (self.dbctrl.homepath if private else self.dbctrl.syspath).replace('%%', '%')
+        journal = path + DB_JOURNAL
+        if os.path.exists(journal):
+            DBTransaction.recover(path)
+        else:
+            if not os.path.exists(path):
+                dragonsuite.mkdir_p(path)
+            open(journal, 'wb').close()
+            DBTransaction.__sync([path])
+        
+        # Write delta segments
+        (dbs, renames) = ([], [])
+        try:
+            for (private, key, value, operations) in tables.values():
+                db = self.dbctrl.open_db(private, key, value, True)
+                renames += db.prepare(operations)
+                dbs.append(db)
+        except:
+            for (temporary, _) in renames:
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+            raise
+        
+        # Journal and publish delta segments
+        with open(journal, 'wb') as file:
+            for (temporary, final) in renames:
+                file.write(('%s\0%s\0' % (temporary, final)).encode('utf-8'))
+            file.write(bytes([0]))
+            file.flush()
+            os.fsync(file.fileno())
+        for (temporary, final) in renames:
+            os.rename(temporary, final)
+        DBTransaction.__sync(set(os.path.dirname(final) for (_, final) in renames))
+        open(journal, 'wb').close()
+        
+        # Compact delta segments that have grown too large
+        for db in dbs:
+            db.compact(False)
+    
+    
+    @staticmethod
+    def recover(path):
+        '''
+        Complete a commit that was interrupted after its journal was written, and empty the journal
+        
+        @param  path:str  The database directory, including a trailing directory separator
+        '''
+        journal = path + DB_JOURNAL
+        with open(journal, 'rb') as file:
+            data = file.read()
+        if data.endswith(bytes([0, 0])):
+            names = data[:-2].decode('utf-8').split('\0')
+            for i in range(0, len(names), 2):
+                if os.path.exists(names[i]):
+                    os.rename(names[i], names[i + 1])
+            DBTransaction.__sync(set(os.path.dirname(name) for name in names[1::2]))
+        with open(journal, 'wb') as file:
+            file.flush()
+            os.fsync(file.fileno())
+    
+    
+    def __operations(self, private, key, value):
+        '''
+        Gets the list of modifications for a database
+        
+        @param   private:bool               Whether the database is private
+        @param   key:(str, int, int)        The key type of the database
+        @param   value:(str, int, int)      The value type of the database
+        @return  :list<(str, int, bytes?)>  The modifications for the database
+        '''
+        table = (private, key[0], value[0])
+        if table not in self.tables:
+            self.tables[table] = (private, key, value, [])
+        return self.tables[table][3]
+    
+    
+    @staticmethod
+    def __sync(directories):
+        '''
+        Synchronise directories to the disc, so that renames in them are durable
+        
+        @param  directories:itr<str>  The directories
+        '''
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+
+class DBSnapshot():
+    '''
+    Generations of the databases, that give readers snapshot isolation from writers
+    
+    The database files are stored in numbered generation directories, in the
+    directory `DB_SNAPSHOTS` in the database directory, and the symbolic link
+    `DB_CURRENT` in that directory points to the current generation. A reader
+    pins the current generation with a shared lock on its pin file, and is
+    never blocked by writers. A writer creates a new generation by hard linking
+    the files of the current generation, modifies it, and publishes it by
+    replacing the symbolic link. Because the databases only replace files by
+    renaming new files over them, the files of older generations are never
+    modified. Generations that are not current and are not pinned are removed
+    when a generation is published.
+    
+    Writers lock the databases they modify, or all databases, so there may be
+    multiple writers at a time if they modify different databases. If another
+    generation has been published since a writer created its generation, the
+    writer publishes the files it modified on top of that generation instead.
+    
+    Before the first generation is published, the databases are read directly
+    from the database directory, and the first generation is created from them.
+    '''
+    
+    @staticmethod
+    def begin(prefix, exclusive, tables = None):
+        '''
+        Pin the current generation of the databases, or create a new generation
+        
+        @param  prefix:str        The prefix of the database files, as returned by `DBCtrl.prefixes`
+        @param  exclusive:bool    Whether to create a new generation, that is, you are about to do modifications
+        @param  tables:itr<str>?  The names of the locks, as returned by `DBCtrl.lock_name`, of the databases
+                                  that will be modified, `None` for all databases
+        '''
+        if prefix in DBSnapshot.pins:
+            return
+        directory = prefix + DB_SNAPSHOTS + os.sep
+        if exclusive:
+            try:
+                if not os.path.exists(directory):
+                    dragonsuite.mkdir_p(directory)
+            except OSError:
+                pass
+            if not os.access(directory, os.W_OK):
+                exclusive = False # You cannot modify these databases, so they are only read
+        if not exclusive:
+            DBSnapshot.pins[prefix] = DBSnapshot.__pin(prefix, directory)
+            return
+        locks = DBSnapshot.__lock(directory, tables)
+        current = DBSnapshot.__current(directory)
+        source = prefix if current is None else (directory + str(current) + os.sep)
+        (target, pin) = DBSnapshot.__create(directory, source)
+        DBSnapshot.pins[prefix] = (target, pin, DBSnapshot.__identity(source), locks)
+    
+    
+    @staticmethod
+    def end():
+        '''
+        Publish the created generations, and unpin the pinned generations
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        pins = DBSnapshot.pins
+        DBSnapshot.pins = {}
+        for prefix in pins:
+            (path, pin, identity, locks) = pins[prefix]
+            directory = prefix + DB_SNAPSHOTS + os.sep
+            fd = None
+            if identity is not None:
+                # Only one generation at a time may be published or removed
+                fd = os.open(directory, os.O_RDONLY)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                DBSnapshot.__publish(directory, path, identity)
+            if pin is not None:
+                fcntl.flock(pin.fileno(), fcntl.LOCK_UN)
+                pin.close()
+            if fd is not None:
+                DBSnapshot.__collect(directory)
+                os.close(fd)
+            for lock in reversed(locks):
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+                lock.close()
+    
+    
+    @staticmethod
+    def resolve(prefix):
+        '''
+        Gets the prefix of the database files in the pinned or created generation,
+        or in the current generation if none has been pinned or created
+        
+        @param   prefix:str  The prefix of the database files, as returned by `DBCtrl.prefixes`
+        @return  :str        The prefix of the database files in the generation
+        '''
+        if prefix in DBSnapshot.pins:
+            return DBSnapshot.pins[prefix][0]
+        directory = prefix + DB_SNAPSHOTS + os.sep
+        current = DBSnapshot.__current(directory)
+        return prefix if current is None else (directory + str(current) + os.sep)
+    
+    
+    
+    @staticmethod
+    def __pin(prefix, directory):
+        '''
+        Pin the current generation of the databases
+        
+        @param   prefix:str                       The prefix of the database files
+        @param   directory:str                    The snapshot directory, including a trailing directory separator
+        @return  :(str, file?, None, list<file>)  The prefix of the database files in the generation, the locked pin file,
+                                                  `None` if no generation has been published, `None` and no locks
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        while True:
+            current = DBSnapshot.__current(directory)
+            if current is None:
+                return (prefix, None, None, [])
+            pin = directory + str(current) + '.pin'
+            try:
+                file = open(pin, 'rb')
+            except FileNotFoundError:
+                continue # The generation was just replaced and removed
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+            # The generation may have been removed before it was pinned
+            try:
+                if os.path.samestat(os.fstat(file.fileno()), os.stat(pin)):
+                    return (directory + str(current) + os.sep, file, None, [])
+            except FileNotFoundError:
+                pass
+            file.close()
+    
+    
+    @staticmethod
+    def __lock(directory, tables):
+        '''
+        Lock databases for modifications
+        
+        @param   directory:str     The snapshot directory, including a trailing directory separator
+        @param   tables:itr<str>?  The names of the locks of the databases, `None` for all databases
+        @return  :list<file>       The locked lock files
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        rc = [open(directory + DB_LOCK, 'ab')]
+        fcntl.flock(rc[0].fileno(), fcntl.LOCK_EX if tables is None else fcntl.LOCK_SH)
+        # The locks are always taken in the same order so that writers cannot deadlock
+        for table in sorted(set(tables or [])):
+            rc.append(open(directory + table + '.lock', 'ab'))
+            fcntl.flock(rc[-1].fileno(), fcntl.LOCK_EX)
+        return rc
+    
+    
+    @staticmethod
+    def __create(directory, source):
+        '''
+        Create a new generation, from the files of another generation
+        
+        @param   directory:str  The snapshot directory, including a trailing directory separator
+        @param   source:str     The generation, or the database directory, to create the generation from
+        @return  :(str, file)   The created generation, including a trailing directory separator, and its locked pin file
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        while True:
+            generation = max([-1] + DBSnapshot.__generations(directory)) + 1
+            pin = directory + str(generation) + '.pin'
+            try:
+                file = open(pin, 'xb')
+            except FileExistsError:
+                continue # Another writer is creating the same generation
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+            # The pin may have been removed, before it was locked, by a writer removing old generations
+            try:
+                if os.path.samestat(os.fstat(file.fileno()), os.stat(pin)):
+                    os.mkdir(directory + str(generation))
+                    break
+            except (FileNotFoundError, FileExistsError):
+                pass
+            file.close()
+        target = directory + str(generation) + os.sep
+        for name in DBSnapshot.__files(source):
+            if name == DB_JOURNAL:
+                # The journal is modified in place, so it cannot be shared with other generations
+                shutil.copyfile(source + name, target + name)
+            else:
+                os.link(source + name, target + name)
+        return (target, file)
+    
+    
+    @staticmethod
+    def __publish(directory, target, identity):
+        '''
+        Publish a created generation, unless it was not modified
+        
+        @param  directory:str                        The snapshot directory, including a trailing directory separator
+        @param  target:str                           The created generation, including a trailing directory separator
+        @param  identity:dict<str, (int, int, int)>  The identity of the files the generation was created from
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        modified = DBSnapshot.__identity(target)
+        if modified == identity:
+            return
+        current = DBSnapshot.__current(directory)
+        source = None if current is None else (directory + str(current) + os.sep)
+        pin = None
+        if (source is not None) and (DBSnapshot.__identity(source) != identity):
+            # Another writer has published a generation, apply the modifications on top of it
+            (rebased, pin) = DBSnapshot.__create(directory, source)
+            for name in set(identity.keys()) | set(modified.keys()):
+                if identity.get(name, None) != modified.get(name, None):
+                    if os.path.lexists(rebased + name):
+                        os.unlink(rebased + name)
+                    if name in modified:
+                        os.link(target + name, rebased + name)
+            target = rebased
+        generation = os.path.basename(target[:-len(os.sep)])
+        DBSnapshot.__sync(target)
+        link = directory + DB_CURRENT
+        if os.path.lexists(link + '~'):
+            os.unlink(link + '~')
+        os.symlink(generation, link + '~')
+        os.rename(link + '~', link)
+        DBSnapshot.__sync(directory)
+        if pin is not None:
+            fcntl.flock(pin.fileno(), fcntl.LOCK_UN)
+            pin.close()
+    
+    
+    @staticmethod
+    def __collect(directory):
+        '''
+        Remove all generations that are neither current nor pinned
+        
+        @param  directory:str  The snapshot directory, including a trailing directory separator
+        '''
+        import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        current = DBSnapshot.__current(directory)
+        for generation in DBSnapshot.__generations(directory):
+            if generation == current:
+                continue
+            pin = directory + str(generation) + '.pin'
+            if os.path.exists(pin):
+                with open(pin, 'rb') as file:
+                    try:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue # The generation is being read or written
+                    # The pin is removed first so that no reader can pin the generation while it is removed
+                    os.unlink(pin)
+            if os.path.exists(directory + str(generation)):
+                shutil.rmtree(directory + str(generation))
+    
+    
+    @staticmethod
+    def __current(directory):
+        '''
+        Gets the current generation
+        
+        @param   directory:str  The snapshot directory, including a trailing directory separator
+        @return  :int?          The current generation, `None` if no generation has been published
+        '''
+        try:
+            return int(os.readlink(directory + DB_CURRENT))
+        except FileNotFoundError:
+            return None
+    
+    
+    @staticmethod
+    def __generations(directory):
+        '''
+        Gets all generations, including those that are not published and those that are only partially removed
+        
+        @param   directory:str  The snapshot directory, including a trailing directory separator
+        @return  :list<int>     The generations
+        '''
+        rc = set()
+        for name in os.listdir(directory):
+            if name.endswith('.pin'):
+                name = name[:-len('.pin')]
+            if name.isdigit():
+                rc.add(int(name))
+        return sorted(rc)
+    
+    
+    @staticmethod
+    def __files(prefix):
+        '''
+        Gets the names of all files with a prefix, these are the database files
+        
+        @param   prefix:str  The prefix of the files
+        @return  :list<str>  The names of the files, without the prefix
+        '''
+        (directory, base) = (os.path.dirname(prefix), os.path.basename(prefix))
+        if not os.path.exists(directory):
+            return []
+        rc = []
+        for name in os.listdir(directory):
+            if name.startswith(base) and os.path.isfile(directory + os.sep + name):
+                rc.append(name[len(base):])
+        return rc
+    
+    
+    @staticmethod
+    def __identity(prefix):
+        '''
+        Gets the identity of all files with a prefix, the journal is excluded
+        
+        @param   prefix:str                   The prefix of the files
+        @return  :dict<str, (int, int, int)>  Map from the name of each file to its device, inode and size
+        '''
+        rc = {}
+        for name in DBSnapshot.__files(prefix):
+            if name != DB_JOURNAL:
+                stat = os.stat(prefix + name)
+                rc[name] = (stat.st_dev, stat.st_ino, stat.st_size)
+        return rc
+    
+    
+    @staticmethod
+    def __sync(directory):
+        '''
+        Synchronise a directory to the disc, so that renames in it are durable
+        
+        @param  directory:str  The directory
+        '''
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+DBSnapshot.pins = {}
+
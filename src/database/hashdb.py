@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import mmap
+import shutil
+import hashlib
+
+from database.spikedb import *
+
+
+
+HASH_LOAD_FACTOR = 0.5
+'''
+The highest ratio of used slots to slots in the hash tables of hash indexed databases
+'''
+
+HASH_HEADER_LEN = 16
+'''
+The number of bytes in the header of a hash indexed database file, it holds the number of slots and the number of records
+'''
+
+
+
+class HashDB():
+    '''
+    Hash indexed Spike Database
+    
+    A Spike Database for point lookups, where the order of the keys is
+    not needed. Each database file is a hash table with open addressing
+    and linear probing, that is memory mapped when read, so a lookup
+    needs 𝓞(1) probes, each of which compares the stored key with the
+    padded key without decoding it.
+    
+    Like in `SpikeDB`, keys are stored in different files depending
+    on their length. Each slot begins with a byte that is 1 if the slot
+    is used, 0 if it is empty and 2 if its record has been removed,
+    followed by the key, padded with NUL:s, and the value. A key may have
+    multiple values, each in its own slot. The header holds the number
+    of slots and the number of slots that are not empty.
+    
+    Insertions and removals are written into the slots of a copy of the
+    database file, that is renamed over the old file, because the files
+    are shared between the generations of `DBSnapshot`. A database file
+    is instead rebuilt when it becomes too full, and by `prepare`.
+    Ordered scans read all records and sort them.
+    '''
+    
+    def __init__(self, file_pattern, value_len, load_factor = None):
+        '''
+        Constructor
+        
+        @param  file_pattern:str   The pattern for the database files, all ‘%’ should be duplicated after which it should include a ‘%i’ for internal use
+        @param  value_len:int      The length of values
+        @param  load_factor:float  The highest ratio of used slots to slots, `None` for `HASH_LOAD_FACTOR`
+        '''
+        self.file_pattern = file_pattern
+        self.value_len = value_len
+        self.load_factor = HASH_LOAD_FACTOR if load_factor is None else load_factor
+        self.maps = {}
+    
+    
+    def close(self):
+        '''
+        Unmap all database files that have been memory mapped
+        '''
+        for db in list(self.maps.keys()):
+            self.__unmap(db)
+    
+    
+    def destroy_database(self):
+        '''
+        Remove the entire database
+        '''
+        # Using DragonSuite.rm because it shred:s files if the user has enabled shred:ing
+        import dragonsuite
+        self.close()
+        for file in self.files():
+            dragonsuite.rm(file)
+    
+    
+    def list(self, rc):
+        '''
+        List all stored values
+        
+        @param   rc:append((str, bytes))→void  Sink to which to append found key–value-pairs
+        @return  rc:                           `rc` is returned, filled with `(key:str, value:bytes)`-pairs
+        '''
+        for pair in self.iter_items():
+            rc.append(pair)
+        return rc
+    
+    
+    def iter_items(self):
+        '''
+        Iterate over all stored values, the keys are not in any particular order
+        
+        @return  :itr<(str, bytes)>  `(key, value)`-pairs
+        '''
+        for lblen in range(32):
+            db = self.file_pattern % lblen
+            if os.path.exists(db):
+                for (key, value) in self.__records(db, 1 << lblen):
+                    yield (unpad_key(key, 1 << lblen), value)
+    
+    
+    def files(self):
+        '''
+        Gets all files associated with the database
+        
+        @return  :list<str>  All files associated with the database
+        '''
+        rc = []
+        for lblen in range(32):
+            db = self.file_pattern % lblen
+            rc += [file for file in (db, db + '~') if os.path.exists(file)]
+        return rc
+    
+    
+    def fetch(self, rc, keys):
+        '''
+        Looks up values in the database
+        
+        @param   rc:append((str, bytes?))→void  Sink to which to append found results
+        @param   keys:list<str>                 Keys for which to search, each key is only looked up once
+        @return  rc:                            `rc` is returned, filled with `(key:str, value:bytes?)`-pairs. `value` is `None` when not found
+        '''
+        for (lblen, keys) in HashDB.__buckets(unique(sorted(keys))).items():
+            db = self.file_pattern % lblen
+            mapping = self.__map(db)
+            maxlen = 1 << lblen
+            for key in keys:
+                found = False
+                if mapping is not None:
+                    for pos in self.__probe(mapping, maxlen, pad_key(key, maxlen)):
+                        rc.append((key, mapping[pos + 1 + maxlen : pos + 1 + maxlen + self.value_len].tobytes()))
+                        found = True
+                if not found:
+                    rc.append((key, None))
+        return rc
+    
+    
+    def iter_fetch(self, keys):
+        '''
+        Looks up values, in key order
+        
+        @param   keys:itr<str>        Keys for which to search
+        @return  :itr<(str, bytes?)>  `(key, value)`-pairs, `value` is `None` when not found
+        '''
+        sink = self.fetch([], keys)
+        sink.sort(key = lambda pair : pair[0])
+        for pair in sink:
+            yield pair
+    
+    
+    def scan(self, prefix = None, start = None, end = None):
+        '''
+        Iterate, in key order, over the stored values whose keys are within a range,
+        the keys are not ordered in the files, so all records are read
+        
+        @param   prefix:str?         Only include keys that start with this string
+        @param   start:str?          Only include keys that are not less than this key
+        @param   end:str?            Only include keys that are less than this key
+        @return  :itr<(str, bytes)>  `(key, value)`-pairs
+        '''
+        pairs = []
+        for (key, value) in self.iter_items():
+            if (start is not None) and (key < start):
+                continue
+            if (end is not None) and (key >= end):
+                continue
+            if (prefix is not None) and not key.startswith(prefix):
+                continue
+            pairs.append((key, value))
+        pairs.sort(key = lambda pair : pair[0])
+        for pair in pairs:
+            yield pair
+    
+    
+    def remove(self, rc, keys):
+        '''
+        Remove all values for keys in the database
+        
+        @param   rc:append(str)→void  Sink on which to append unfound keys
+        @param   keys:list<str>       Keys to remove
+        @return  rc:                  `rc` is returned
+        '''
+        for (lblen, keys) in HashDB.__buckets(unique(sorted(keys))).items():
+            db = self.file_pattern % lblen
+            mapping = self.__map(db)
+            maxlen = 1 << lblen
+            slots = []
+            for key in keys:
+                found = [] if mapping is None else list(self.__probe(mapping, maxlen, pad_key(key, maxlen)))
+                if len(found) == 0:
+                    rc.append(key)
+                slots += found
+            if len(slots) > 0:
+                with self.__copy(db) as file:
+                    for pos in slots:
+                        file.seek(pos, 0) # 0 means from the start of the stream
+                        file.write(bytes([2]))
+                self.__replace(db)
+        return rc
+    
+    
+    def insert(self, pairs):
+        '''
+        Insert, but do not override, values in the database
+        
+        @param  pairs:list<(str, bytes)>  Key–value-pairs, all values must be of same length
+        '''
+        for (lblen, pairs) in HashDB.__buckets(pairs, lambda pair : pair[0]).items():
+            db = self.file_pattern % lblen
+            mapping = self.__map(db)
+            maxlen = 1 << lblen
+            if mapping is None:
+                (slots, nonempty) = (0, 0)
+            else:
+                (slots, nonempty) = (int.from_bytes(mapping[:8], 'big'), int.from_bytes(mapping[8 : HASH_HEADER_LEN], 'big'))
+            if (nonempty + len(pairs) > slots * self.load_factor) or (nonempty + len(pairs) >= slots):
+                # The file is too full, or does not exist, so it is rewritten without removed records,
+                # at least one slot must be empty for probing to terminate
+                (temporary, final) = self.prepare([(key, DELTA_INSERT, value) for (key, value) in pairs])[0]
+                self.__unmap(final)
+                os.rename(temporary, final)
+                continue
+            slotlen = 1 + maxlen + self.value_len
+            taken = set()
+            with self.__copy(db) as file:
+                for (key, value) in pairs:
+                    key = pad_key(key, maxlen)
+                    slot = HashDB.__hash(key) & (slots - 1)
+                    while (mapping[HASH_HEADER_LEN + slot * slotlen] == 1) or (slot in taken):
+                        slot = (slot + 1) & (slots - 1)
+                    pos = HASH_HEADER_LEN + slot * slotlen
+                    if mapping[pos] == 0:
+                        nonempty += 1
+                    taken.add(slot)
+                    file.seek(pos, 0) # 0 means from the start of the stream
+                    file.write(bytes([1]) + key + value)
+                file.seek(8, 0)
+                file.write(nonempty.to_bytes(8, 'big'))
+            self.__replace(db)
+    
+    
+    def make(self, pairs):
+        '''
+        Build the database from the ground
+        
+        @param  pairs:list<(str, bytes)>  Key–value-pairs, all values must be of same length
+        '''
+        for (lblen, pairs) in HashDB.__buckets(pairs, lambda pair : pair[0]).items():
+            db = self.file_pattern % lblen
+            maxlen = 1 << lblen
+            self.__write(db + '~', maxlen, [(pad_key(key, maxlen), value) for (key, value) in pairs])
+            self.__unmap(db)
+            os.rename(db + '~', db)
+    
+    
+    def prepare(self, operations):
+        '''
+        Write, but do not publish, the database files with modifications applied, this is used to
+        apply modifications on multiple databases at once
+        
+        @param   operations:list<(str, int, bytes?)>  The key, operation (`DELTA_INSERT` or `DELTA_REMOVE`) and value (`None` for removals) of each modification, in order
+        @return  :list<(str, str)>                    The written files and the filenames they should be renamed to, to publish the modifications
+        '''
+        rc = []
+        for (lblen, operations) in HashDB.__buckets(operations, lambda operation : operation[0]).items():
+            db = self.file_pattern % lblen
+            maxlen = 1 << lblen
+            values = {}
+            if os.path.exists(db):
+                for (key, value) in self.__records(db, maxlen):
+                    if key not in values:
+                        values[key] = []
+                    values[key].append(value)
+            for (key, op, value) in operations:
+                key = pad_key(key, maxlen)
+                if op == DELTA_REMOVE:
+                    values.pop(key, None)
+                else:
+                    if key not in values:
+                        values[key] = []
+                    values[key].append(value)
+            self.__write(db + '~', maxlen, [(key, value) for key in values for value in values[key]])
+            rc.append((db + '~', db))
+        return rc
+    
+    
+    def compact(self, forced = True):
+        '''
+        Does nothing, modifications are always written to the database files, this exists for compatibility with `SpikeDB`
+        
+        @param  forced:bool  Ignored
+        '''
+        pass
+    
+    
+    
+    def __map(self, db):
+        '''
+        Gets a read-only memory map of a database file, each file is only mapped once
+        as long as it is not modified
+        
+        @param   db:str        The database file
+        @return  :memoryview?  The content of the file, `None` if it does not exist
+        '''
+        try:
+            stat = os.stat(db)
+        except:
+            return None
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if db in self.maps:
+            if self.maps[db][0] == identity:
+                return self.maps[db][2]
+            self.__unmap(db)
+        with open(db, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        self.maps[db] = (identity, mapping, view)
+        return view
+    
+    
+    def __unmap(self, db):
+        '''
+        Unmap a database file if it has been memory mapped, this must be done before the file is modified
+        
+        @param  db:str  The database file
+        '''
+        if db in self.maps:
+            (_, mapping, view) = self.maps[db]
+            del self.maps[db]
+            try:
+                view.release()
+                mapping.close()
+            except BufferError:
+                pass # Slices of the map are still in use, it will be unmapped when they are released
+    
+    
+    @staticmethod
+    def __copy(db):
+        '''
+        Copy a database file, so that the copy can be modified without modifying
+        the generations of the databases that share the file
+        
+        @param   db:str  The database file
+        @return  :file   The copy, opened for modification, `__replace` should be called after it has been closed
+        '''
+        shutil.copyfile(db, db + '~')
+        return open(db + '~', 'r+b')
+    
+    
+    def __replace(self, db):
+        '''
+        Replace a database file with its modified copy
+        
+        @param  db:str  The database file
+        '''
+        with open(db + '~', 'rb') as file:
+            os.fsync(file.fileno())
+        self.__unmap(db)
+        os.rename(db + '~', db)
+    
+    
+    def __probe(self, mapping, maxlen, key):
+        '''
+        Find the records of a key in a memory mapped database file
+        
+        @param   mapping:memoryview  The content of the database file
+        @param   maxlen:int          The length of keys
+        @param   key:bytes           The padded key
+        @return  :itr<int>           The positions of the slots of the key's records
+        '''
+        slots = int.from_bytes(mapping[:8], 'big')
+        slotlen = 1 + maxlen + self.value_len
+        slot = HashDB.__hash(key) & (slots - 1)
+        while True:
+            pos = HASH_HEADER_LEN + slot * slotlen
+            if mapping[pos] == 0:
+                break
+            if (mapping[pos] == 1) and (mapping[pos + 1 : pos + 1 + maxlen] == key):
+                yield pos
+            slot = (slot + 1) & (slots - 1)
+    
+    
+    def __records(self, db, maxlen):
+        '''
+        Iterate over all records in a database file, in slot order
+        
+        @param   db:str                The database file
+        @param   maxlen:int            The length of keys
+        @return  :itr<(bytes, bytes)>  The padded key and the value of each record
+        '''
+        slotlen = 1 + maxlen + self.value_len
+        with open(db, 'rb') as file:
+            data = file.read()
+        for pos in range(HASH_HEADER_LEN, len(data) - slotlen + 1, slotlen):
+            if data[pos] == 1:
+                yield (data[pos + 1 : pos + 1 + maxlen], data[pos + 1 + maxlen : pos + slotlen])
+    
+    
+    def __write(self, file, maxlen, records):
+        '''
+        Write a database file
+        
+        @param  file:str                      The file to write
+        @param  maxlen:int                    The length of keys
+        @param  records:list<(bytes, bytes)>  The padded key and the value of each record
+        '''
+        slots = 8
+        while len(records) > slots * self.load_factor:
+            slots <<= 1
+        if len(records) == slots:
+            slots <<= 1 # At least one slot must be empty for probing to terminate
+        slotlen = 1 + maxlen + self.value_len
+        table = bytearray(HASH_HEADER_LEN + slots * slotlen)
+        table[:HASH_HEADER_LEN] = slots.to_bytes(8, 'big') + len(records).to_bytes(8, 'big')
+        for (key, value) in records:
+            slot = HashDB.__hash(key) & (slots - 1)
+            while table[HASH_HEADER_LEN + slot * slotlen] != 0:
+                slot = (slot + 1) & (slots - 1)
+            pos = HASH_HEADER_LEN + slot * slotlen
+            table[pos : pos + slotlen] = bytes([1]) + key + value
+        with open(file, 'wb') as wfile:
+            wfile.write(table)
+            wfile.flush()
+            os.fsync(wfile.fileno())
+    
+    
+    @staticmethod
+    def __buckets(items, key = None):
+        '''
+        Group items by the binary logarithm of the length of their keys
+        
+        @param   items:itr<¿E?>         The items
+        @param   key:(¿E?)→str          Function that gets the key of an item, `None` if the items are keys
+        @return  :dict<int, list<¿E?>>  Map from binary logarithm of key length to items
+        '''
+        buckets = {}
+        for item in items:
+            k = item if key is None else key(item)
+            lblen = lb32(len(k))
+            if (1 << lblen) < len(k):
+                lblen += 1
+            if lblen not in buckets:
+                buckets[lblen] = [item]
+            else:
+                buckets[lblen].append(item)
+        return buckets
+    
+    
+    @staticmethod
+    def __hash(key):
+        '''
+        Calculate the hash of a padded key
+        
+        @param   key:bytes  The padded key
+        @return  :int       The hash of the key
+        '''
+        return int.from_bytes(hashlib.blake2b(key, digest_size = 8).digest(), 'big')
+
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import sys
+import os
+import bisect
+from array import array
+
+from database.spikedb import *
+
+
+
+INTDB_HEADER_LEN = 8
+'''
+The number of bytes in the header of an integer keyed database file, it holds the number of records
+'''
+
+
+
+class IntDB():
+    '''
+    Integer keyed Spike Database
+    
+    A Spike Database for fixed-width integer keys, such as file ID:s and
+    scroll ID:s. The keys are stored as a sorted column of integers,
+    followed by a parallel column of values, so no padding, length
+    classes or initials are needed.
+    
+    Keys may be given as integers, or as big-endian raw integers stored
+    in strings or byte arrays. Keys that are read from the database are
+    returned as raw integer strings without leading NUL:s, the form
+    `DBCtrl.value_convert` gives them, so they can be looked up in the
+    other storage engines.
+    
+    As in `SpikeDB`, modifications are not written to the database file
+    directly, they are written to small sorted delta segments
+    (‘<file>.delta.<n>’) that are merged with the database file when it
+    is read, and folded into the database file when they grow too large
+    or when `compact` is called.
+    '''
+    
+    def __init__(self, file, key_len, value_len):
+        '''
+        Constructor
+        
+        @param  file:str       The database file
+        @param  key_len:int    The length of keys, in bytes
+        @param  value_len:int  The length of values
+        '''
+        self.file = file
+        self.key_len = key_len
+        self.value_len = value_len
+        self.typecode = None
+        for typecode in 'BHILQ':
+            if array(typecode).itemsize == key_len:
+                self.typecode = typecode
+                break
+        if self.typecode is None:
+            raise Exception('No integer type is %i bytes wide' % key_len)
+        self.cache = None
+        self.changes = None
+    
+    
+    def close(self):
+        '''
+        Forget the cached database file and delta segments
+        '''
+        self.cache = None
+        self.changes = None
+    
+    
+    def destroy_database(self):
+        '''
+        Remove the entire database
+        '''
+        # Using DragonSuite.rm because it shred:s files if the user has enabled shred:ing
+        import dragonsuite
+        self.close()
+        for file in self.files():
+            dragonsuite.rm(file)
+    
+    
+    def list(self, rc):
+        '''
+        List all stored values
+        
+        @param   rc:append((str, bytes))→void  Sink to which to append found key–value-pairs
+        @return  rc:                           `rc` is returned, filled with `(key:str, value:bytes)`-pairs
+        '''
+        for pair in self.iter_items():
+            rc.append(pair)
+        return rc
+    
+    
+    def iter_items(self):
+        '''
+        Iterate over all stored values, in key order
+        
+        @return  :itr<(str, bytes)>  `(key, value)`-pairs
+        '''
+        for (key, value) in self.__merged():
+            yield (IntDB.__raw(key), value)
+    
+    
+    def files(self):
+        '''
+        Gets all files associated with the database
+        
+        @return  :list<str>  All files associated with the database
+        '''
+        deltas = delta_segments(self.file)
+        rc = ([self.file] if os.path.exists(self.file) else []) + deltas
+        for leftover in (self.file + '.folding', self.file + '.folded', '%s.delta.%i~' % (self.file, len(deltas))):
+            if os.path.exists(leftover):
+                rc.append(leftover)
+        return rc
+    
+    
+    def fetch(self, rc, keys):
+        '''
+        Looks up values in the database
+        
+        @param   rc:append((str, bytes?))→void  Sink to which to append found results
+        @param   keys:itr<int|str|bytes>        Keys for which to search
+        @return  rc:                            `rc` is returned, filled with `(key, value:bytes?)`-pairs, `value` is `None` when not found
+        '''
+        (keys_, values) = self.__load()
+        changes = self.__changes()
+        valuelen = self.value_len
+        # The keys are sorted so that each search can start where the previous ended
+        (lo, last) = (0, None)
+        for (ikey, key) in sorted(((IntDB.__int(key), key) for key in keys), key = lambda pair : pair[0]):
+            if ikey == last:
+                continue # Each key is only looked up once, as in `SpikeDB`
+            last = ikey
+            lo = bisect.bisect_left(keys_, ikey, lo)
+            hi = bisect.bisect_right(keys_, ikey, lo)
+            found = [values[i * valuelen : (i + 1) * valuelen] for i in range(lo, hi)]
+            if ikey in changes:
+                found = apply_operations(found, changes[ikey])
+            if len(found) == 0:
+                rc.append((key, None))
+            for value in found:
+                rc.append((key, value))
+        return rc
+    
+    
+    def iter_fetch(self, keys):
+        '''
+        Looks up values, in key order
+        
+        @param   keys:itr<int|str|bytes>  Keys for which to search
+        @return  :itr<(str, bytes?)>      `(key, value)`-pairs, `value` is `None` when not found
+        '''
+        for pair in self.fetch([], keys):
+            yield pair
+    
+    
+    def remove(self, rc, keys):
+        '''
+        Remove all values for keys in the database
+        
+        @param   rc:append(str)→void      Sink on which to append unfound keys
+        @param   keys:itr<int|str|bytes>  Keys to remove
+        @return  rc:                      `rc` is returned
+        '''
+        operations = []
+        for (key, value) in self.fetch([], keys):
+            if value is None:
+                rc.append(key)
+            else:
+                operations.append((key, DELTA_REMOVE, None))
+        if len(operations) > 0:
+            os.rename(*self.prepare(operations)[0])
+            self.compact(False)
+        return rc
+    
+    
+    def insert(self, pairs):
+        '''
+        Insert, but do not override, values in the database
+        
+        @param  pairs:list<(int|str|bytes, bytes)>  Key–value-pairs, all values must be of same length
+        '''
+        if len(pairs) > 0:
+            os.rename(*self.prepare([(key, DELTA_INSERT, value) for (key, value) in pairs])[0])
+            self.compact(False)
+    
+    
+    def make(self, pairs):
+        '''
+        Build the database from the ground
+        
+        @param  pairs:list<(int|str|bytes, bytes)>  Key–value-pairs, all values must be of same length
+        '''
+        recover_folded(self.file)
+        records = sorted(((IntDB.__int(pairs[i][0]), i) for i in range(len(pairs))))
+        keys = array(self.typecode, [key for (key, _) in records])
+        values = b''.join(pairs[i][1] for (_, i) in records)
+        self.__write(self.file + '.folded', keys, values)
+        replace_folded(self.file, self.file + '.folded', len(delta_segments(self.file)))
+    
+    
+    def prepare(self, operations):
+        '''
+        Write, but do not publish, a delta segment for modifications, this is used to
+        apply modifications on multiple databases at once
+        
+        @param   operations:list<(int|str|bytes, int, bytes?)>  The key, operation (`DELTA_INSERT` or `DELTA_REMOVE`) and value (`None` for removals) of each modification, in order
+        @return  :list<(str, str)>                              The written file and the filename it should be renamed to, to publish the modifications
+        '''
+        recover_folded(self.file)
+        # Sorting is stable, so the operations on a key keep their order
+        records = sorted(((IntDB.__int(key), op, value) for (key, op, value) in operations), key = lambda record : record[0])
+        blank = bytes(self.value_len)
+        delta = '%s.delta.%i' % (self.file, len(delta_segments(self.file)))
+        with open(delta + '~', 'wb') as file:
+            for (key, op, value) in records:
+                file.write(key.to_bytes(self.key_len, 'big'))
+                file.write(blank if value is None else value)
+                file.write(bytes([op]))
+            file.flush()
+            os.fsync(file.fileno())
+        return [(delta + '~', delta)]
+    
+    
+    def compact(self, forced = True):
+        '''
+        Fold the delta segments into the database file
+        
+        @param  forced:bool  Whether to fold the delta segments even if they have not grown too large
+        '''
+        recover_folded(self.file)
+        deltas = delta_segments(self.file)
+        if len(deltas) == 0:
+            return
+        if not forced:
+            pending = sum(os.stat(delta).st_size for delta in deltas) // (self.key_len + self.value_len + 1)
+            present = len(self.__load()[0])
+            if (len(deltas) <= DELTA_MAX_SEGMENTS) and (pending * DELTA_MAX_RATIO <= present):
+                return
+        (keys, values) = (array(self.typecode), [])
+        for (key, value) in self.__merged():
+            keys.append(key)
+            values.append(value)
+        self.__write(self.file + '.folded', keys, b''.join(values))
+        replace_folded(self.file, self.file + '.folded', len(deltas))
+        self.close()
+    
+    
+    
+    def __load(self):
+        '''
+        Read the database file, unless it has not changed since it was last read
+        
+        @return  :(array<int>, bytes)  The keys, in sorted order, and the values, concatenated in the same order
+        '''
+        if not os.path.exists(self.file):
+            return (array(self.typecode), b'')
+        stat = os.stat(self.file)
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if (self.cache is not None) and (self.cache[0] == identity):
+            return self.cache[1]
+        keys = array(self.typecode)
+        with open(self.file, 'rb') as file:
+            count = int.from_bytes(file.read(INTDB_HEADER_LEN), 'big')
+            keys.fromfile(file, count)
+            values = file.read(count * self.value_len)
+        if sys.byteorder != 'little':
+            keys.byteswap()
+        self.cache = (identity, (keys, values))
+        return self.cache[1]
+    
+    
+    def __changes(self):
+        '''
+        Read the operations in the delta segments, unless they have not changed since they were last read
+        
+        @return  :dict<int, list<(int, bytes)>>  Map from key to operations and values, in order of operation
+        '''
+        deltas = delta_segments(self.file)
+        identity = []
+        for delta in deltas:
+            stat = os.stat(delta)
+            identity.append((stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        if (self.changes is not None) and (self.changes[0] == identity):
+            return self.changes[1]
+        rc = {}
+        (keylen, valuelen) = (self.key_len, self.value_len)
+        reclen = keylen + valuelen + 1
+        for delta in deltas:
+            with open(delta, 'rb') as file:
+                data = file.read()
+            for pos in range(0, len(data) - reclen + 1, reclen):
+                key = int.from_bytes(data[pos : pos + keylen], 'big')
+                if key not in rc:
+                    rc[key] = []
+                rc[key].append((data[pos + reclen - 1], data[pos + keylen : pos + reclen - 1]))
+        self.changes = (identity, rc)
+        return rc
+    
+    
+    def __merged(self):
+        '''
+        Iterate over all records in the database file, in key order, with the delta segments applied
+        
+        @return  :itr<(int, bytes)>  The key and value of each record
+        '''
+        (keys, values) = self.__load()
+        changes = self.__changes()
+        valuelen = self.value_len
+        pos = 0
+        for ikey in sorted(changes.keys()):
+            # Copy unmodified records before the key
+            lo = bisect.bisect_left(keys, ikey, pos)
+            hi = bisect.bisect_right(keys, ikey, lo)
+            for i in range(pos, lo):
+                yield (keys[i], values[i * valuelen : (i + 1) * valuelen])
+            current = [values[i * valuelen : (i + 1) * valuelen] for i in range(lo, hi)]
+            for value in apply_operations(current, changes[ikey]):
+                yield (ikey, value)
+            pos = hi
+        for i in range(pos, len(keys)):
+            yield (keys[i], values[i * valuelen : (i + 1) * valuelen])
+    
+    
+    def __write(self, file, keys, values):
+        '''
+        Write a database file
+        
+        @param  file:str         The file to write
+        @param  keys:array<int>  The keys, in sorted order
+        @param  values:bytes     The values, concatenated in the same order as the keys
+        '''
+        if sys.byteorder != 'little':
+            keys = array(self.typecode, keys)
+            keys.byteswap()
+        with open(file, 'wb') as wfile:
+            wfile.write(len(keys).to_bytes(INTDB_HEADER_LEN, 'big'))
+            keys.tofile(wfile)
+            wfile.write(values)
+            wfile.flush()
+            os.fsync(wfile.fileno())
+    
+    
+    @staticmethod
+    def __raw(key):
+        '''
+        Convert an integer key to a raw integer stored in a string
+        
+        @param   key:int  The key
+        @return  :str     The key as a raw integer string without leading NUL:s, zero is a single NUL
+        '''
+        return key.to_bytes(max(1, (key.bit_length() + 7) >> 3), 'big').decode('latin-1')
+    
+    
+    @staticmethod
+    def __int(key):
+        '''
+        Convert a key to an integer
+        
+        @param   key:int|str|bytes  The key, as an integer or as a big-endian raw integer
+        @return  :int               The key as an integer
+        '''
+        if isinstance(key, int):
+            return key
+        if isinstance(key, str):
+            key = key.encode('latin-1')
+        return int.from_bytes(key, 'big')
+
@@ -20,6 +20,14 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import sys
 import os
+import mmap
+import math
+import heapq
+import bisect
+import hashlib
+import itertools
+from array import array
+from collections import OrderedDict
 
 from algorithmic.algospike import *
 
@@ -30,6 +38,62 @@ INITIALS_LEN = 4
 The number of characters accounted for in the initials which are used to speed up searches
 '''
 
+READ_MAPPED = True
+'''
+Whether database files should be memory mapped, rather than read block by block, when looking up values
+'''
+
+PAGE_CACHE_SIZE = 8 << 20
+'''
+The number of bytes the page cache, that is shared by all databases, may use
+'''
+
+BLOOM_ERROR = 0.01
+'''
+The false positive rate of the Bloom filters that are used to rule out keys without searching the database files
+'''
+
+BLOOM_FORMAT = 1
+'''
+The version of the format of stored Bloom filters, filters in other formats are not used
+'''
+
+FETCH_BATCH = 4096
+'''
+The number of keys that are looked up at a time by `SpikeDB.iter_fetch`
+'''
+
+BULK_RUN_LEN = 1 << 17
+'''
+The number of key–value-pairs that `SpikeDB.bulk_load` sorts in memory at a time, larger inputs are merged from sorted temporary files
+'''
+
+BULK_BUFFER = 1 << 20
+'''
+The number of bytes `SpikeDB.bulk_load` buffers when writing and reading files
+'''
+
+DELTA_MAX_SEGMENTS = 16
+'''
+The number of delta segments a database file may have before they are compacted into the database file
+'''
+
+DELTA_MAX_RATIO = 8
+'''
+Delta segments are compacted into their database file when they hold more records than
+the database file divided by this number
+'''
+
+DELTA_REMOVE = 0
+'''
+Delta segment operation: remove all values associated with the key
+'''
+
+DELTA_INSERT = 1
+'''
+Delta segment operation: associate a value with the key
+'''
+
 
 
 class SpikeDB():
@@ -44,17 +108,38 @@ class SpikeDB():
     
     Spike Database can only do act as a string to bytes map, with
     a fixed value size.
+    
+    Modifications are not written to the database files directly, they
+    are appended to small sorted delta segments (‘<file>.delta.<n>’)
+    that are merged with the database file when it is read, and folded
+    into the database file when they grow too large or when `compact`
+    is called.
     '''
     
-    def __init__(self, file_pattern, value_len):
+    def __init__(self, file_pattern, value_len, mapped = None, bloom_error = None):
         '''
         Constructor
         
-        @param  file_pattern:str  The pattern for the database files, all ‘%’ should be duplicated after which it should include a ‘%i’ for internal use
-        @param  value_len:int     The length of values
+        @param  file_pattern:str   The pattern for the database files, all ‘%’ should be duplicated after which it should include a ‘%i’ for internal use
+        @param  value_len:int      The length of values
+        @param  mapped:bool?       Whether to memory map the database files when reading, `None` for `READ_MAPPED`
+        @param  bloom_error:float  The false positive rate of the Bloom filters, `None` for `BLOOM_ERROR`, 0 to not use Bloom filters
         '''
         self.file_pattern = file_pattern
         self.value_len = value_len
+        self.mapped = READ_MAPPED if mapped is None else mapped
+        self.bloom_error = BLOOM_ERROR if bloom_error is None else bloom_error
+        self.maps = {}
+        self.blooms = {}
+        self.offsets = {}
+    
+    
+    def close(self):
+        '''
+        Unmap all database files that have been memory mapped
+        '''
+        for db in list(self.maps.keys()):
+            self.__unmap(db)
     
     
     
@@ -64,10 +149,11 @@ class SpikeDB():
         '''
         # Using DragonSuite.rm because it shred:s files if the user has enabled shred:ing
         import dragonsuite
+        self.close()
         for lblen in range(64):
             db = self.file_pattern % lblen
-            if os.path.exists(db):
-                dragonsuite.rm(db)
+            for file in SpikeDB.__associated(db):
+                dragonsuite.rm(file)
     
     
     def list(self, rc):
@@ -77,19 +163,27 @@ class SpikeDB():
         @param   rc:append((str, bytes))→void  Sink to which to append found key–value-pairs
         @return  rc:                           `rc` is returned, filled with `(key:str, value:bytes)`-pairs
         '''
-        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
+        for pair in self.iter_items():
+            rc.append(pair)
+        return rc
+    
+    
+    def iter_items(self):
+        '''
+        Iterate over all stored values, by initials and then by key, without loading them all into memory
+        
+        @return  :itr<(str, bytes)>  `(key, value)`-pairs
+        '''
+        streams = []
         for lblen in range(32):
             db = self.file_pattern % lblen
-            if os.path.exists(db):
-                devblocksize = SpikeDB.__lb_blocksize(db)
-                with open(db, 'rb') as file:
-                    keyvallen = (1 << lblen) + self.value_len
-                    amount = os.stat(os.path.realpath(db)).st_size
-                    amount = (amount - masterseeklen) // keyvallen
-                    blist = Blocklist(file, devblocksize, masterseeklen, keyvallen, 1 << lblen, amount)
-                    for i in range(amount):
-                        rc.append((blist.get_key(i), blist.get_value(i)))
-        return rc
+            recover_folded(db)
+            deltas = delta_segments(db)
+            if (len(deltas) > 0) or os.path.exists(db):
+                streams.append(self.__merged(db, 1 << lblen, deltas))
+        # The files are sorted by initials before keys, so they are merged in that order
+        for (_, key, value) in heapq.merge(*streams, key = lambda record : record[:2]):
+            yield (key, value)
     
     
     def files(self):
@@ -100,9 +194,7 @@ class SpikeDB():
         '''
         rc = []
         for lblen in range(32):
-            db = self.file_pattern % lblen
-            if os.path.exists(db):
-                rc.append(db)
+            rc += SpikeDB.__associated(self.file_pattern % lblen)
         return rc
     
     
@@ -127,15 +219,54 @@ class SpikeDB():
             else:
                 buckets[lblen].append(key)
         for lblen in buckets:
-            filename = self.file_pattern % lblen
-            if os.path.exists(filename):
-                SpikeDB.__fetch(rc, filename, 1 << lblen, buckets[lblen], self.value_len)
-            else:
-                for key in buckets[lblen]:
-                    rc.append((key, None))
+            self.__lookup(rc, self.file_pattern % lblen, 1 << lblen, buckets[lblen])
         return rc
     
     
+    def scan(self, prefix = None, start = None, end = None):
+        '''
+        Iterate, by initials and then by key, over the stored values whose keys are within a range
+        
+        @param   prefix:str?         Only include keys that start with this string
+        @param   start:str?          Only include keys that are not less than this key
+        @param   end:str?            Only include keys that are less than this key
+        @return  :itr<(str, bytes)>  `(key, value)`-pairs
+        '''
+        if prefix is not None:
+            # The keys that start with the prefix are those from the prefix up to its successor
+            if (start is None) or (start < prefix):
+                start = prefix
+            if len(prefix) > 0:
+                successor = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                if (end is None) or (successor < end):
+                    end = successor
+        streams = []
+        for lblen in range(32):
+            db = self.file_pattern % lblen
+            recover_folded(db)
+            deltas = delta_segments(db)
+            if (len(deltas) > 0) or os.path.exists(db):
+                streams.append(self.__merged(db, 1 << lblen, deltas, start, end))
+        # The files are sorted by initials before keys, so the range is searched for in each initials
+        for (_, key, value) in heapq.merge(*streams, key = lambda record : record[:2]):
+            yield (key, value)
+    
+    
+    def iter_fetch(self, keys):
+        '''
+        Looks up values, in key order, a batch of `FETCH_BATCH` keys at a time
+        
+        @param   keys:itr<str>        Keys for which to search
+        @return  :itr<(str, bytes?)>  `(key, value)`-pairs, `value` is `None` when not found
+        '''
+        keys = unique(sorted(keys))
+        for i in range(0, len(keys), FETCH_BATCH):
+            sink = self.fetch([], keys[i : i + FETCH_BATCH])
+            sink.sort(key = lambda pair : pair[0])
+            for pair in sink:
+                yield pair
+    
+    
     def remove(self, rc, keys):
         '''
         Looks up values in a file
@@ -158,11 +289,15 @@ class SpikeDB():
                 buckets[lblen].append(key)
         for lblen in buckets:
             filename = self.file_pattern % lblen
-            if os.path.exists(filename):
-                SpikeDB.__remove(rc, filename, 1 << lblen, buckets[lblen], self.value_len)
-            else:
-                for key in buckets[lblen]:
+            found = []
+            for (key, value) in self.__lookup([], filename, 1 << lblen, buckets[lblen]):
+                if value is None:
                     rc.append(key)
+                elif (len(found) == 0) or (found[-1] != key):
+                    found.append(key)
+            if len(found) > 0:
+                os.rename(*SpikeDB.__write_delta(filename, 1 << lblen, self.value_len, [(key, DELTA_REMOVE, None) for key in found]))
+                self.__consider_folding(filename, 1 << lblen)
         return rc
     
     
@@ -185,10 +320,14 @@ class SpikeDB():
                 buckets[lblen].append(pair)
         for lblen in buckets:
             filename = self.file_pattern % lblen
-            if os.path.exists(filename):
-                SpikeDB.__insert(filename, 1 << lblen, self.value_len, buckets[lblen])
+            recover_folded(filename)
+            if (len(delta_segments(filename)) == 0) and not os.path.exists(filename):
+                bloom = self.__new_bloom(len(buckets[lblen]))
+                SpikeDB.__make(filename, 1 << lblen, buckets[lblen], bloom)
+                self.__store_bloom(filename, bloom)
             else:
-                SpikeDB.__make(filename, 1 << lblen, buckets[lblen])
+                os.rename(*SpikeDB.__write_delta(filename, 1 << lblen, self.value_len, [(key, DELTA_INSERT, value) for (key, value) in buckets[lblen]]))
+                self.__consider_folding(filename, 1 << lblen)
     
     
     def make(self, pairs):
@@ -199,19 +338,447 @@ class SpikeDB():
         @param-  maxlen:int                The length of keys
         @param   pairs:list<(str, bytes)>  Key–value-pairs, all values must be of same length
         '''
+        self.bulk_load(pairs)
+    
+    
+    def bulk_load(self, pairs, presorted = False):
+        '''
+        Build a database from the ground, from a stream of key–value-pairs, without keeping them all in memory
+        
+        @param  pairs:itr<(str, bytes)>  Key–value-pairs, all values must be of same length
+        @param  presorted:bool           Whether `pairs` is already sorted by key, otherwise it is sorted with an external merge sort
+        '''
+        (runs, amounts, blooms) = ([], None, {})
+        writers = {}
+        try:
+            if presorted:
+                records = ((SpikeDB.__initials(key), key, value) for (key, value) in pairs)
+            else:
+                (records, runs, amounts) = self.__sort_runs(pairs)
+            for (initials, key, value) in records:
+                lblen = lb32(len(key))
+                if (1 << lblen) < len(key):
+                    lblen += 1
+                if lblen not in writers:
+                    filename = self.file_pattern % lblen
+                    recover_folded(filename)
+                    writers[lblen] = Bulkwriter(filename + '.folded', 3 * (1 << (INITIALS_LEN << 2)))
+                    if amounts is not None:
+                        blooms[lblen] = self.__new_bloom(amounts[lblen])
+                writer = writers[lblen]
+                if (writer.last is not None) and ((initials, key) < writer.last):
+                    raise Exception('Key–value-pairs are not sorted: %s' % key)
+                writer.last = (initials, key)
+                writer.append(initials, pad_key(key, 1 << lblen) + value)
+                if blooms.get(lblen, None) is not None:
+                    blooms[lblen].add(pad_key(key, 1 << lblen))
+            for lblen in writers:
+                filename = self.file_pattern % lblen
+                amount = writers[lblen].close()
+                if amounts is not None:
+                    bloom = blooms[lblen]
+                else:
+                    # The number of records was not known in advance, so the keys are read back
+                    bloom = self.__new_bloom(amount)
+                    if bloom is not None:
+                        for (_, key, _) in self.__records(filename + '.folded', 1 << lblen):
+                            bloom.add(pad_key(key, 1 << lblen))
+                        self.__unmap(filename + '.folded')
+                self.__unmap(filename)
+                replace_folded(filename, filename + '.folded', len(delta_segments(filename)))
+                self.__store_bloom(filename, bloom)
+            writers = {}
+        finally:
+            for lblen in writers:
+                writers[lblen].abort()
+            for run in runs:
+                if os.path.exists(run):
+                    os.unlink(run)
+    
+    
+    def prepare(self, operations):
+        '''
+        Write, but do not publish, delta segments for modifications, this is used to
+        apply modifications on multiple databases at once
+        
+        @param   operations:list<(str, int, bytes?)>  The key, operation (`DELTA_INSERT` or `DELTA_REMOVE`) and value (`None` for removals) of each modification, in order
+        @return  :list<(str, str)>                    The written files and the filenames they should be renamed to, in order, to publish the modifications
+        '''
         buckets = {}
-        for pair in pairs:
-            lblen = lb32(len(pair[0]))
-            if (1 << lblen) < len(pair[0]):
+        for operation in operations:
+            lblen = lb32(len(operation[0]))
+            if (1 << lblen) < len(operation[0]):
                 lblen += 1
             if lblen not in buckets:
-                buckets[lblen] = [pair]
+                buckets[lblen] = [operation]
             else:
-                buckets[lblen].append(pair)
+                buckets[lblen].append(operation)
+        rc = []
         for lblen in buckets:
             filename = self.file_pattern % lblen
-            SpikeDB.__make(filename, 1 << lblen, buckets[lblen])
+            recover_folded(filename)
+            rc.append(SpikeDB.__write_delta(filename, 1 << lblen, self.value_len, buckets[lblen]))
+        return rc
+    
+    
+    def compact(self, forced = True):
+        '''
+        Fold delta segments into their database files
+        
+        @param  forced:bool  Whether to fold all delta segments, rather than only those that have grown too large
+        '''
+        for lblen in range(32):
+            db = self.file_pattern % lblen
+            recover_folded(db)
+            deltas = delta_segments(db)
+            if len(deltas) > 0:
+                if forced:
+                    self.__fold(db, 1 << lblen, deltas)
+                else:
+                    self.__consider_folding(db, 1 << lblen)
+    
+    
+    
+    def __map(self, db):
+        '''
+        Gets a read-only memory map of a database file, each file is only mapped once
+        as long as it is not modified
+        
+        @param   db:str        The database file
+        @return  :memoryview?  The content of the file, `None` if memory mapping is disabled or not possible
+        '''
+        if not self.mapped:
+            return None
+        try:
+            stat = os.stat(db)
+        except:
+            return None
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if db in self.maps:
+            if self.maps[db][0] == identity:
+                return self.maps[db][2]
+            self.__unmap(db)
+        if stat.st_size < 3 * (1 << (INITIALS_LEN << 2)):
+            return None
+        try:
+            with open(db, 'rb') as file:
+                mapping = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        except:
+            return None
+        view = memoryview(mapping)
+        self.maps[db] = (identity, mapping, view)
+        return view
+    
+    
+    def __unmap(self, db):
+        '''
+        Unmap a database file if it has been memory mapped, this must be done before the file is modified
+        
+        @param  db:str  The database file
+        '''
+        if db in self.maps:
+            (_, mapping, view) = self.maps[db]
+            del self.maps[db]
+            try:
+                view.release()
+                mapping.close()
+            except BufferError:
+                pass # Slices of the map are still in use, it will be unmapped when they are released
+    
+    
+    def __lookup(self, rc, db, maxlen, keys):
+        '''
+        Looks up values in a database file and its delta segments
+        
+        @param   rc:append((str, bytes?))→void  Sink to which to append found results
+        @param   db:str                         The database file
+        @param   maxlen:int                     The length of keys
+        @param   keys:list<str>                 Keys for which to search
+        @return  rc:                            `rc` is returned, filled with `(key:str, value:bytes?)`-pairs. `value` is `None` when not found
+        '''
+        recover_folded(db)
+        deltas = delta_segments(db)
+        sink = rc if len(deltas) == 0 else []
+        if os.path.exists(db):
+            bloom = self.__bloom(db)
+            if bloom is not None:
+                (present, keys) = ([], unique(sorted(keys)))
+                for key in keys:
+                    if pad_key(key, maxlen) in bloom:
+                        present.append(key)
+                    else:
+                        sink.append((key, None))
+                keys = present
+            if len(keys) > 0:
+                mapping = self.__map(db)
+                SpikeDB.__fetch(sink, db, maxlen, keys, self.value_len, self.__offsets(db, mapping), mapping)
+        else:
+            for key in unique(sorted(keys)):
+                sink.append((key, None))
+        if len(deltas) > 0:
+            values = {}
+            for (key, value) in sink:
+                if key not in values:
+                    values[key] = []
+                if value is not None:
+                    values[key].append(value)
+            for delta in deltas:
+                SpikeDB.__fetch_delta(values, delta, maxlen, self.value_len)
+            for key in values:
+                if len(values[key]) == 0:
+                    rc.append((key, None))
+                for value in values[key]:
+                    rc.append((key, value))
+        return rc
+    
+    
+    def __records(self, db, maxlen, start = None, end = None):
+        '''
+        Iterate over all records in a database file, in file order, without applying its delta segments
+        
+        @param   db:str                   The database file
+        @param   maxlen:int               The length of keys
+        @param   start:str?               Skip records whose keys are less than this key
+        @param   end:str?                 Skip records whose keys are not less than this key
+        @return  :itr<(int, str, bytes)>  The initials, key and value of each record
+        '''
+        if not os.path.exists(db):
+            return
+        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
+        keyvallen = maxlen + self.value_len
+        mapping = self.__map(db)
+        offsets = self.__offsets(db, mapping)
+        file = None
+        try:
+            if mapping is None:
+                file = open(db, 'rb')
+                amount = (os.stat(os.path.realpath(db)).st_size - masterseeklen) // keyvallen
+                blist = Blocklist(file, SpikeDB.__lb_blocksize(db), masterseeklen, keyvallen, maxlen, amount)
+            else:
+                amount = (len(mapping) - masterseeklen) // keyvallen
+                blist = Mappedlist(mapping, masterseeklen, keyvallen, maxlen, amount)
+            for initials in range(len(offsets) - 1):
+                (first, last) = (offsets[initials], min(offsets[initials + 1], amount))
+                if first >= amount:
+                    break
+                if (start is not None) and (first < last):
+                    first = bisect.bisect_left(blist, pad_key(start, maxlen), first, last)
+                if (end is not None) and (first < last):
+                    last = bisect.bisect_left(blist, pad_key(end, maxlen), first, last)
+                for i in range(first, last):
+                    yield (initials, unpad_key(blist.get_key_binary(i), maxlen), blist.get_value(i))
+        finally:
+            if file is not None:
+                file.close()
+    
+    
+    def __merged(self, db, maxlen, deltas, start = None, end = None):
+        '''
+        Iterate over all records in a database file, in file order, with its delta segments applied
+        
+        @param   db:str                   The database file
+        @param   maxlen:int               The length of keys
+        @param   deltas:list<str>         The database file's delta segments, in order of creation
+        @param   start:str?               Skip records whose keys are less than this key
+        @param   end:str?                 Skip records whose keys are not less than this key
+        @return  :itr<(int, str, bytes)>  The initials, key and value of each record
+        '''
+        changes = SpikeDB.__load_deltas(deltas, maxlen, self.value_len)
+        within = lambda key : ((start is None) or (key >= start)) and ((end is None) or (key < end))
+        changed = sorted(position for position in changes.keys() if within(position[1]))
+        i = 0
+        for (position, records) in itertools.groupby(self.__records(db, maxlen, start, end), lambda record : record[:2]):
+            while (i < len(changed)) and (changed[i] < position):
+                for value in apply_operations([], changes[changed[i]]):
+                    yield changed[i] + (value,)
+                i += 1
+            values = [value for (_, _, value) in records]
+            if (i < len(changed)) and (changed[i] == position):
+                values = apply_operations(values, changes[position])
+                i += 1
+            for value in values:
+                yield position + (value,)
+        while i < len(changed):
+            for value in apply_operations([], changes[changed[i]]):
+                yield changed[i] + (value,)
+            i += 1
+    
+    
+    def __sort_runs(self, pairs):
+        '''
+        Sort key–value-pairs, in file order, with an external merge sort, `BULK_RUN_LEN` pairs
+        are sorted at a time and written to temporary files that are merged as they are read
+        
+        @param   pairs:itr<(str, bytes)>                               Key–value-pairs
+        @return  :(itr<(int, str, bytes)>, list<str>, dict<int, int>)  The initials, key and value of each pair, in sorted order, the temporary
+                                                                       files, which should be removed when the pairs have been read, and a map
+                                                                       from binary logarithm of key length to the number of pairs
+        '''
+        order = lambda record : record[:2]
+        (runs, run, amounts) = ([], [], {})
+        for (key, value) in pairs:
+            run.append((SpikeDB.__initials(key), key, value))
+            lblen = lb32(len(key))
+            if (1 << lblen) < len(key):
+                lblen += 1
+            amounts[lblen] = amounts.get(lblen, 0) + 1
+            if len(run) == BULK_RUN_LEN:
+                run.sort(key = order)
+                runs.append('%s.run.%i' % (self.file_pattern % 0, len(runs)))
+                SpikeDB.__write_run(runs[-1], run)
+                run = []
+        run.sort(key = order)
+        if len(runs) == 0:
+            return (run, runs, amounts)
+        streams = [SpikeDB.__read_run(name, self.value_len) for name in runs] + [run]
+        # `heapq.merge` is stable, so pairs with the same key keep their order
+        return (heapq.merge(*streams, key = order), runs, amounts)
+    
+    
+    def __consider_folding(self, db, maxlen):
+        '''
+        Fold the delta segments of a database file into the database file if they have grown too large
+        
+        @param  db:str      The database file
+        @param  maxlen:int  The length of keys
+        '''
+        deltas = delta_segments(db)
+        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
+        pending = sum(os.stat(delta).st_size for delta in deltas) // (2 + maxlen + self.value_len + 1)
+        present = os.stat(db).st_size if os.path.exists(db) else masterseeklen
+        present = (present - masterseeklen) // (maxlen + self.value_len)
+        if (len(deltas) > DELTA_MAX_SEGMENTS) or (pending * DELTA_MAX_RATIO > present):
+            self.__fold(db, maxlen, deltas)
+    
+    
+    def __fold(self, db, maxlen, deltas):
+        '''
+        Fold the delta segments of a database file into the database file
+        
+        @param  db:str            The database file
+        @param  maxlen:int        The length of keys
+        @param  deltas:list<str>  The database file's delta segments, in order of creation
+        '''
+        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
+        counts = {}
+        records = os.stat(db).st_size if os.path.exists(db) else masterseeklen
+        records = (records - masterseeklen) // (maxlen + self.value_len)
+        records += sum(os.stat(delta).st_size for delta in deltas) // (2 + maxlen + self.value_len + 1)
+        bloom = self.__new_bloom(records)
+        with open(db + '.folded', 'wb') as file:
+            file.write(bytes(masterseeklen))
+            for (initials, key, value) in self.__merged(db, maxlen, deltas):
+                file.write(pad_key(key, maxlen))
+                file.write(value)
+                counts[initials] = counts.get(initials, 0) + 1
+                if bloom is not None:
+                    bloom.add(pad_key(key, maxlen))
+            file.flush()
+            for initials in counts:
+                count = counts[initials]
+                file.seek(3 * initials, 0) # 0 means from the start of the stream
+                file.write(bytes([b & 255 for b in [count >> 16, count >> 8, count]]))
+            file.flush()
+            os.fsync(file.fileno())
+        self.__unmap(db)
+        replace_folded(db, db + '.folded', len(deltas))
+        self.__store_bloom(db, bloom)
+    
+    
+    def __offsets(self, db, mapping = None):
+        '''
+        Gets the index of the first record in each bucket of a database file, the master seek
+        table is only decoded once as long as the file is not modified
+        
+        @param   db:str               The database file
+        @param   mapping:memoryview?  The content of the file if it is memory mapped, `None` to read it
+        @return  :array<int>          The index of the first record in each bucket, followed by the number of records
+        '''
+        stat = os.stat(db)
+        identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if (db in self.offsets) and (self.offsets[db][0] == identity):
+            return self.offsets[db][1]
+        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
+        if mapping is None:
+            with open(db, 'rb') as file:
+                table = file.read(masterseeklen)
+        else:
+            table = mapping[:masterseeklen].tobytes()
+        # Widen the 3-byte big-endian counts to 4 bytes with slice assignments, so they can be decoded at once
+        wide = bytearray(len(table) // 3 * 4)
+        for i in range(3):
+            wide[i + 1 :: 4] = table[i :: 3]
+        counts = array('I')
+        counts.frombytes(bytes(wide))
+        if sys.byteorder != 'big':
+            counts.byteswap()
+        offsets = array('Q', itertools.accumulate(counts, initial = 0))
+        self.offsets[db] = (identity, offsets)
+        return offsets
+    
+    
+    def __new_bloom(self, amount):
+        '''
+        Create an empty Bloom filter for a database file
+        
+        @param   amount:int     The number of records that will be added to the filter
+        @return  :Bloomfilter?  The Bloom filter, `None` if Bloom filters are not used
+        '''
+        if self.bloom_error <= 0:
+            return None
+        return Bloomfilter.sized(amount, self.bloom_error)
+    
     
+    def __store_bloom(self, db, bloom):
+        '''
+        Store the Bloom filter for a database file, the database file must already have been written
+        
+        @param  db:str              The database file
+        @param  bloom:Bloomfilter?  The Bloom filter, `None` to remove the stored filter
+        '''
+        if db in self.blooms:
+            del self.blooms[db]
+        if bloom is None:
+            if os.path.exists(db + '.bloom'):
+                os.unlink(db + '.bloom')
+            return
+        stat = os.stat(db)
+        with open(db + '.bloom~', 'wb') as file:
+            for n in (stat.st_ino, stat.st_size, stat.st_mtime_ns, bloom.k, bloom.m, BLOOM_FORMAT):
+                file.write(n.to_bytes(8, 'big'))
+            file.write(bloom.bits)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(db + '.bloom~', db + '.bloom')
+    
+    
+    def __bloom(self, db):
+        '''
+        Gets the Bloom filter for a database file
+        
+        @param   db:str         The database file
+        @return  :Bloomfilter?  The Bloom filter, `None` if Bloom filters are not used, or if it is missing or out of date
+        '''
+        if self.bloom_error <= 0:
+            return None
+        try:
+            stat = os.stat(db)
+        except:
+            return None
+        identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if (db in self.blooms) and (self.blooms[db][0] == identity):
+            return self.blooms[db][1]
+        bloom = None
+        try:
+            with open(db + '.bloom', 'rb') as file:
+                data = file.read()
+            header = [int.from_bytes(data[i : i + 8], 'big') for i in range(0, 48, 8)]
+            if (tuple(header[:3]) == identity) and (header[5] == BLOOM_FORMAT) and (len(data) == 48 + ((header[4] + 7) >> 3)):
+                bloom = Bloomfilter(header[4], header[3], data[48:])
+        except:
+            pass
+        self.blooms[db] = (identity, bloom)
+        return bloom
     
     
     @staticmethod
@@ -228,6 +795,33 @@ class SpikeDB():
             return 13
     
     
+    @staticmethod
+    def __initials(key):
+        '''
+        Calculate the initials of a key, that is, the bucket the key is stored in
+        
+        @param   key:str  The key
+        @return  :int     The initials of the key
+        '''
+        pos = 0
+        initials = ''
+        while '/' in key[pos : -1]:
+            pos = key.find('/', pos) + 1
+            initials += key[pos]
+        while len(initials) < INITIALS_LEN:
+            pos += 1
+            if pos == len(key):
+                break
+            initials += key[pos]
+        if len(initials) > INITIALS_LEN:
+            initials += initials[:INITIALS_LEN]
+        initials = [(ord(c) & 15) for c in initials]
+        ivalue = 0
+        for initial in initials:
+            ivalue = (ivalue << 4) | ivalue
+        return ivalue
+    
+    
     @staticmethod
     def __make_buckets(keys):
         '''
@@ -238,22 +832,7 @@ class SpikeDB():
         '''
         buckets = {}
         for key in unique(sorted(keys)):
-            pos = 0
-            initials = ''
-            while '/' in key[pos : -1]:
-                pos = key.find('/') + 1
-                initials += key[pos]
-            while len(initials) < INITIALS_LEN:
-                pos += 1
-                if pos == len(key):
-                    break
-                initials += key[pos]
-            if len(initials) > INITIALS_LEN:
-                initials += initials[:INITIALS_LEN]
-            initials = [(ord(c) & 15) for c in initials]
-            ivalue = 0
-            for initial in initials:
-                ivalue = (ivalue << 4) | ivalue
+            ivalue = SpikeDB.__initials(key)
             if ivalue not in buckets:
                 buckets[ivalue] = []
             buckets[ivalue].append(key)
@@ -270,23 +849,7 @@ class SpikeDB():
         '''
         buckets = {}
         for pair in sorted(pairs, key = lambda x : x[0]):
-            pos = 0
-            initials = ''
-            (key, value) = pair
-            while '/' in key[pos : -1]:
-                pos = key.find('/') + 1
-                initials += key[pos]
-            while len(initials) < INITIALS_LEN:
-                pos += 1
-                if pos == len(key):
-                    break
-                initials += key[pos]
-            if len(initials) > INITIALS_LEN:
-                initials += initials[:INITIALS_LEN]
-            initials = [(ord(c) & 15) for c in initials]
-            ivalue = 0
-            for initial in initials:
-                ivalue = (ivalue << 4) | ivalue
+            ivalue = SpikeDB.__initials(pair[0])
             if ivalue not in buckets:
                 buckets[ivalue] = []
             buckets[ivalue].append(pair)
@@ -294,7 +857,7 @@ class SpikeDB():
     
     
     @staticmethod
-    def __fetch(rc, db, maxlen, keys, valuelen):
+    def __fetch(rc, db, maxlen, keys, valuelen, offsets, mapping = None):
         '''
         Looks up values in a file
         
@@ -303,253 +866,58 @@ class SpikeDB():
         @param   maxlen:int                     The length of keys
         @param   keys:list<str>                 Keys for which to search
         @param   valuelen:int                   The length of values
+        @param   offsets:array<int>             The index of the first record in each bucket, followed by the number of records
+        @param   mapping:memoryview?            The content of the file if it is memory mapped, `None` to read it block by block
         @return  rc:                            `rc` is returned, filled with `(key:str, value:bytes?)`-pairs. `value` is `None` when not found
         '''
         buckets = SpikeDB.__make_buckets(keys)
         devblocksize = SpikeDB.__lb_blocksize(db)
-        with open(db, 'rb') as file:
-            offset = 0
-            position = 0
-            amount = 0
-            masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
-            masterseek = _file_read(file, masterseeklen)
-            keyvallen = maxlen + valuelen
-            for initials in sorted(buckets.keys()):
-                if position >= initials:
-                    position = 0
-                    offset = 0
-                    amount = 0
-                while position <= initials:
-                    offset += amount
-                    amount = [int(b) for b in masterseek[3 * position : 3 * (position + 1)]]
-                    amount = (amount[0] << 16) | (amount[1] << 8) | amount[2]
-                    position += 1
-                fileoffset = masterseeklen + offset * keyvallen
-                bucket = buckets[initials]
-                bbucket = [(word + '\0' * (maxlen - len(word.encode('utf-8')))).encode('utf-8') for word in bucket]
-                blist = Blocklist(file, devblocksize, fileoffset, keyvallen, maxlen, amount)
-                class Agg():
-                    def __init__(self, sink, key_map, value_map, limit):
-                        self.sink = sink
-                        self.key_map = key_map;
-                        self.value_map = value_map;
-                        self.limit = limit;
-                    def append(self, item):
-                        (key_index, val_index) = item
-                        val = None if val_index < 0 else self.value_map.get_value(val_index)
-                        key = self.key_map[key_index]
-                        _key = self.value_map.get_key(val_index)
-                        self.sink.append((key, val))
-                        _val_index = val_index
-                        val_index += 1
-                        while val_index < self.limit:
-                            if self.value_map.get_key(val_index) != _key:
-                                break
-                            val = self.value_map.get_value(val_index)
-                            self.sink.append((key, val))
-                            val_index += 1
-                        val_index = _val_index - 1
-                        while val_index >= 0:
-                            if self.value_map.get_key(val_index) != _key:
-                                break
-                            val = self.value_map.get_value(val_index)
-                            self.sink.append((key, val))
-                            val_index -= 1
-                multibin_search(Agg(rc, bucket, blist, amount), blist, bbucket)
-        return rc
-    
-    
-    @staticmethod
-    def __remove(rc, db, maxlen, keys, valuelen):
-        ## TODO: remove file if all entires have been removed
-        '''
-        Looks up values in a file
-        
-        @param   rc:append(str)→void  Sink on which to append unfound keys
-        @param   db:str               The database file
-        @param   maxlen:int           The length of keys
-        @param   keys:list<str>       Keys for which to search
-        @param   valuelen:int         The length of values
-        @return  rc:                  `rc` is returned
-        '''
-        buckets = SpikeDB.__make_buckets(keys)
-        devblocksize = SpikeDB.__lb_blocksize(db)
-        wdata = []
-        with open(db, 'rb') as file:
-            removelist = []
-            diminish = []
-            offset = 0
-            position = 0
-            amount = 0
+        file = open(db, 'rb') if mapping is None else None
+        try:
             masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
-            masterseek = list(_file_read(file, masterseeklen))
             keyvallen = maxlen + valuelen
+            class Agg():
+                def __init__(self, sink, key_map, bkey_map, value_map):
+                    self.sink = sink
+                    self.key_map = key_map
+                    self.bkey_map = bkey_map
+                    self.value_map = value_map
+                def append(self, item):
+                    (key_index, val_index) = item
+                    key = self.key_map[key_index]
+                    if val_index < 0:
+                        self.sink.append((key, None))
+                        return
+                    # Expand the run of records with the same key by comparing the stored bytes, without decoding them
+                    (first, end) = self.value_map.key_run(val_index, self.bkey_map[key_index])
+                    for index in range(first, end):
+                        self.sink.append((key, self.value_map.get_value(index)))
             for initials in sorted(buckets.keys()):
-                if position >= initials:
-                    position = 0
-                    offset = 0
-                    amount = 0
-                while position <= initials:
-                    offset += amount
-                    amount = [int(b) for b in masterseek[3 * position : 3 * (position + 1)]]
-                    amount = (amount[0] << 16) | (amount[1] << 8) | amount[2]
-                    position += 1
+                offset = offsets[initials]
+                amount = offsets[initials + 1] - offset
                 fileoffset = masterseeklen + offset * keyvallen
                 bucket = buckets[initials]
-                bbucket = [(word + '\0' * (maxlen - len(word.encode('utf-8')))).encode('utf-8') for word in bucket]
-                curremove = len(removelist)
-                blist = Blocklist(file, devblocksize, fileoffset, keyvallen, maxlen, amount)
-                class Agg():
-                    def __init__(self, sink, failsink, key_map, value_map, limit):
-                        self.sink = sink
-                        self.failsink = failsink
-                        self.key_map = key_map
-                        self.value_map = value_map
-                        self.limit = limit
-                    def append(self, item):
-                        val = item[1]
-                        if val < 0:
-                            self.failsink.append(self.key_map[item[0]])
-                        else:
-                            self.sink.append(val)
-                            _key = self.value_map.get_key(val)
-                            _val = val
-                            val += 1
-                            while val < self.limit:
-                                if self.value_map.get_key(val) != _key:
-                                    break
-                                self.sink.append(val)
-                                val += 1
-                            val = _val - 1
-                            while val >= 0:
-                                if self.value_map.get_key(val) != _key:
-                                    break
-                                self.sink.append(val)
-                                val -= 1
-                multibin_search(Agg(removelist, rc, bucket, blist, amount), blist, bbucket)
-                diminishamount = len(removelist) - curremove
-                if diminishamount > 0:
-                    diminish.append((position - 1, diminishamount))
-            end = 0
-            pos = 0
-            while pos < masterseeklen:
-                amount = [int(b) for b in masterseek[pos : pos + 3]]
-                end += (amount[0] << 16) | (amount[1] << 8) | amount[2]
-                pos += 3
-            for (index, amount) in diminish:
-                pos = 3 * index
-                was = [int(b) for b in masterseek[pos : pos + 3]]
-                was = (was[0] << 16) | (was[1] << 8) | was[2]
-                amount = was - amount
-                masterseek[pos : pos + 3] = [b & 255 for b in [amount >> 16, amount >> 8, amount]]
-            masterseek = bytes(masterseek)
-            wdata.append(masterseek)
-            pos = 0
-            removelist.sort()
-            for indices in (removelist, [end]):
-                for index in indices:
-                    if pos != index:
-                        file.seek(masterseeklen + pos * keyvallen, 0) # 0 means from the start of the stream
-                        wdata.append(_file_read(file, (index - pos) * keyvallen))
-                    pos = index + 1
-        with open(db, 'wb') as file:
-            for data in wdata:
-                file.write(data)
+                bbucket = [pad_key(word, maxlen) for word in bucket]
+                if mapping is None:
+                    blist = Blocklist(file, devblocksize, fileoffset, keyvallen, maxlen, amount)
+                else:
+                    blist = Mappedlist(mapping, fileoffset, keyvallen, maxlen, amount)
+                multibin_search(Agg(rc, bucket, bbucket, blist), blist, bbucket)
+        finally:
+            if file is not None:
+                file.close()
         return rc
     
     
     @staticmethod
-    def __insert(db, maxlen, valuelen, pairs):
-        '''
-        Insert, but do not override, values in a database
-        
-        @param  db:str                    The database file
-        @param  maxlen:int                The length of keys
-        @param  valuelen:int              The length of values
-        @param  pairs:list<(str, bytes)>  Key–value-pairs, all values must be of same length
-        '''
-        buckets = SpikeDB.__make_pair_buckets(pairs)
-        devblocksize = SpikeDB.__lb_blocksize(db)
-        insertlist = []
-        initialscache = {}
-        masterseek = None
-        masterseeklen = 3 * (1 << (INITIALS_LEN << 2))
-        data = []
-        with open(db, 'rb') as file:
-            offset = 0
-            position = 0
-            amount = 0
-            masterseek = list(_file_read(file, masterseeklen))
-            keyvallen = maxlen + valuelen
-            for initials in sorted(buckets.keys()):
-                if position >= initials:
-                    position = 0
-                    offset = 0
-                    amount = 0
-                while position <= initials:
-                    offset += amount
-                    if initials in initialscache:
-                        amount = initialscache[initials]
-                    else:
-                        amount = [int(b) for b in masterseek[3 * position : 3 * (position + 1)]]
-                        amount = (amount[0] << 16) | (amount[1] << 8) | amount[2]
-                        initialscache[initials] = amount
-                    position += 1
-                fileoffset = masterseeklen + offset * keyvallen
-                bucket = buckets[initials]
-                bbucket = [(word + '\0' * (maxlen - len(word.encode('utf-8')))).encode('utf-8') for (word, _) in bucket]
-                blist = Blocklist(file, devblocksize, fileoffset, keyvallen, maxlen, amount)
-                class Agg():
-                    def __init__(self, sink, key_map, pos_calc, initials):
-                        self.sink = sink
-                        self.key_map = key_map
-                        self.pos_calc = pos_calc
-                        self.initials = initials
-                    def append(self, item):
-                        pos = item[1]
-                        pos = ~pos if pos < 0 else pos
-                        (key, val) = self.key_map[item[0]]
-                        self.sink.append((key, val, self.pos_calc(pos), self.initials))
-                multibin_search(Agg(insertlist, bucket, lambda x : fileoffset + x * keyvallen, initials), blist, bbucket)
-            insertlist.sort(key = lambda x : x[2])
-            end = 0
-            pos = 0
-            while pos < masterseeklen:
-                amount = [int(b) for b in masterseek[pos : pos + 3]]
-                end += (amount[0] << 16) | (amount[1] << 8) | amount[2]
-                pos += 3
-            end = masterseeklen + end * keyvallen
-            for (_k, _v, _p, initials) in insertlist:
-                initialscache[initials] += 1
-            for initials in initialscache:
-                count = initialscache[initials]
-                count = [b & 255 for b in [count >> 16, count >> 8, count]]
-                masterseek[3 * initials : 3 * (initials + 1)] = count
-            masterseek = bytes(masterseek)
-            data.append(masterseek)
-            last = masterseeklen
-            file.seek(last, 0) # 0 means from the start of the stream
-            for (key, val, pos, _) in insertlist + [(None, None, end, None)]:
-                if pos > last:
-                    data.append(_file_read(file, pos - last))
-                    last = pos
-                if key is not None:
-                    key = key + '\0' * (maxlen - len(key.encode('utf8')))
-                    data.append(key.encode('utf8'))
-                    data.append(val)
-        with open(db, 'wb') as file:
-            for d in data:
-                file.write(d)
-    
-    
-    @staticmethod
-    def __make(db, maxlen, pairs):
+    def __make(db, maxlen, pairs, bloom = None):
         '''
         Build a database from the ground
         
         @param  db:str                    The database file
         @param  maxlen:int                The length of keys
         @param  pairs:list<(str, bytes)>  Key–value-pairs, all values must be of same length
+        @param  bloom:Bloomfilter?        Bloom filter to which to add the keys
         '''
         buckets = SpikeDB.__make_pair_buckets(pairs)
         counts = []
@@ -562,10 +930,9 @@ class SpikeDB():
                 bucket = buckets[initials]
                 for pair in bucket:
                     (key, value) = pair
-                    key = key + '\0' * (maxlen - len(key.encode('utf8')))
-                    key = key.encode('utf8')
-                    file.write(key)
-                    file.write(value)
+                    file.write(pad_key(key, maxlen) + value)
+                    if bloom is not None:
+                        bloom.add(pad_key(key, maxlen))
                 counts.append((initials, len(bucket)))
             file.flush()
             for (initials, count) in counts:
@@ -573,6 +940,287 @@ class SpikeDB():
                 wbuf = bytes([b & 255 for b in [count >> 16, count >> 8, count]])
                 file.write(wbuf)
             file.flush()
+            os.fsync(file.fileno())
+    
+    
+    @staticmethod
+    def __write_run(run, records):
+        '''
+        Write a sorted run of key–value-pairs, for the external merge sort, to a temporary file
+        
+        @param  run:str                          The temporary file
+        @param  records:list<(int, str, bytes)>  The initials, key and value of each pair, in sorted order
+        '''
+        with open(run, 'wb', buffering = BULK_BUFFER) as file:
+            for (initials, key, value) in records:
+                key = key.encode('utf-8')
+                file.write(initials.to_bytes(2, 'big') + len(key).to_bytes(4, 'big') + key + value)
+    
+    
+    @staticmethod
+    def __read_run(run, valuelen):
+        '''
+        Read a sorted run of key–value-pairs, that was written by `__write_run`
+        
+        @param   run:str                  The temporary file
+        @param   valuelen:int             The length of values
+        @return  :itr<(int, str, bytes)>  The initials, key and value of each pair
+        '''
+        with open(run, 'rb', buffering = BULK_BUFFER) as file:
+            while True:
+                head = file.read(6)
+                if len(head) < 6:
+                    break
+                key = file.read(int.from_bytes(head[2:], 'big')).decode('utf-8')
+                yield (int.from_bytes(head[:2], 'big'), key, file.read(valuelen))
+    
+    
+    @staticmethod
+    def __associated(db):
+        '''
+        Gets all existing files associated with a database file
+        
+        @param   db:str      The database file
+        @return  :list<str>  The database file, its delta segments, its Bloom filter and any leftovers from interrupted writes
+        '''
+        deltas = delta_segments(db)
+        rc = ([db] if os.path.exists(db) else []) + deltas
+        for leftover in (db + '.bloom', db + '.bloom~', db + '.folding', db + '.folded', '%s.delta.%i~' % (db, len(deltas))):
+            if os.path.exists(leftover):
+                rc.append(leftover)
+        return rc
+    
+    
+    @staticmethod
+    def __write_delta(db, maxlen, valuelen, records):
+        '''
+        Write a new delta segment for a database file, it is written to a temporary file that should be renamed to publish it
+        
+        @param   db:str                            The database file
+        @param   maxlen:int                        The length of keys
+        @param   valuelen:int                      The length of values
+        @param   records:list<(str, int, bytes?)>  The key, operation and value (`None` for removals) of each record, in order of operation
+        @return  :(str, str)                       The temporary file and the delta segment's filename
+        '''
+        entries = [(SpikeDB.__initials(records[i][0]), records[i][0], i) + records[i][1:] for i in range(len(records))]
+        entries.sort(key = lambda x : x[:3])
+        blank = bytes(valuelen)
+        delta = '%s.delta.%i' % (db, len(delta_segments(db)))
+        with open(delta + '~', 'wb') as file:
+            for (initials, key, _, op, value) in entries:
+                file.write(bytes([initials >> 8, initials & 255]))
+                file.write(pad_key(key, maxlen))
+                file.write(blank if value is None else value)
+                file.write(bytes([op]))
+            file.flush()
+            os.fsync(file.fileno())
+        return (delta + '~', delta)
+    
+    
+    @staticmethod
+    def __fetch_delta(values, delta, maxlen, valuelen):
+        '''
+        Apply the operations in a delta segment to looked up values
+        
+        @param  values:dict<str, list<bytes>>  Map from keys to their values, updated in place
+        @param  delta:str                      The delta segment
+        @param  maxlen:int                     The length of keys
+        @param  valuelen:int                   The length of values
+        '''
+        itemsize = 2 + maxlen
+        reclen = itemsize + valuelen + 1
+        with open(delta, 'rb') as file:
+            amount = os.stat(os.path.realpath(delta)).st_size // reclen
+            blist = Blocklist(file, SpikeDB.__lb_blocksize(delta), 0, reclen, itemsize, amount)
+            for key in values:
+                initials = SpikeDB.__initials(key)
+                item = bytes([initials >> 8, initials & 255]) + pad_key(key, maxlen)
+                index = bin_search(blist, item, 0, amount - 1)
+                if index < 0:
+                    continue
+                while (index > 0) and (blist[index - 1] == item):
+                    index -= 1
+                while (index < amount) and (blist[index] == item):
+                    value = blist.get_value(index)
+                    if value[-1] == DELTA_REMOVE:
+                        values[key] = []
+                    else:
+                        values[key].append(value[:-1])
+                    index += 1
+    
+    
+    @staticmethod
+    def __load_deltas(deltas, maxlen, valuelen):
+        '''
+        Read all operations in delta segments
+        
+        @param   deltas:list<str>                       The delta segments, in order of creation
+        @param   maxlen:int                             The length of keys
+        @param   valuelen:int                           The length of values
+        @return  :dict<(int, str), list<(int, bytes)>>  Map from initials and key to operations and values, in order of operation
+        '''
+        rc = {}
+        reclen = 2 + maxlen + valuelen + 1
+        for delta in deltas:
+            with open(delta, 'rb') as file:
+                data = file.read()
+            for pos in range(0, len(data) - reclen + 1, reclen):
+                key = unpad_key(data[pos + 2 : pos + 2 + maxlen], maxlen)
+                position = ((data[pos] << 8) | data[pos + 1], key)
+                if position not in rc:
+                    rc[position] = []
+                rc[position].append((data[pos + reclen - 1], data[pos + 2 + maxlen : pos + reclen - 1]))
+        return rc
+
+
+
+class Pagecache():
+    '''
+    Least recently used cache of pages read from files, this is shared by all `Blocklist`:s
+    '''
+    def __init__(self, budget):
+        '''
+        Constructor
+        
+        @param  budget:int  The number of bytes the cache may use
+        '''
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.pages = OrderedDict()
+    
+    @staticmethod
+    def identify(file):
+        '''
+        Gets the identity of a file, which changes when the file is modified or replaced
+        
+        @param   file:inputfile         The file
+        @return  :(str, int, int, int)  The identity of the file
+        '''
+        stat = os.fstat(file.fileno())
+        return (file.name, stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    
+    def read(self, file, identity, lb_pagesize, first, count):
+        '''
+        Read pages from a file
+        
+        @param   file:inputfile                 The file, it must be seekable
+        @param   identity:(str, int, int, int)  The identity of the file
+        @param   lb_pagesize:int                The binary logarithm of the page size
+        @param   first:int                      The index of the first page to read
+        @param   count:int                      The number of pages to read
+        @return  :bytes                         The read data, it is shorter than requested at the end of the file
+        '''
+        pagesize = 1 << lb_pagesize
+        pages = []
+        page = first
+        while page < first + count:
+            key = identity + (lb_pagesize, page)
+            if key in self.pages:
+                self.hits += 1
+                self.pages.move_to_end(key)
+                pages.append(self.pages[key])
+                page += 1
+                continue
+            self.misses += 1
+            wanted = (first + count - page) << lb_pagesize
+            file.seek(page << lb_pagesize, 0) # 0 means from the start of the stream
+            data = _file_read(file, wanted)
+            for pos in range(0, len(data), pagesize):
+                self.__store(identity + (lb_pagesize, page), data[pos : pos + pagesize])
+                pages.append(data[pos : pos + pagesize])
+                page += 1
+            if len(data) < wanted:
+                break
+        return pages[0] if len(pages) == 1 else b''.join(pages)
+    
+    def clear(self):
+        '''
+        Remove all pages from the cache
+        '''
+        self.pages.clear()
+        self.size = 0
+    
+    def __store(self, key, data):
+        '''
+        Add a page to the cache, and evict the least recently used pages if the cache is too large
+        
+        @param  key:(str, int, int, int, int, int)  The identity of the file, the binary logarithm of the page size and the page index
+        @param  data:bytes                          The content of the page
+        '''
+        if key in self.pages:
+            self.size -= len(self.pages[key])
+        self.pages[key] = data
+        self.size += len(data)
+        while (self.size > self.budget) and (len(self.pages) > 0):
+            self.size -= len(self.pages.popitem(last = False)[1])
+
+
+
+page_cache = Pagecache(PAGE_CACHE_SIZE)
+'''
+The page cache that is shared by all databases
+'''
+
+
+
+class Bulkwriter():
+    '''
+    Buffered writer of a database file whose records are appended in file order,
+    the master seek table is written in one piece when the file is closed
+    '''
+    
+    def __init__(self, file, masterseeklen):
+        '''
+        Constructor
+        
+        @param  file:str           The file to write
+        @param  masterseeklen:int  The length of the master seek table
+        '''
+        self.filename = file
+        self.file = open(file, 'wb', buffering = BULK_BUFFER)
+        self.file.write(bytes(masterseeklen))
+        self.counts = [0] * (masterseeklen // 3)
+        self.amount = 0
+        self.last = None
+    
+    
+    def append(self, initials, record):
+        '''
+        Append a record
+        
+        @param  initials:int  The initials of the record's key
+        @param  record:bytes  The padded key followed by the value
+        '''
+        self.file.write(record)
+        self.counts[initials] += 1
+        self.amount += 1
+    
+    
+    def close(self):
+        '''
+        Write the master seek table and close the file
+        
+        @return  :int  The number of records in the file
+        '''
+        table = b''.join(bytes([(count >> 16) & 255, (count >> 8) & 255, count & 255]) for count in self.counts)
+        self.file.flush()
+        self.file.seek(0, 0) # 0 means from the start of the stream
+        self.file.write(table)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return self.amount
+    
+    
+    def abort(self):
+        '''
+        Close and remove the file, without completing it
+        '''
+        self.file.close()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
 
 
 
@@ -600,6 +1248,7 @@ class Blocklist():
         self.position = -1
         self.length = length
         self.buffer = None
+        self.identity = Pagecache.identify(file)
     
     def __getitem__(self, index):
         '''
@@ -648,6 +1297,21 @@ class Blocklist():
         key = key[:i]
         return bytes(key).decode('utf-8', 'replace')
     
+    def key_run(self, index, key):
+        '''
+        Gets the run of elements, around an element, that are equal to a key
+        
+        @param   index:int    The index of an element that is equal to `key`
+        @param   key:bytes    The key, as stored in the file
+        @return  :(int, int)  The index of the first element in the run, and the index after the last element in the run
+        '''
+        (first, end) = (index, index + 1)
+        while (first > 0) and (self[first - 1] == key):
+            first -= 1
+        while (end < self.length) and (self[end] == key):
+            end += 1
+        return (first, end)
+    
     def __read(self, pos, n):
         '''
         Read a block from the device and store it to the buffer
@@ -658,14 +1322,10 @@ class Blocklist():
         '''
         p = pos >> self.lb_devblock
         pos &= self.devblock - 1
-        if self.position != p:
-            if self.position + 1 != p:
-                self.file.seek(p << self.lb_devblock, 0) # 0 means from the start of the stream
+        if (self.position != p) or (len(self.buffer) < pos + n):
             self.position = p
-            rn = self.devblock
-            while pos + n >= rn:
-                rn <<= 1
-            self.buffer = _file_read(self.file, rn)
+            count = ((pos + n - 1) >> self.lb_devblock) + 1
+            self.buffer = page_cache.read(self.file, self.identity, self.lb_devblock, p, count)
         return pos
     
     def __len__(self):
@@ -678,6 +1338,164 @@ class Blocklist():
 
 
 
+class Mappedlist():
+    '''
+    A memory mapped file representated as a list
+    '''
+    def __init__(self, mapping, offset, blocksize, itemsize, length):
+        '''
+        Constructor
+        
+        @param  mapping:memoryview  The content of the memory mapped file
+        @param  offset:int          The list's offset in the file
+        @param  blocksize:int       The number of bytes between the start of elements
+        @param  itemsize:int        The size of each element
+        @param  length:int          The number of elements
+        '''
+        self.mapping = mapping
+        self.data = mapping.obj
+        self.offset = offset
+        self.blocksize = blocksize
+        self.itemsize = itemsize
+        self.length = length
+    
+    def __getitem__(self, index):
+        '''
+        Gets an element by index
+        
+        @param   index:int  The index of the element
+        @return  :bytes     The element
+        '''
+        # Slicing the map directly copies the element once, rather than first creating a view of it
+        pos = index * self.blocksize + self.offset
+        return self.data[pos : pos + self.itemsize]
+    
+    def get_value(self, index):
+        '''
+        Gets the associated value to an element by index
+        
+        @param   index:int  The index of the element
+        @return  :bytes     The associated value
+        '''
+        pos = index * self.blocksize + self.offset
+        return self.mapping[pos + self.itemsize : pos + self.blocksize].tobytes()
+    
+    def get_key_binary(self, index):
+        '''
+        Gets the associated key to an element by index
+        
+        @param   index:int  The index of the element
+        @return  :bytes     The associated key
+        '''
+        pos = index * self.blocksize + self.offset
+        return self.mapping[pos : pos + self.itemsize].tobytes()
+    
+    def get_key(self, index):
+        '''
+        Gets the associated key to an element by index
+        
+        @param   index:int  The index of the element
+        @return  :str       The associated key
+        '''
+        pos = index * self.blocksize + self.offset
+        key = self.mapping[pos : pos + self.itemsize]
+        end = key.obj.find(b'\0', pos, pos + self.itemsize)
+        if end >= 0:
+            key = key[: end - pos]
+        return str(key, 'utf-8', 'replace')
+    
+    def key_run(self, index, key):
+        '''
+        Gets the run of elements, around an element, that are equal to a key
+        
+        @param   index:int    The index of an element that is equal to `key`
+        @param   key:bytes    The key, as stored in the file
+        @return  :(int, int)  The index of the first element in the run, and the index after the last element in the run
+        '''
+        (mapping, blocksize, itemsize) = (self.mapping, self.blocksize, self.itemsize)
+        pos = index * blocksize + self.offset
+        (first, end) = (index, index + 1)
+        # Comparing views of the map with the key does not copy the elements
+        while (first > 0) and (mapping[pos - blocksize : pos - blocksize + itemsize] == key):
+            (first, pos) = (first - 1, pos - blocksize)
+        pos = end * blocksize + self.offset
+        while (end < self.length) and (mapping[pos : pos + itemsize] == key):
+            (end, pos) = (end + 1, pos + blocksize)
+        return (first, end)
+    
+    def __len__(self):
+        '''
+        Gets the number of elements
+        
+        @return  :int  The number of elements
+        '''
+        return self.length
+
+
+
+class Bloomfilter():
+    '''
+    A Bloom filter over the keys in a database file
+    '''
+    def __init__(self, m, k, bits = None):
+        '''
+        Constructor
+        
+        @param  m:int                  The number of bits in the filter
+        @param  k:int                  The number of bits that are set for each key
+        @param  bits:bytes|bytearray?  The bits of the filter, `None` for an empty filter
+        '''
+        self.m = m
+        self.k = k
+        self.bits = bytearray((m + 7) >> 3) if bits is None else bits
+    
+    @staticmethod
+    def sized(n, error):
+        '''
+        Create an empty Bloom filter with a sufficient size
+        
+        @param   n:int         The number of keys that will be added
+        @param   error:float   The desired false positive rate
+        @return  :Bloomfilter  The Bloom filter
+        '''
+        m = int(math.ceil(-max(n, 1) * math.log(error) / (math.log(2) ** 2)))
+        k = int(round(-math.log(error, 2)))
+        return Bloomfilter(max(m, 8), max(k, 1))
+    
+    def add(self, key):
+        '''
+        Add a key to the filter
+        
+        @param  key:bytes  The key, as stored in the database file
+        '''
+        for pos in self.__positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, key):
+        '''
+        Checks whether a key may be in the filter
+        
+        @param   key:bytes  The key, as stored in the database file
+        @return  :bool      `False` if the key has not been added, `True` if it probably has
+        '''
+        for pos in self.__positions(key):
+            if (self.bits[pos >> 3] & (1 << (pos & 7))) == 0:
+                return False
+        return True
+    
+    def __positions(self, key):
+        '''
+        Gets the bits that are set for a key, using double hashing
+        
+        @param   key:bytes   The key, as stored in the database file
+        @return  :list<int>  The indices of the bits
+        '''
+        digest = hashlib.blake2b(key, digest_size = 16).digest()
+        (a, b) = (int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1)
+        return [(a + i * b) % self.m for i in range(self.k)]
+
+
+
 
 def _file_read(stream, n):
     '''
@@ -704,3 +1522,114 @@ def _file_read(stream, n):
             rcc += list(c)
         return bytes(rcc)
 
+
+def pad_key(key, maxlen):
+    '''
+    Encode a key and pad it to the length of keys
+    
+    @param   key:str     The key
+    @param   maxlen:int  The length of keys
+    @return  :bytes      The key as stored in the files
+    '''
+    return (key + '\0' * (maxlen - len(key.encode('utf-8')))).encode('utf-8')
+
+
+def unpad_key(key, maxlen):
+    '''
+    Decode a key as stored in the files
+    
+    The padding cannot be told apart from trailing NUL:s in the key, such as in raw
+    integers, so the key is given back its trailing NUL:s up to the shortest length
+    of keys that are stored with this length of keys
+    
+    @param   key:bytes   The key as stored in the files
+    @param   maxlen:int  The length of keys
+    @return  :str        The key
+    '''
+    key = bytes(key).rstrip(b'\0').decode('utf-8', 'replace')
+    shortest = 0 if maxlen == 1 else ((maxlen >> 1) + 1)
+    return key + '\0' * max(0, shortest - len(key))
+
+
+def delta_segments(db):
+    '''
+    Gets the delta segments of a database file
+    
+    @param   db:str      The database file
+    @return  :list<str>  The delta segments, in order of creation
+    '''
+    rc = []
+    while os.path.exists('%s.delta.%i' % (db, len(rc))):
+        rc.append('%s.delta.%i' % (db, len(rc)))
+    return rc
+
+
+def apply_operations(values, operations):
+    '''
+    Apply delta segment operations to the values of a key
+    
+    @param   values:list<bytes>            The values before the operations
+    @param   operations:itr<(int, bytes)>  The operations and their values, in order of operation
+    @return  :list<bytes>                  The values after the operations
+    '''
+    for (op, value) in operations:
+        if op == DELTA_REMOVE:
+            values = []
+        else:
+            values.append(value)
+    return values
+
+
+def replace_folded(db, replacement, count):
+    '''
+    Replace a database file with a file that includes its oldest delta segments,
+    and remove those delta segments, in a way that can be recovered by `recover_folded`
+    
+    @param  db:str           The database file
+    @param  replacement:str  The file to replace the database file with
+    @param  count:int        The number of delta segments included in `replacement`
+    '''
+    with open(db + '.folding', 'wb') as file:
+        file.write(('%i %i\n' % (os.stat(replacement).st_ino, count)).encode('utf-8'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.rename(replacement, db)
+    _finish_folded(db, count)
+
+
+def _finish_folded(db, count):
+    '''
+    Remove the delta segments that have been folded into a database file
+    
+    @param  db:str     The database file
+    @param  count:int  The number of delta segments that have been folded
+    '''
+    for i in range(count):
+        delta = '%s.delta.%i' % (db, i)
+        if os.path.exists(delta):
+            os.unlink(delta)
+    os.unlink(db + '.folding')
+
+
+def recover_folded(db):
+    '''
+    Complete or roll back an interrupted replacement of a database file
+    
+    @param  db:str  The database file
+    '''
+    journal = db + '.folding'
+    if not os.path.exists(journal):
+        return
+    with open(journal, 'rb') as file:
+        data = file.read().decode('utf-8', 'replace').split()
+    try:
+        (inode, count) = [int(word) for word in data]
+    except ValueError:
+        (inode, count) = (None, 0) # The journal is incomplete, so the database file has not been replaced
+    if (inode is not None) and os.path.exists(db) and (os.stat(db).st_ino == inode):
+        _finish_folded(db, count)
+    else:
+        if os.path.exists(db + '.folded'):
+            os.unlink(db + '.folded')
+        os.unlink(journal)
+
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Test for this directory
+'''
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, '..')
+
+from database.spikedb import *
+from database.intdb import *
+from database.hashdb import *
+from database.dbctrl import *
+
+
+errno = 0
+def error(message, ok = False):
+    global errno
+    if not ok:
+        errno = 2
+        print('\033[31m%s\033[00m' % message)
+
+
+tmpdir = tempfile.mkdtemp()
+
+
+
+# Raw integer keys, as stored for pony ID:s and file ID:s, contain NUL:s
+pairs = [('\x01\x00', b'ab'), ('\x05', b'cd'), ('\x01\x00\x05', b'ef'), ('\x01\x00\x00', b'gh')]
+db = SpikeDB(tmpdir + '/nul.%i', 2)
+db.make(pairs)
+db.insert([('\x02\x00', b'ij')])
+db.insert([('\x03', b'kl')]) # Folds the delta segments
+error('spikedb.SpikeDB.insert, folding, does not work', not any('.delta.' in file for file in db.files()))
+got = sorted(db.list([]))
+error('spikedb.SpikeDB.list, NUL in keys, does not work',
+      got == sorted(pairs + [('\x02\x00', b'ij'), ('\x03', b'kl')]))
+got = sorted(db.fetch([], [key for (key, _) in pairs]))
+error('spikedb.SpikeDB.fetch, NUL in keys after folding, does not work', got == sorted(pairs))
+
+
+# The Bloom filters must agree with the database files about which keys are equal
+keys = [key for (key, _) in pairs] + ['\x01\x00\x00\x00', '\x02\x00', '\x04\x00', '\x00']
+plain = SpikeDB(tmpdir + '/nul.%i', 2, bloom_error = 0)
+got = sorted(db.fetch([], keys), key = str)
+error('spikedb.SpikeDB.fetch, Bloom filter, does not work', got == sorted(plain.fetch([], keys), key = str))
+
+# Scans merge the files of all key lengths and their delta segments
+db = SpikeDB(tmpdir + '/scan.%i', 2)
+db.make([('/usr/bin/a', b'ab'), ('/usr/share/x', b'cd'), ('/usr/share/xyz/long', b'ef'), ('/usr', b'gh')])
+db.insert([('/usr/share/y', b'ij'), ('/usr/sbin/b', b'kl')])
+db.remove([], ['/usr/share/x'])
+got = list(db.scan(prefix = '/usr/share/'))
+error('spikedb.SpikeDB.scan, prefix, does not work', got == [('/usr/share/xyz/long', b'ef'), ('/usr/share/y', b'ij')])
+got = [key for (key, _) in db.scan(start = '/usr/b', end = '/usr/share/y')]
+error('spikedb.SpikeDB.scan, range, does not work', got == ['/usr/bin/a', '/usr/sbin/b', '/usr/share/xyz/long'])
+got = [key for (key, _) in db.iter_items()]
+error('spikedb.SpikeDB.iter_items does not work', got == sorted(got) and len(got) == 5)
+
+
+db = IntDB(tmpdir + '/int.int', 4, 2)
+db.make([(6, b'ab'), (256, b'cd'), (256, b'ef')])
+got = db.fetch([], [6, '\x06', 256, 256, 7])
+error('intdb.IntDB.fetch, repeated keys, does not work', got == [(6, b'ab'), (7, None), (256, b'cd'), (256, b'ef')])
+db.make([(i, b'ab') for i in range(100)])
+inode = os.stat(tmpdir + '/int.int').st_ino
+db.insert([(6, b'cd')])
+error('intdb.IntDB.remove does not work', db.remove([], [7, 200, 8]) == [200])
+got = db.fetch([], [6, 7, 9])
+error('intdb.IntDB.insert, delta segments, does not work', (os.stat(tmpdir + '/int.int').st_ino == inode) and
+      (len(db.files()) == 3) and (got == [(6, b'ab'), (6, b'cd'), (7, None), (9, b'ab')]) and (len(db.list([])) == 99))
+db.compact()
+error('intdb.IntDB.compact does not work', (db.files() == [tmpdir + '/int.int']) and (db.list([])[5 : 8] == [('\x05', b'ab'), ('\x06', b'ab'), ('\x06', b'cd')]))
+folded = True
+for i in range(2 * DELTA_MAX_SEGMENTS):
+    IntDB(tmpdir + '/int.int', 4, 2).insert([(1000 + i, b'ef')])
+    folded = folded and (len(db.files()) <= DELTA_MAX_SEGMENTS + 1)
+error('intdb.IntDB.insert, folding, does not work', folded and (len(db.list([])) == 2 * DELTA_MAX_SEGMENTS + 99))
+
+
+db = HashDB(tmpdir + '/hash.%i', 2)
+db.make([('b', b'ab'), ('aa', b'cd'), ('ab', b'ef'), ('ba', b'gh')])
+got = db.fetch([], ['aa', 'b', 'aa', 'c'])
+error('hashdb.HashDB.fetch, repeated keys, does not work', sorted(got, key = str) == [('aa', b'cd'), ('b', b'ab'), ('c', None)])
+got = list(db.iter_fetch(['ba', 'b', 'c']))
+error('hashdb.HashDB.iter_fetch does not work', got == [('b', b'ab'), ('ba', b'gh'), ('c', None)])
+got = list(db.scan(prefix = 'a'))
+error('hashdb.HashDB.scan, prefix, does not work', got == [('aa', b'cd'), ('ab', b'ef')])
+got = list(db.scan(start = 'ab', end = 'b'))
+error('hashdb.HashDB.scan, range, does not work', got == [('ab', b'ef')])
+
+# The files are shared between the generations of the databases, so they must never be modified
+os.mkdir(tmpdir + '/snap')
+prefix = tmpdir + '/snap/'
+snapdb = lambda : HashDB(DBSnapshot.resolve(prefix) + 'hash.%i', 2)
+DBSnapshot.begin(prefix, True)
+snapdb().make(db.list([]))
+DBSnapshot.end()
+DBSnapshot.begin(prefix, False)
+pinned = snapdb()
+(pins, DBSnapshot.pins) = (DBSnapshot.pins, {}) # Another process
+DBSnapshot.begin(prefix, True)
+error('hashdb.HashDB.remove does not work', snapdb().remove([], ['aa', 'c']) == ['c'])
+snapdb().insert([('aa', b'ij')])
+DBSnapshot.end()
+DBSnapshot.pins = pins
+error('hashdb.HashDB.insert, pinned generation, does not work', sorted(pinned.list([])) == sorted(db.list([])))
+DBSnapshot.end()
+db = snapdb()
+got = sorted(db.list([]))
+error('hashdb.HashDB.insert, after remove, does not work', got == [('aa', b'ij'), ('ab', b'ef'), ('b', b'ab'), ('ba', b'gh')])
+db.insert([('a%i' % i, b'mn') for i in range(20)])
+error('hashdb.HashDB.insert, rehashing, does not work', len(db.list([])) == 24 and db.fetch([], ['a19']) == [('a19', b'mn')])
+
+
+# Databases stored with another storage engine are read as they are, and converted when they are modified
+os.environ['HOME'] = tmpdir
+os.makedirs(tmpdir + '/spike/var')
+os.makedirs(tmpdir + '/.local/var/spike/var')
+DB = DBCtrl(tmpdir + '/spike')
+legacy = SpikeDB(DB.syspath + 'id_fileid.%i', DB_FILE_ID[1])
+legacy.make([('\x06', b'\x00\x00\x00\x00\x00\x00\x00\x01')])
+files = legacy.files()
+db = DB.open_db(False, DB_PONY_ID, DB_FILE_ID)
+error('dbctrl.DBCtrl.open_db, reading another storage engine, does not work',
+      isinstance(db, SpikeDB) and (legacy.files() == files) and (db.fetch([], ['\x06'])[0][1] is not None))
+transaction = DB.transaction()
+transaction.insert(False, DB_PONY_ID, DB_FILE_ID, [('\x07', b'\x00\x00\x00\x00\x00\x00\x00\x02')])
+transaction.commit()
+db = DBCtrl(tmpdir + '/spike').open_db(False, DB_PONY_ID, DB_FILE_ID)
+got = [value for (_, value) in db.fetch([], ['\x06', '\x07'])]
+error('dbctrl.DBCtrl.open_db, converting when modified, does not work',
+      isinstance(db, IntDB) and (legacy.files() == []) and (len(got) == 2) and (None not in got))
+
+# Raw integers that only differ in trailing zero bytes must not be merged by another storage engine
+keys = [DBCtrl.value_convert(DBCtrl.int_bytes(n, 4), CONVERT_INT) for n in (65536, 16777216)]
+values = [DBCtrl.int_bytes(n, DB_PONY_ID[1]) for n in (1, 2)]
+transaction = DB.transaction()
+transaction.insert(False, DB_FILE_ID, DB_PONY_ID, list(zip(keys, values)))
+transaction.commit()
+for engine in (DB_ENGINE_SPIKE, DB_ENGINE_HASH):
+    try:
+        DB.convert(False, DB_FILE_ID, DB_PONY_ID, engine)
+        error('dbctrl.DBCtrl.convert, integer keys to %s, does not work' % engine)
+    except Exception:
+        pass
+DB.convert(False, DB_FILE_ID, DB_PONY_ID, DB_ENGINE_INT)
+got = DBCtrl(tmpdir + '/spike').open_db(False, DB_FILE_ID, DB_PONY_ID).fetch([], keys)
+error('dbctrl.DBCtrl.convert, integer keys, does not work', got == list(zip(keys, values)))
+
+# Erasing a pony that owns an entire directory, the directory is kept while another pony has files below it
+fileid = lambda n : DBCtrl.int_bytes(n, DB_FILE_ID[1])
+transaction = DB.transaction()
+transaction.insert(False, DB_PONY_ID, DB_FILE_ID, [('\x08', fileid(n)) for n in (256, 65536)])
+transaction.insert(False, DB_FILE_NAME(-1), DB_FILE_ID, [('/usr/share/foo', fileid(256)), ('/usr/share/foo/a', fileid(65536))])
+transaction.commit()
+id_fileid = DBCtrl.tablise({}, DB.open_db(False, DB_PONY_ID, DB_FILE_ID).fetch([], ['\x08']), DB_FILE_ID, None)
+files_db = DB.open_db(False, DB_FILE_NAME(-1), DB_FILE_ID)
+error('dbctrl.DBCtrl.foreign_below, owned files, does not work', not DBCtrl.foreign_below(files_db, '/usr/share/foo', id_fileid['\x08']))
+transaction = DB.transaction()
+transaction.insert(False, DB_FILE_NAME(-1), DB_FILE_ID, [('/usr/share/foo/b', fileid(3))])
+transaction.commit()
+files_db = DB.open_db(False, DB_FILE_NAME(-1), DB_FILE_ID)
+error('dbctrl.DBCtrl.foreign_below, foreign files, does not work', DBCtrl.foreign_below(files_db, '/usr/share/foo', id_fileid['\x08']))
+
+# An interrupted commit is rolled back if its journal is incomplete, and completed from its journal otherwise
+journal = DB.syspath.replace('%%', '%') + DB_JOURNAL
+for (complete, key) in ((False, '\x09'), (True, '\x0a')):
+    renames = DB.open_db(False, DB_PONY_ID, DB_FILE_ID, True).prepare([(key, DELTA_INSERT, fileid(9))])
+    with open(journal, 'wb') as file:
+        for (temporary, final) in renames:
+            file.write(('%s\0%s\0' % (temporary, final)).encode('utf-8'))
+        if complete:
+            file.write(bytes([0]))
+    got = DBCtrl(tmpdir + '/spike').open_db(False, DB_PONY_ID, DB_FILE_ID).fetch([], [key])
+    error('dbctrl.DBTransaction.recover, %s journal, does not work' % ('complete' if complete else 'incomplete'),
+          ((got[0][1] is not None) == complete) and (os.path.exists(renames[0][0]) != complete) and (os.path.getsize(journal) == 0))
+
+# A pinned reader keeps its generation while writers publish new ones, and the generation is removed when it is unpinned
+os.makedirs(tmpdir + '/gens/var')
+prefix = DBCtrl.prefixes(tmpdir + '/gens')[0]
+def write(key):
+    DBSnapshot.begin(prefix, True)
+    transaction = DBCtrl(tmpdir + '/gens').transaction()
+    transaction.insert(False, DB_PONY_ID, DB_FILE_ID, [(key, fileid(1))])
+    transaction.commit()
+    DBSnapshot.end()
+write('\x01')
+DBSnapshot.begin(prefix, False)
+reader = DBCtrl(tmpdir + '/gens')
+(pins, DBSnapshot.pins) = (DBSnapshot.pins, {}) # Another process
+write('\x02')
+DBSnapshot.pins = pins
+got = [value is not None for (_, value) in reader.open_db(False, DB_PONY_ID, DB_FILE_ID).fetch([], ['\x01', '\x02'])]
+error('dbctrl.DBSnapshot.begin, pinned generation, does not work', got == [True, False])
+DBSnapshot.end()
+got = [value is not None for (_, value) in DBCtrl(tmpdir + '/gens').open_db(False, DB_PONY_ID, DB_FILE_ID).fetch([], ['\x01', '\x02'])]
+error('dbctrl.DBSnapshot.end, publishing, does not work', got == [True, True])
+write('\x03')
+error('dbctrl.DBSnapshot.end, removing unpinned generations, does not work',
+      (not os.path.exists(reader.syspath.replace('%%', '%'))) and os.path.exists(DBSnapshot.resolve(prefix)))
+
+
+
+shutil.rmtree(tmpdir)
+
+
+if errno == 0:
+    print('\033[32m%s\033[00m' % 'Everyting seems to be working')
+exit(errno)
+
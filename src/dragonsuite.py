@@ -476,7 +476,8 @@ def rm(path, recursive = False, directories = False):
         if not recursive:
             if directories and os.path.isdir(p):
                 os.rmdir(p)
-            elif get('shred', None) is not None:
+            elif (get('shred', None) is not None) and (os.lstat(p).st_nlink == 1):
+                # Files with other hard links are only unlinked, shred:ing them would destroy the other links' content
                 execute(get('shred').split(' ') + [p], fail = True)
             else:
                 os.remove(p)
@@ -1283,24 +1284,23 @@ def bash_escape(*word):
         return tuple(rc)
 
 
-def sha3sum(files):
+def sha3sum(files, jobs = None, cached = True):
     '''
     Calculate the Keccak[] sum of one or more files
     
+    Multiple files are hashed in parallel, largest file first
+    
     @param   files:str|itr<str>  The files
+    @param   jobs:int?           The highest number of files to hash at the same time, `None` for the default
+    @param   cached:bool         Whether to use checksums cached by spike, rather than reading files that have not been modified
     @return  :str|list<str>      The sums, will be an string if the input as a string
     '''
-    sha3 = SHA3()
+    from scales.checksummer import Checksummer
     if isinstance(files, str):
-        return sha3.digest_file(files)
-    elif len(files) == 0:
-        return []
-    else:
-        rc = [sha3.digest_file(files[0])]
-        for file in files[1:]:
-            sha3.reinitialise()
-            rc.append(sha3.digest_file(file))
-        return rc
+        return sha3sum([files], jobs, cached)[0]
+    files = list(files)
+    checksums = dict(Checksummer.sha3sum(files, jobs, cached))
+    return [checksums[file] for file in files]
 
 
 def patch(patches, strip = 1, forward = True, directory = None):
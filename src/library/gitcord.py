@@ -20,7 +20,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
 import sys
-from subprocess import Popen, PIPE
+import hashlib
+import threading
+from subprocess import Popen, PIPE, TimeoutExpired
+
+
+
+OBJECT_STORE = 'var/lib/objects.git'
+'''
+The shared object store, relative to Spike's location, it is not a cache:
+the repositories that share it depend on its objects, so it must not be deleted
+'''
 
 
 
@@ -73,17 +83,25 @@ class Gitcord():
         return True
     
     
-    def __exec(self, command):
+    def __exec(self, command, timeout = None, output = None):
         '''
         Execute an exterminal command and wait for it to finish, and print output to stderr
         
         @param   command:list<str>  The command
+        @param   timeout:float?     The number of seconds after which the command is killed, `None` for no limit
+        @param   output:file?       The file to which to print the output, `None` for stderr
         @return  :int               Exit value
         '''
         proc = None
+        output = sys.stderr if output is None else output
         try:
-            proc = Popen(command, cwd = self.dir, stdout = sys.stderr, stdin = sys.stdin, stderr = sys.stderr)
-            proc.wait()
+            proc = Popen(command, cwd = self.dir, stdout = output, stdin = sys.stdin, stderr = output)
+            try:
+                proc.wait(timeout)
+            except TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                return 255
             return proc.returncode
         except:
             if proc is not None:
@@ -92,18 +110,20 @@ class Gitcord():
                 return 255
     
     
-    def update_branch(self, verify):
+    def update_branch(self, verify, timeout = None, output = None):
         '''
         Update the current branch in the repository. If git is new enough (>=1.8.2.4), support signature verification.
         
-        @param   verify:bool  Whether to verify signatures, this is important that it could be skipped
-                              because somepony may have missed it and it would not get signed before next tag
-        @return  :bool        Whether the spell casting was successful
+        @param   verify:bool     Whether to verify signatures, this is important that it could be skipped
+                                 because somepony may have missed it and it would not get signed before next tag
+        @param   timeout:float?  The number of seconds after which the update is aborted, `None` for no limit
+        @param   output:file?    The file to which to print the output of git, `None` for stderr
+        @return  :bool           Whether the spell casting was successful
         '''
         args = ['git', 'pull']
         if verify and Gitcord.check_version(1, 8, 2, 4):
             args.append('--verify-signatures')
-        return 0 == self.__exec(args)
+        return 0 == self.__exec(args, timeout, output)
     
     
     def change_branch(self, branch):
@@ -125,10 +145,14 @@ class Gitcord():
         @param   branch:str?     The branch to download
         @return  :bool           Whether the spell casting was successful
         '''
+        command = ['git', 'clone']
+        store = Gitcord.__store()
+        if (store is not None) and Gitcord.__store_fetch(store, repository):
+            command += ['--reference', store]
         if branch is None:
-            return 0 == self.__exec(['git', 'clone', repository, directory])
+            return 0 == self.__exec(command + [repository, directory])
         else:
-            return 0 == self.__exec(['git', 'clone', '--branch', branch, '--single-branch', repository, directory])
+            return 0 == self.__exec(command + ['--branch', branch, '--single-branch', repository, directory])
     
     
     def create_repository(self, directory):
@@ -234,6 +258,9 @@ class Gitcord():
         @return  :bool           Whether the spell casting was successful
         '''
         params = ['git', 'clone', '--single-branch', '--depth', '1']
+        store = Gitcord.__store()
+        if store is not None:
+            params += ['--reference', store]
         if branch is not None:
             params += ['--branch', branch]
         params.append(repository)
@@ -242,6 +269,63 @@ class Gitcord():
         return 0 == self.__exec(params)
     
     
+    def share(self):
+        '''
+        Make the repository use the shared object store, the repository's objects are
+        added to the store and removed from the repository
+        
+        @return  :bool  Whether the spell casting was successful
+        '''
+        store = Gitcord.__store()
+        if store is None:
+            return False
+        try:
+            proc = Popen(['git', 'rev-parse', '--absolute-git-dir'], cwd = self.dir, stdout = PIPE, stdin = sys.stdin, stderr = sys.stderr)
+            gitdir = proc.communicate()[0].decode('utf-8', 'replace').rstrip('\n')
+            if proc.returncode != 0:
+                return False
+        except:
+            return False
+        if not Gitcord.__store_fetch(store, gitdir):
+            return False
+        alternates = gitdir + '/objects/info/alternates'
+        objects = store + '/objects'
+        try:
+            have = []
+            if os.path.exists(alternates):
+                with open(alternates, 'rb') as file:
+                    have = file.read().decode('utf-8', 'replace').split('\n')
+            if objects not in have:
+                if not os.path.exists(os.path.dirname(alternates)):
+                    os.makedirs(os.path.dirname(alternates))
+                with open(alternates, 'ab') as file:
+                    file.write((objects + '\n').encode('utf-8'))
+        except:
+            return False
+        # Objects that are in the store are not included when repacking locally, and are
+        # removed by prune-packed, repack does not prune if there is nothing to pack
+        if 0 != self.__exec(['git', 'repack', '-a', '-d', '-l', '-q']):
+            return False
+        return 0 == self.__exec(['git', 'prune-packed', '-q'])
+    
+    
+    @staticmethod
+    def repack_store():
+        '''
+        Repack the shared object store, objects that are no longer referenced are kept
+        because repositories that use the store may still need them
+        
+        @return  :bool  Whether the spell casting was successful
+        '''
+        store = Gitcord.__store()
+        if store is None:
+            return False
+        gitcord = Gitcord(store)
+        if 0 != gitcord.__exec(['git', '--git-dir', store, 'repack', '-a', '-d', '-k', '-q']):
+            return False
+        return 0 == gitcord.__exec(['git', '--git-dir', store, 'pack-refs', '--all'])
+    
+    
     def stash(self):
         '''
         Stash all uncommited staged changes
@@ -306,66 +390,175 @@ class Gitcord():
         
         @return  :str?  Get the hash of the current commit, `None` on error
         '''
-        proc = None
-        out = None
+        rc = self.__batch('HEAD')
+        return None if rc is None else rc[0]
+    
+    
+    def read_file(self, commit, filename):
+        '''
+        Read a file as it is in a commit, without checking out the commit
+        
+        @param   commit:str    The commit
+        @param   filename:str  The file, relative to the root of the repository
+        @return  :bytes?       The content of the file, `None` if it does not exist or on error
+        '''
+        rc = self.__batch('%s:%s' % (commit, filename))
+        return None if (rc is None) or (rc[1] != 'blob') else rc[2]
+    
+    
+    def rev_list(self, since = None, until = None):
+        '''
+        Get the commits since another commit
+        
+        @param   since:str?   The other commit, `None` if since and including the first commit
+        @param   until:str?   The last commit, `None` for the current commit
+        @return  :list<str>?  The hashes of the commits, the newest first, `None` on error
+        '''
+        until = 'HEAD' if until is None else until
+        out = self.__read(['git', 'rev-list', until if since is None else '%s..%s' % (since, until), '--'])
+        return None if out is None else out.decode('utf-8', 'replace').split()
+    
+    
+    def what_changed(self, since, until = None):
+        '''
+        Get changes since another commit
+        
+        @param   since:str?                                            The other commit, `None` if since and including the first commit
+        @param   until:str?                                            The last commit, `None` for the current commit
+        @return  :list<[filename:str, old_mode:int?, new_mode:int?]>?  Updated files, `None` on error
+        '''
+        until = self.where_am_i() if until is None else until
+        if until is None:
+            return None
+        # Only the two trees are compared, rather than each commit in between
+        if since is None:
+            out = self.__read(['git', 'ls-tree', '-r', '-z', '--full-tree', until])
+        else:
+            out = self.__read(['git', 'diff-tree', '-r', '-z', since, until, '--'])
+        if out is None:
+            return None
+        out = out.decode('utf-8', 'replace').split('\0')
+        rc = []
+        if since is None:
+            for line in out:
+                if '\t' in line:
+                    (info, filename) = line.split('\t', 1)
+                    rc.append([filename, None, int(info.split(' ')[0])])
+        else:
+            for i in range(0, len(out) - 1, 2):
+                (old_mode, new_mode, _1, _2, action) = out[i][1:].split(' ')
+                old_mode = None if action == 'A' else int(old_mode)
+                new_mode = None if action == 'D' else int(new_mode)
+                rc.append([out[i + 1], old_mode, new_mode])
+        return rc
+    
+    
+    @staticmethod
+    def close_batches():
+        '''
+        Stop the git processes that are kept running for reading objects
+        '''
+        with Gitcord.batch_lock:
+            for proc in Gitcord.batches.values():
+                try:
+                    proc.stdin.close()
+                    proc.wait()
+                except:
+                    pass
+            Gitcord.batches = {}
+    
+    
+    
+    def __read(self, command):
+        '''
+        Execute an exterminal command and wait for it to finish, and get its output
+        
+        @param   command:list<str>  The command
+        @return  :bytes?            The output of the command, `None` on error
+        '''
         try:
-            command = 'git log --pretty=format:%H'.split(' ')
             proc = Popen(command, cwd = self.dir, stdout = PIPE, stdin = sys.stdin, stderr = sys.stderr)
-            out = proc.communicate()[0].decode('utf-8', 'replace')
+            out = proc.communicate()[0]
             if proc.returncode != 0:
                 return None
         except:
             return None
-        return out.split('\n')[0]
+        return out
     
     
-    def what_changed(self, since):
+    def __batch(self, name):
         '''
-        Get changes since another commit
+        Look up an object using a git process that is kept running for the repository
         
-        @param   since:str?                                            The other commit, `None` if since and including the first commit
-        @return  :list<[filename:str, old_mode:int?, new_mode:int?]>?  Updated files, `None` on error
+        @param   name:str             The name of the object, such as ‘HEAD’ or ‘<commit>:<file>’
+        @return  :(str, str, bytes)?  The hash, the type and the content of the object, `None` if it does not exist or on error
         '''
-        proc = None
-        out = None
+        if '\n' in name:
+            return None
+        with Gitcord.batch_lock:
+            key = os.path.realpath(self.dir)
+            proc = Gitcord.batches.get(key, None)
+            try:
+                if (proc is None) or (proc.poll() is not None):
+                    proc = Popen(['git', 'cat-file', '--batch'], cwd = key, stdout = PIPE, stdin = PIPE, stderr = sys.stderr)
+                    Gitcord.batches[key] = proc
+                proc.stdin.write((name + '\n').encode('utf-8'))
+                proc.stdin.flush()
+                header = proc.stdout.readline().decode('utf-8', 'replace').rstrip('\n').split(' ')
+                if len(header) != 3: # ‘<name> missing’ or ‘<name> ambiguous’
+                    return None
+                (sha, objtype, size) = header
+                content = proc.stdout.read(int(size) + 1)[:-1]
+                return (sha, objtype, content)
+            except:
+                if proc is not None:
+                    proc.kill()
+                Gitcord.batches.pop(key, None)
+                return None
+    
+    
+    @staticmethod
+    def __store():
+        '''
+        Get the shared object store, and create it if it does not exist
+        
+        @return  :str?  The shared object store, `None` if not used or if it cannot be created
+        '''
+        store = Gitcord.object_store
+        if (store is None) or os.path.exists(store + '/objects'):
+            return store
         try:
-            command = 'git whatchanged --pretty=format:%H'.split(' ')
-            proc = Popen(command, cwd = self.dir, stdout = PIPE, stdin = sys.stdin, stderr = sys.stderr)
-            out = proc.communicate()[0].decode('utf-8', 'replace')
-            if proc.returncode != 0:
+            if not os.path.exists(os.path.dirname(store)):
+                os.makedirs(os.path.dirname(store))
+            gitcord = Gitcord(os.path.dirname(store))
+            if 0 != gitcord.__exec(['git', 'init', '--bare', '--quiet', store]):
                 return None
+            # Objects may be needed by repositories that use the store even if the store does not reference them
+            for (key, value) in (('gc.auto', '0'), ('gc.pruneExpire', 'never')):
+                if 0 != gitcord.__exec(['git', '--git-dir', store, 'config', key, value]):
+                    return None
         except:
             return None
-        if since is None:
-            since = '*'
-        out = out.split('\n')
-        changes = []
-        for line in out:
-            if line == since:
-                break
-            if line.startswith(':'):
-                changes.append(line[1:])
-        have = {}
-        _rc = []
-        for line in reversed(changes):
-            sep = line.find('\t')
-            (old_mode, new_mode, _1, _2, action) = line[:sep].split(' ')
-            filename = line[sep + 1:]
-            if '\"' in filename:
-                filename = eval(filename)
-            old_mode = None if action == 'A' else int(old_mode)
-            new_mode = None if action == 'D' else int(new_mode)
-            if filename in have:
-                have[filename][2] = new_mode
-            else:
-                entry = [filename, old_mode, new_mode]
-                have[filename] = entry
-                _rc.append(entry)
-        rc = []
-        for entry in _rc:
-            if entry[1] is None:
-                if entry[2] is None:
-                    continue
-            rc.append(entry)
-        return rc
+        return store
+    
+    
+    @staticmethod
+    def __store_fetch(store, repository):
+        '''
+        Fetch the objects of a repository into the shared object store
+        
+        @param   store:str       The shared object store
+        @param   repository:str  The URL or directory of the repository
+        @return  :bool           Whether the spell casting was successful
+        '''
+        # The references are kept, under a namespace for the repository, so that the objects are not unreferenced
+        namespace = hashlib.sha1(repository.encode('utf-8')).hexdigest()
+        refspec = '+refs/*:refs/shared/%s/*' % namespace
+        # The objects are always kept packed, loose objects in the store would not be pruned from the repository
+        return 0 == Gitcord(store).__exec(['git', '--git-dir', store, '-c', 'fetch.unpackLimit=1', 'fetch', '--quiet', repository, refspec])
+
+
+Gitcord.object_store = None
+Gitcord.batches = {}
+Gitcord.batch_lock = threading.Lock()
 
@@ -27,6 +27,9 @@ from scales.bootstrapper import *
 from scales.scrollfinder import *
 from scales.ownerfinder import *
 from scales.claimer import *
+from scales.catalogue import *
+from scales.evaluator import *
+from scales.checksummer import *
 from database.spikedb import *
 from database.dbctrl import *
 from algorithmic.algospike import *
@@ -81,6 +84,9 @@ class LibSpike(LibSpikeHelper):
         @param  shred:bool  Whether to preform secure removal when possible
         '''
         util = lambda u : SPIKE_PATH + 'src/util-replacements/' + u
+        ScrollMagick.bytecode_cache = SPIKE_PATH + BYTECODE_CACHE
+        Gitcord.object_store = SPIKE_PATH + OBJECT_STORE
+        Checksummer.cache_file = SPIKE_PATH + CHECKSUM_CACHE_FILE
         export('SPIKE_SHRED_OPTS', '-n 3 -z -u')
         if shred:
             export('shred', get('SPIKE_SHRED_OPTS'))
@@ -101,6 +107,7 @@ class LibSpike(LibSpikeHelper):
         Perform terminations
         '''
         LibSpike.unlock()
+        Gitcord.close_batches()
     
     
     @staticmethod
@@ -113,11 +120,7 @@ class LibSpike(LibSpikeHelper):
                 addon = SPIKE_PATH + 'add-on/' + addon
                 if (addon[-1] != '~') and os.path.isfile(addon) and os.access(addon, os.R_OK | os.X_OK):
                     try:
-                        code = None
-                        with open(addon, 'rb') as file:
-                            code = file.read().decode('utf8', 'replace') + '\n'
-                            code = compile(code, addon, 'exec')
-                        exec(code, globals())
+                        exec(ScrollMagick.compile_scroll(addon), globals())
                     except:
                         if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
                             import traceback
@@ -125,7 +128,7 @@ class LibSpike(LibSpikeHelper):
     
     
     @staticmethod
-    def bootstrap(aggregator, verify):
+    def bootstrap(aggregator, verify, jobs = None, timeout = None):
         '''
         Update the spike and the scroll archives
         
@@ -133,9 +136,12 @@ class LibSpike(LibSpikeHelper):
                      Feed a directory path and 0 when a directory is enqueued for bootstraping.
                      Feed a directory path and 1 when a directory bootstrap process is beginning.
                      Feed a directory path and 2 when a directory bootstrap process has ended.
+                     Feed a pony and 3 if it is installed and has a new scroll version.
         
-        @param   verify:bool  Whether to verify signatures
-        @return  :byte        Exit value, see description of `LibSpike`, the possible ones are: 0, 12, 24
+        @param   verify:bool     Whether to verify signatures
+        @param   jobs:int?       The highest number of repositories to update concurrently, `None` for the default
+        @param   timeout:float?  The number of seconds after which the update of a repository is aborted, `None` for no limit
+        @return  :byte           Exit value, see description of `LibSpike`, the possible ones are: 0, 12, 24
         '''
         LibSpike.lock(True)
         if not os.path.exists(SPIKE_PATH):
@@ -152,11 +158,71 @@ class LibSpike(LibSpikeHelper):
         Bootstrapper.queue_repositores(repos, repositories, update, aggregator)
         
         # Update Spike and repositories, those that are listed
-        for repo in update:
-            aggregator(repo, 1)
-            if not Bootstrapper.update(repo, verify):
+        if not Bootstrapper.update_all(update, verify, aggregator, jobs, timeout):
+            return 24
+        
+        # Catalogue the scrolls so that they do not need to be executed to read their fields,
+        # only the changes since the last bootstrap are catalogued for git repositories
+        catalogue = Catalogue(SPIKE_PATH)
+        installed_files = LibSpike.locate_all_scrolls(True)
+        changed = catalogue.refresh(LibSpike.locate_all_repositories(False), installed_files)
+        
+        # Find installed ponies with new scroll versions, among the changed scrolls and those found by
+        # earlier bootstraps, the latter are kept until the pony has been updated
+        def load(scrollfiles):
+            for scrollfile in scrollfiles:
+                fields = catalogue.get(scrollfile)
+                if fields is not None:
+                    yield Installer.Scroll(scrollfile, fields)
+        installed = dict((scroll.name, scroll) for scroll in load(installed_files))
+        updates = {}
+        for scroll in load(list(catalogue.get_updates().values()) + changed):
+            if (scroll.name in installed) and (scroll.version != installed[scroll.name].version):
+                updates[scroll.name] = scroll.file
+        for pony in sorted(updates.keys()):
+            aggregator(pony, 3)
+        catalogue.set_updates(updates)
+        
+        return 0
+    
+    
+    @staticmethod
+    def repack(aggregator):
+        '''
+        Make Spike and the scroll repositories use the shared object store, and repack the store
+        
+        @param   aggregator:(str, int)→void
+                     Feed a directory path and 0 when a repository begins using the shared object store.
+                     Feed a directory path and 1 when a repository is using the shared object store.
+                     Feed the shared object store and 2 when it is being repacked.
+                     Feed the shared object store and 3 when it has been repacked.
+        
+        @return  :byte  Exit value, see description of `LibSpike`, the possible ones are: 0, 12, 24
+        '''
+        LibSpike.lock(True)
+        if not os.path.exists(SPIKE_PATH):
+            return 12
+        
+        # Find Spike, the installed super-repository and the scroll repositories, that are git repositories
+        repositories = []
+        candidates = [SPIKE_PATH, SPIKE_PATH + 'installed']
+        candidates += LibSpike.locate_all_repositories(False) + LibSpike.locate_all_repositories(True)
+        for repo in candidates:
+            repo = os.path.realpath(repo)
+            if os.path.exists(repo + '/.git') and (repo not in repositories):
+                repositories.append(repo)
+        
+        # Move the objects of the repositories to the store
+        for repo in repositories:
+            aggregator(repo, 0)
+            if not Gitcord(repo).share():
                 return 24
-            aggregator(repo, 2)
+            aggregator(repo, 1)
+        
+        aggregator(Gitcord.object_store, 2)
+        if not Gitcord.repack_store():
+            return 24
+        aggregator(Gitcord.object_store, 3)
         
         return 0
     
@@ -266,12 +332,12 @@ class LibSpike(LibSpikeHelper):
         '''
         global SPIKE_PATH
         ## TODO checkdepends
-        LibSpike.lock(True)
         # Set root
         if root is not None:
             if root.endswith('/'):
                 root = root[:-1]
             SPIKE_PATH = root + SPIKE_PATH
+        LibSpike.lock(True, spike_path = SPIKE_PATH)
         
         # Information needed in the progress and may only be extended
         installed_info = {}
@@ -288,11 +354,11 @@ class LibSpike(LibSpikeHelper):
         installing = {}
         new_scrolls = make_dictionary([(scroll, None) for scroll in scrolls])
         
-        # Load information about already installed scrolls
-        # TODO this should be better using spikedb
+        # Load information about already installed scrolls, from the catalogue where possible
+        catalogue = Catalogue(SPIKE_PATH)
         aggregator(None, 0)
         try:
-            Installer.load_all_information(private, installed_info, installed_versions, field_installed)
+            Installer.load_all_information(private, installed_info, installed_versions, field_installed, catalogue)
         except:
             if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
                 import traceback
@@ -313,6 +379,7 @@ class LibSpike(LibSpikeHelper):
             aggregator(None, 3)
             
             # Get scroll fields
+            scrollfiles = []
             for scroll in new_scrolls.keys():
                 scrollfile = LibSpikeHelper.locate_scroll(scroll) if new_scrolls[scroll] is None else new_scrolls[scroll]
                 if scrollfile is None:
@@ -320,16 +387,16 @@ class LibSpike(LibSpikeHelper):
                         import traceback
                         traceback.print_exc()
                     return 255 # But, the proofreader already found them...
-                else:
-                    try:
-                        scrollinfo = Installer.load_information(scrollfile)
-                        Installer.transpose_fields(scrollinfo, field_scroll)
-                        scroll_info[scrollinfo.scroll] = scrollinfo
-                    except:
-                        if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
-                            import traceback
-                            traceback.print_exc()
-                        return 255 # But, the proofreader did not have any problem...
+                scrollfiles.append(scrollfile)
+            try:
+                for scrollinfo in Installer.load_multiple_information(scrollfiles, catalogue):
+                    Installer.transpose_fields(scrollinfo, field_scroll)
+                    scroll_info[scrollinfo.scroll] = scrollinfo
+            except:
+                if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
+                    import traceback
+                    traceback.print_exc()
+                return 255 # But, the proofreader did not have any problem...
             
             # Identify scrolls that may not be installed at the same time
             installed = set()
@@ -369,14 +436,12 @@ class LibSpike(LibSpikeHelper):
             
             # Select providers and loop if any was needed
             if len(not_found) > 0:
-                # Read all scrolls so we can find providers
-                # TODO this should be better using spikedb
+                # Read all scrolls so we can find providers, from the catalogue where possible
                 if providers is None:
                     aggregator(None, 7)
                     providers = {}
                     provider_files = {}
-                    for scrollfile in locate_all_scrolls(False):
-                        scroll = Installer.load_information(scrollfile)
+                    for scroll in Installer.load_multiple_information(LibSpike.locate_all_scrolls(False), catalogue):
                         for provides in scroll['provides']:
                             provides.slice_map(providers, scroll.scroll)
                             provider_file[scroll.scroll.full] = scroll.file
@@ -494,12 +559,17 @@ class LibSpike(LibSpikeHelper):
         @return  :byte              Exit value, see description of `LibSpike`, the possible ones are: 0 (TODO)
         '''
         global SPIKE_PATH
-        LibSpike.lock(True)
         # Set root
         if root is not None:
             if root.endswith('/'):
                 root = root[:-1]
             SPIKE_PATH = root + SPIKE_PATH
+        LibSpike.lock(True, spike_path = SPIKE_PATH)
+        
+        # Update the ponies that the last bootstrap found new scroll versions of
+        for pony in sorted(Catalogue(SPIKE_PATH).get_updates().keys()):
+            if pony not in ignores:
+                aggregator(pony, 2)
         
         return 0
     
@@ -521,7 +591,6 @@ class LibSpike(LibSpikeHelper):
         # TODO also remove dependencies, but verify
         
         global SPIKE_PATH
-        LibSpike.lock(True)
         error = 0
         try:
             # Set root
@@ -529,6 +598,10 @@ class LibSpike(LibSpikeHelper):
                 if root.endswith('/'):
                     root = root[:-1]
                 SPIKE_PATH = root + SPIKE_PATH
+            tables = [(DB_PONY_NAME, DB_PONY_ID), (DB_PONY_ID, DB_PONY_NAME), (DB_PONY_ID, DB_PONY_DEPS), (DB_PONY_DEPS, DB_PONY_ID),
+                      (DB_PONY_ID, DB_FILE_ID), (DB_FILE_ID, DB_PONY_ID), (DB_FILE_ID, DB_FILE_ENTIRE),
+                      (DB_FILE_NAME(-1), DB_FILE_ID), (DB_FILE_ID, DB_FILE_NAME(-1))]
+            LibSpike.lock(True, tables, private, SPIKE_PATH)
             
             # Get scroll ID:s and map the transposition
             DB = DBCtrl(SPIKE_PATH)
@@ -569,10 +642,10 @@ class LibSpike(LibSpikeHelper):
                 return error
             
             # Get files for each scroll and check for dependencies
-            sink = DB.open_db(private, DB_PONY_ID, DB_FILE_ID).fetch([], id_scroll.key())
-            id_fileid = transpose({}, sink, DB_FILE_ID, None)
-            sink = DB.open_db(private, DB_PONY_DEPS, DB_PONY_ID).fetch([], id_scroll.key())
-            deps = tablise({}, sink, DB_PONY_ID, None)
+            sink = DB.open_db(private, DB_PONY_ID, DB_FILE_ID).fetch([], id_scroll.keys())
+            id_fileid = DBCtrl.tablise({}, sink, DB_FILE_ID, None)
+            sink = DB.open_db(private, DB_PONY_DEPS, DB_PONY_ID).fetch([], id_scroll.keys())
+            deps = DBCtrl.tablise({}, sink, DB_PONY_ID, None)
             for id in id_scroll.keys():
                 if (id in deps) and (len(deps[id]) > 0):
                     return 28
@@ -586,6 +659,7 @@ class LibSpike(LibSpikeHelper):
             for id in id_scroll.keys():
                 scroll = id_scroll[id]
                 endstate = len(id_fileid[id]) + 7
+                transaction = DB.transaction()
                 
                 # Remove files and remove them from the databases
                 if len(id_fileid[id]):
@@ -593,7 +667,7 @@ class LibSpike(LibSpikeHelper):
                     
                     # Get shared and exclusive files
                     sink = DB.open_db(private, DB_FILE_ID, DB_PONY_ID).fetch([], id_fileid[id])
-                    table = tablise({}, sink, DB_PONY_ID, None)
+                    table = DBCtrl.tablise({}, sink, DB_PONY_ID, None)
                     (shared, exclusive) = ([], [])
                     list_split(table.keys(), lambda x : exclusive if len(x) == 1 else shared)
                     
@@ -606,13 +680,13 @@ class LibSpike(LibSpikeHelper):
                             for ponyid in table[fileid]:
                                 if ponyid != id:
                                     pairs.append((fileid, ponyid))
-                        update(DB.open_db(private, DB_FILE_ID, DB_PONY_ID), [], shared, pairs)
+                        transaction.update(private, DB_FILE_ID, DB_PONY_ID, shared, pairs)
                     
                     # Remove exclusive files
                     if len(exclusive) > 0:
                         # Get filenames
                         sink = DB.open_db(private, DB_FILE_ID, DB_FILE_NAME(-1)).fetch([], exclusive)
-                        table = transpose({}, sink, DB_FILE_NAME(-1), None)
+                        table = DBCtrl.transpose({}, sink, DB_FILE_NAME(-1), None)
                         filenames = []
                         for file in table.keys():
                             sink = DB.open_db(private, DB_FILE_ID, DB_FILE_NAME(file)).fetch([], table[file])
@@ -651,14 +725,20 @@ class LibSpike(LibSpikeHelper):
                                 progress += 1
                                 aggregator(scroll, progress, endstate)
                         sink = DB.open_db(private, DB_FILE_ID, DB_FILE_ENTIRE).fetch([], dirs.keys())
+                        files_db = DB.open_db(private, DB_FILE_NAME(-1), DB_FILE_ID)
                         for (dirid, entire) in sink:
                             if entire is None:
                                 progress += 1
                                 aggregator(scroll, progress, endstate)
                             else:
+                                # Do not remove files, below the directory, that are claimed by other ponies
+                                if DBCtrl.foreign_below(files_db, dirs[dirid], id_fileid[id]):
+                                    progress += 1
+                                    aggregator(scroll, progress, endstate)
+                                    continue
                                 try:
-                                    if filename in backups:
-                                        backup(filename)
+                                    if dirs[dirid] in backups:
+                                        backup(dirs[dirid])
                                     else:
                                         rm(dirs[dirid], recursive = True)
                                 except:
@@ -671,10 +751,10 @@ class LibSpike(LibSpikeHelper):
                         
                         # Remove from database
                         for to in (DB_PONY_ID, DB_FILE_ENTIRE, DB_FILE_NAME(-1)):
-                            DB.open_db(private, DB_FILE_ID, to).remove([], exclusive)
+                            transaction.remove(private, DB_FILE_ID, to, exclusive)
                         for file in table.keys():
-                            DB.open_db(private, DB_FILE_ID, DB_FILE_NAME(file)).remove([], table[file])
-                        DB.open_db(private, DB_FILE_NAME(-1), DB_FILE_ID).remove([], [name for (name, _) in filenames])
+                            transaction.remove(private, DB_FILE_ID, DB_FILE_NAME(file), table[file])
+                        transaction.remove(private, DB_FILE_NAME(-1), DB_FILE_ID, [name for (name, _) in filenames])
                 aggregator(scroll, len(id_fileid[id]) + 1, endstate)
                 
                 # Remove file as a dependee in dependency → scroll database
@@ -685,8 +765,7 @@ class LibSpike(LibSpikeHelper):
                         continue
                     dep = DBCtrl.value_convert(dep, CONVERT_INT)
                     deps.append(dep)
-                db = DB.open_db(private, DB_PONY_DEPS, DB_PONY_ID)
-                sink = db.fetch([], deps)
+                sink = DB.open_db(private, DB_PONY_DEPS, DB_PONY_ID).fetch([], deps)
                 deps = set()
                 pairs = []
                 for (dependency, dependee) in sink:
@@ -695,17 +774,18 @@ class LibSpike(LibSpikeHelper):
                     deps.add(dependency)
                     if DBCtrl.value_convert(dependee, CONVERT_INT) != id:
                         pairs.append((dependency, dependee))
-                update(db, [], list(deps), pairs)
+                transaction.update(private, DB_PONY_DEPS, DB_PONY_ID, list(deps), pairs)
                 aggregator(scroll, len(id_fileid[id]) + 2, endstate)
                 
                 # Remove pony from database
-                DB.open_db(private, DB_PONY_NAME, DB_PONY_ID).remove([], [scroll])
+                transaction.remove(private, DB_PONY_NAME, DB_PONY_ID, [scroll])
                 aggregator(scroll, len(id_fileid[id]) + 3, endstate)
-                DB.open_db(private, DB_PONY_ID, DB_PONY_DEPS).remove([], [id])
+                transaction.remove(private, DB_PONY_ID, DB_PONY_DEPS, [id])
                 aggregator(scroll, len(id_fileid[id]) + 4, endstate)
-                DB.open_db(private, DB_PONY_ID, DB_PONY_NAME).remove([], [id])
+                transaction.remove(private, DB_PONY_ID, DB_PONY_NAME, [id])
                 aggregator(scroll, len(id_fileid[id]) + 5, endstate)
-                DB.open_db(private, DB_PONY_ID, DB_FILE_ID).remove([], [id])
+                transaction.remove(private, DB_PONY_ID, DB_FILE_ID, [id])
+                transaction.commit()
                 aggregator(scroll, len(id_fileid[id]) + 6, endstate)
                 
                 # Remove save scroll file
@@ -909,6 +989,7 @@ class LibSpike(LibSpikeHelper):
         
         allfields = field is None
         fields = list(allowedfields) if allfields else ([field] if isinstance(field, str) else field)
+        catalogue = Catalogue(SPIKE_PATH)
         error = 0
         try:
             # Define arbitrary to str convertion function
@@ -927,13 +1008,16 @@ class LibSpike(LibSpikeHelper):
                     f = None if first is None else first[1:]
                     return [convert(v, f) for v in val]
             
-            for scroll in scrolls:
-                # Set environment variables (re-export before each scroll in case a scroll changes it)
-                ScrollMagick.export_environment()
-                
-                # Locate installed and not installed version of scroll
-                scroll_installed    = None if not    installed else LibSpike.locate_scroll(scroll, True)
-                scroll_notinstalled = None if not notinstalled else LibSpike.locate_scroll(scroll, False)
+            # Locate installed and not installed version of the scrolls
+            located = [(None if not    installed else LibSpike.locate_scroll(scroll, True),
+                        None if not notinstalled else LibSpike.locate_scroll(scroll, False)) for scroll in scrolls]
+            
+            # Fetch fields of scrolls that are not in the catalogue, or have been modified, in parallel
+            scrollfiles = [scrollfile for pair in located for scrollfile in pair if scrollfile is not None]
+            scrollfiles = [scrollfile for scrollfile in scrollfiles if catalogue.get(scrollfile) is None]
+            evaluated = dict(zip(scrollfiles, Evaluator.map(Catalogue.execute, scrollfiles)))
+            
+            for (scroll, (scroll_installed, scroll_notinstalled)) in zip(scrolls, located):
                 if (scroll_installed is None) and (scroll_notinstalled is None):
                     aggregator(scroll, None, None, installed)
                     error = max(error, 6)
@@ -943,28 +1027,30 @@ class LibSpike(LibSpikeHelper):
                 for scrollfile in [scroll_installed, scroll_notinstalled]:
                     if scrollfile is not None:
                         try:
-                            installed = scrollfile is scroll_installed
+                            is_installed = scrollfile is scroll_installed
                             
-                            # Initalise or reset fields to their default values
-                            ScrollMagick.init_fields(globals())
+                            # Fetch fields, from the catalogue unless the scroll has been modified,
+                            # in which case they have been fetched by a worker process
+                            if scrollfile in evaluated:
+                                (values, err) = evaluated[scrollfile]
+                                if err is not None:
+                                    raise err
+                            else:
+                                values = catalogue.get(scrollfile)
+                                if values is None:
+                                    values = Catalogue.execute(scrollfile)
+                            values = dict(values)
                             
                             # Scroll location
-                            global repository, category
-                            repository = scrollfile.split('/')[-3]
-                            category = scrollfile.split('/')[-2]
-                            
-                            # Open installed scroll
-                            if scrollfile == None:
-                                return 6
-                            # Fetch fields
-                            ScrollMagick.execute_scroll(scrollfile, globals())
+                            values['repository'] = scrollfile.split('/')[-3]
+                            values['category'] = scrollfile.split('/')[-2]
                             
                             # Prepare for report
                             for field in fields:
                                 if field not in allowedfields:
-                                    aggregator(scroll, field, None, installed)
+                                    aggregator(scroll, field, None, is_installed)
                                     continue
-                                value = globals()[field]
+                                value = values[field]
                                 value = ScrollMagick.field_display_convert(field, value)
                                 value = convert(value)
                                 if isinstance(value, str):
@@ -974,7 +1060,7 @@ class LibSpike(LibSpikeHelper):
                                 for v in value:
                                     if field not in report:
                                         report[field] = []
-                                    report[field].append((v, installed))
+                                    report[field].append((v, is_installed))
                         except:
                             if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
                                 import traceback
@@ -1009,7 +1095,9 @@ class LibSpike(LibSpikeHelper):
         @return  :byte              Exit value, see description of `LibSpike`, the possible ones are: 0, 10, 11, 12, 27, 255
         '''
         global SPIKE_PATH
-        LibSpike.lock(True)
+        tables = [(DB_PONY_NAME, DB_PONY_ID), (DB_PONY_ID, DB_PONY_NAME), (DB_PONY_ID, DB_FILE_ID), (DB_FILE_ID, DB_PONY_ID),
+                  (DB_FILE_ID, DB_FILE_ENTIRE), (DB_FILE_NAME(-1), DB_FILE_ID), (DB_FILE_ID, DB_FILE_NAME(-1))]
+        LibSpike.lock(True, tables, private)
         
         DB = DBCtrl(SPIKE_PATH)
         files = Claimer.get_files(files, recursiveness == 1)
@@ -1047,11 +1135,12 @@ class LibSpike(LibSpikeHelper):
             return error
         
         # Store scroll name → scroll id and scroll id → scroll name if the pony is not installed
+        transaction = DB.transaction()
         if new:
-            DB.open_db(private, DB_PONY_NAME, DB_PONY_ID).insert([(pony, _id)])
+            transaction.insert(private, DB_PONY_NAME, DB_PONY_ID, [(pony, _id)])
         if new:
             _pony = (pony + '\0' * DB_SIZE_SCROLL)[DB_SIZE_SCROLL:]
-            DB.open_db(private, DB_PONY_ID, DB_PONY_NAME).insert([(_id, _pony)])
+            transaction.insert(private, DB_PONY_ID, DB_PONY_NAME, [(_id, _pony)])
         
         # Fetch file name → file ID and identify files without an assigned ID
         sink = DB.open_db(private, DB_FILE_NAME(-1), DB_FILE_ID).fetch([], files)
@@ -1068,15 +1157,17 @@ class LibSpike(LibSpikeHelper):
             # Assign ID to new files
             (fileid_len, len_fileid_name) = ([], {})
             db = DB.open_db(private, DB_PONY_ID, DB_FILE_ID)
-            ids = [fileid for (_, fileid) in db.list([])]
-            ids.sort()
-            ids = unique(ids)
-            fid = ids[-1] + 1
             start = ((1 << ((DB_SIZE_FILEID << 3) - 1)) if private else 0) -1 
+            fid = start + 1
+            for (_, fileid) in db.iter_items():
+                fid = max(fid, int.from_bytes(fileid, 'big') + 1)
+            ids = None
             (last, jump) = (start, 0)
             for file in files_withoutid:
                 # Look for unused ID:s if the highest is already used
                 if (last != -1) or (fid >> ((DB_SIZE_FILEID << 3) - (0 if private else 1)) > 0):
+                    if ids is None:
+                        ids = unique(sorted(int.from_bytes(fileid, 'big') for (_, fileid) in db.iter_items()))
                     if fid >> (DB_SIZE_FILEID << 3) > 0:
                         last = start
                         jump = 0
@@ -1101,39 +1192,38 @@ class LibSpike(LibSpikeHelper):
                 len_fileid_name[n].append((fileid, name))
             
             # Store file name → file ID
-            db = DB.open_db(private, DB_FILE_NAME(-1), DB_FILE_ID)
-            db.insert([(file, DBCtrl.int_bytes(fileid, DB_SIZE_FILEID)) for (file, fileid) in new_files])
+            transaction.insert(private, DB_FILE_NAME(-1), DB_FILE_ID,
+                               [(file, DBCtrl.int_bytes(fileid, DB_SIZE_FILEID)) for (file, fileid) in new_files])
             
             # Store file ID → file name length
-            db = DB.open_db(private, DB_FILE_ID, DB_FILE_NAME(-1))
-            db.insert([(fileid, DBCtrl.int_bytes(n, DB_SIZE_FILELEN)) for (fileid, n) in fileid_len])
+            transaction.insert(private, DB_FILE_ID, DB_FILE_NAME(-1),
+                               [(fileid, DBCtrl.int_bytes(n, DB_SIZE_FILELEN)) for (fileid, n) in fileid_len])
             
             # Store file ID → file name based on file name length
             for n in len_fileid_name.keys():
-                db = DB.open_db(private, DB_FILE_ID, DB_FILE_NAME(-1)(n))
-                db.insert([(fileid, name) for (fileid, name) in len_fileid_name[n]])
+                transaction.insert(private, DB_FILE_ID, DB_FILE_NAME(n), [(fileid, name) for (fileid, name) in len_fileid_name[n]])
         
         # Store scroll ID → file name ID
-        db = DB.open_db(private, DB_PONY_ID, DB_FILE_ID)
-        db.insert([(_id, DBCtrl.int_bytes(fileid, DB_SIZE_FILEID)) for (file, fileid) in file_id])
+        transaction.insert(private, DB_PONY_ID, DB_FILE_ID, [(_id, DBCtrl.int_bytes(fileid, DB_SIZE_FILEID)) for (file, fileid) in file_id])
         
         # Store --entire information
         if recursiveness == 3:
             _ = bytes([])
-            db = DB.open_db(private, DB_FILE_ID, DB_FILE_ENTIRE)
-            db.insert([(fileid, _) for (file, fileid) in file_id])
+            transaction.insert(private, DB_FILE_ID, DB_FILE_ENTIRE, [(fileid, _) for (file, fileid) in file_id])
         
         # Store file name → owner scroll ID
         inserts = [(fileid, _id) for (file, fileid) in file_id]
-        db = DB.open_db(private, DB_FILE_ID, DB_PONY_ID)
         if force:
             # Keep previous owners if using --force
-            db.fetch(sink, files)
+            DB.open_db(private, DB_FILE_ID, DB_PONY_ID).fetch(sink, files)
             for (a, b) in sink:
                 if b is not None:
                     inserts.append((a, b))
-            db.remove([], files)
-        db.insert(inserts)
+            transaction.remove(private, DB_FILE_ID, DB_PONY_ID, files)
+        transaction.insert(private, DB_FILE_ID, DB_PONY_ID, inserts)
+        
+        # Apply all changes at once
+        transaction.commit()
         return error
     
     
@@ -1149,12 +1239,20 @@ class LibSpike(LibSpikeHelper):
         @return  :byte              Exit value, see description of `LibSpike`, the possible ones are: 0, 27
         '''
         global SPIKE_PATH
-        LibSpike.lock(True)
+        tables = [(DB_PONY_ID, DB_FILE_ID), (DB_FILE_ID, DB_PONY_ID), (DB_FILE_ID, DB_FILE_ENTIRE),
+                  (DB_FILE_NAME(-1), DB_FILE_ID), (DB_FILE_ID, DB_FILE_NAME(-1))]
+        LibSpike.lock(True, tables, private)
         files = [os.path.abspath(file) for file in files]
         DB = DBCtrl(SPIKE_PATH)
         
         # Fetch and map file name → scroll
         db = DB.open_db(private, DB_FILE_NAME(-1), DB_FILE_ID)
+        if recursive:
+            # Claimed files below a directory form a contiguous key range
+            for directory in list(files):
+                prefix = directory if directory.endswith(os.sep) else (directory + os.sep)
+                files += [file for (file, _) in db.scan(prefix)]
+            files = unique(sorted(files))
         fileid_file = DBCtrl.transpose({}, db.fetch([], files), DB_FILE_ID, None)
         sink = []
         def agg(file, scroll):
@@ -1201,11 +1299,11 @@ class LibSpike(LibSpikeHelper):
             for n in ns.keys():
                 removes.append((DB_FILE_ID, DB_FILE_NAME(n), ns[n]))
             for (db_from, db_to, rm_list) in removes:
-                DB.open_db(private, db_from, db_to).remove(error_sink, rm_list)
-            DB.open_db(private, DB_FILE_ID, DB_FILE_ENTIRE).remove([], exclusive)
+                DB.open_db(private, db_from, db_to, True).remove(error_sink, rm_list)
+            DB.open_db(private, DB_FILE_ID, DB_FILE_ENTIRE, True).remove([], exclusive)
             
             # Remove files from listed as installed under their scrolls
-            db = DB.open_db(private, DB_PONY_ID, DB_FILE_ID)
+            db = DB.open_db(private, DB_PONY_ID, DB_FILE_ID, True)
             _id = DBCtrl.value_convert(id, CONVERT_INT)
             sink = db.fetch([], [_id])
             pairs = []
@@ -1218,7 +1316,7 @@ class LibSpike(LibSpikeHelper):
         # Disclaim shared files
         if len(shared) > 0:
             # Fetch ID of scrolls owning shared files
-            db = DB.open_db(private, DB_FILE_ID, DB_PONY_ID)
+            db = DB.open_db(private, DB_FILE_ID, DB_PONY_ID, True)
             sink = db.fetch([], shared)
             
             # Get other owners of a file
@@ -1288,6 +1386,32 @@ class LibSpike(LibSpikeHelper):
         (error, n) = (0, len(scrolls))
         scrollfiles = [(scrolls[i], LibSpikeHelper.locate_scroll(scrolls[i]), i) for i in range(n)]
         
+        tasks = [(scroll, scrollfile) for (scroll, scrollfile, i) in scrollfiles if scrollfile is not None]
+        results = Evaluator.map(LibSpike.proofread_scroll, tasks)
+        for (scroll, scrollfile, i) in scrollfiles:
+            aggregator(scroll, 0, i, n)
+            if scrollfile is None:
+                error = max(error, 6)
+                aggregator(scroll, 1, 'Scroll not found')
+            else:
+                (_, err) = next(results)
+                if err is not None:
+                    error = max(error, 22)
+                    aggregator(scroll, 1, str(err))
+        return error
+    
+    
+    @staticmethod
+    def proofread_scroll(task):
+        '''
+        Look for errors in a scroll, this is performed by the worker processes of `proofread`
+        
+        The scroll is executed in a fresh namespace, an exception is raised for the first error that is found.
+        
+        @param  task:(str, str)  The scroll and the scroll file
+        '''
+        (scroll, scrollfile) = task
+        
         allowed_options = 'strip docs info man licenses changelogs libtool docs= docs=gz docs=xz info= info=gz info=xz man= man=gz man=xz upx'.split(' ')
         method_specs = {'ride'           : 'private',
                         'build'          : 'startdir srcdir pkgdir private',
@@ -1327,120 +1451,105 @@ class LibSpike(LibSpikeHelper):
                 return False
             return ispony(s.name)
         
-        for (scroll, scrollfile, i) in scrollfiles:
-            # Set environment variables (re-export before each scroll in case a scroll changes it)
-            ScrollMagick.export_environment()
-            
-            aggregator(scroll, 0, i, n)
-            if scrollfile is None:
-                error = max(error, 6)
-                aggregator(scroll, 1, 'Scroll not found')
+        # Set environment variables (re-export before each scroll in case a scroll changes it)
+        ScrollMagick.export_environment()
+        
+        # Read scroll
+        globs = dict(globals())
+        ScrollMagick.init_fields(globs)
+        ScrollMagick.init_methods(globs)
+        ScrollMagick.execute_scroll(scrollfile, globs)
+        scrollmagick = ScrollMagick(globs)
+        
+        # TODO look for autoconflicts
+        # Proofread scroll fields
+        scrollmagick.check_type_format('pkgname', False, str, ispony)
+        scrollmagick.check_type_format('pkgver', False, str, lambda x : isscroll('x=' + x))
+        scrollmagick.check_type_format('pkgrel', False, int, lambda x : x >= 1)
+        scrollmagick.check_type_format('epoch', False, int, lambda x : x >= 0)
+        
+        version_a = '%s=%i:%s-%i' % (globs['pkgname'], globs['epoch'], globs['pkgver'], globs['pkgrel'])
+        version_b = scrollfile.replace(os.sep, '/').split('/')[-1][:-len('.scroll')]
+        (version_a, version_b) = (ScrollVersion(version_a), ScrollVersion(version_b))
+        if (version_b.name is False) or ('<' in version_b.full) or ('>' in version_b.full):
+            raise Exception('Scroll file name is badly formated')
+        if version_a not in version_b:
+            raise Exception('Version and name fields conflicts with scroll file name')
+        
+        scrollmagick.check_type_format(['pkgdesc', 'upstream'], True, str, lambda x : len(x) > 0)
+        scrollmagick.check_is_list_format('arch', False, str, lambda x : len(x) > 0)
+        if len(globs['arch']) == 0:
+            raise Exception('Field \'arch\' may not be empty')
+        
+        scrollmagick.check_type_format('freedom', False, int, lambda x : 0 <= x < (1 << 8))
+        scrollmagick.check_is_list_format('license', False, str, lambda x : len(x) > 0)
+        scrollmagick.check_type_format('private', False, int, lambda x : 0 <= x < 3)
+        scrollmagick.check_type('interactive', False, bool)
+        scrollmagick.check_is_list_format(['conflicts', 'replaces', 'provides'], False, str, isscroll)
+        scrollmagick.check_type_format(['extension', 'variant', 'patches'], True, str, ispony)
+        scrollmagick.check_type_format('reason', True, str, lambda x : len(x) > 0)
+        scrollmagick.check_is_list_format(['patchbefore', 'patchafter'], False, str, isscroll)
+        scrollmagick.check_is_list_format('groups', False, str, ispony)
+        scrollmagick.check_is_list_format(['depends', 'makedepends', 'checkdepends', 'optdepends'], False, str, lambda x : len(x) == 0 or isscroll(x))
+        scrollmagick.check_is_list('noextract', False, str)
+        
+        scrollmagick.check_is_list('source', False, str, list)
+        elements = set()
+        for element in globs['source']:
+            if isinstance(element, list):
+                if len(element) < 2:
+                    raise Exception('Lists in field \'source\' must be at least of length 2')
+                for elem in element:
+                    if elem is None:
+                        raise Exception('Lists in field \'source\' may not contain `None`')
+                    elif isinstance(elem, str):
+                        raise Exception('Lists in field \'source\' is restricted to str elements')
+                if len(element[0]):
+                    raise Exception('Source file in field \'source\' may not be empty')
+                element = element[1]
+            if element == '':
+                raise Exception('Destination file in field \'source\' may not be empty')
+            if element in elements:
+                raise Exception('Duplicate destination file \'%s\' in field \'source\'', element)
             else:
-                try:
-                    # Read scroll
-                    globs = globals()
-                    ScrollMagick.init_fields(globs)
-                    ScrollMagick.init_methods(globs)
-                    ScrollMagick.execute_scroll(scrollfile, globs)
-                    scrollmagick = ScrollMagick(globs)
-                    
-                    # TODO look for autoconflicts
-                    # Proofread scroll fields
-                    scrollmagick.check_type_format('pkgname', False, str, ispony)
-                    scrollmagick.check_type_format('pkgver', False, str, lambda x : isscroll('x=' + x))
-                    scrollmagick.check_type_format('pkgrel', False, int, lambda x : x >= 1)
-                    scrollmagick.check_type_format('epoch', False, int, lambda x : x >= 0)
-                    
-                    version_a = '%s=%i:%s-%i' % (pkgname, epoch, pkgver, pkgrel)
-                    version_b = scrollfile.replace(os.sep, '/').split('/')[-1][:-len('.scroll')]
-                    (version_a, version_b) = (ScrollVersion(version_a), ScrollVersion(version_b))
-                    if (version_b.name is False) or ('<' in version_b.full) or ('>' in version_b.full):
-                        raise Exception('Scroll file name is badly formated')
-                    if version_a not in version_b:
-                        raise Exception('Version and name fields conflicts with scroll file name')
-                    
-                    scrollmagick.check_type_format(['pkgdesc', 'upstream'], True, str, lambda x : len(x) > 0)
-                    scrollmagick.check_is_list_format('arch', False, str, lambda x : len(x) > 0)
-                    if len(arch) == 0:
-                        raise Exception('Field \'arch\' may not be empty')
-                    
-                    scrollmagick.check_type_format('freedom', False, int, lambda x : 0 <= x < (1 << 8))
-                    scrollmagick.check_is_list_format('license', False, str, lambda x : len(x) > 0)
-                    scrollmagick.check_type_format('private', False, int, lambda x : 0 <= x < 3)
-                    scrollmagick.check_type('interactive', False, bool)
-                    scrollmagick.check_is_list_format(['conflicts', 'replaces', 'provides'], False, str, isscroll)
-                    scrollmagick.check_type_format(['extension', 'variant', 'patches'], True, str, ispony)
-                    scrollmagick.check_type_format('reason', True, str, lambda x : len(x) > 0)
-                    scrollmagick.check_is_list_format(['patchbefore', 'patchafter'], False, str, isscroll)
-                    scrollmagick.check_is_list_format('groups', False, str, ispony)
-                    scrollmagick.check_is_list_format(['depends', 'makedepends', 'checkdepends', 'optdepends'], False, str, lambda x : len(x) == 0 or isscroll(x))
-                    scrollmagick.check_is_list('noextract', False, str)
-                    
-                    scrollmagick.check_is_list('source', False, str, list)
-                    elements = set()
-                    for element in source:
-                        if isinstance(element, list):
-                            if len(element) < 2:
-                                raise Exception('Lists in field \'source\' must be at least of length 2')
-                            for elem in element:
-                                if elem is None:
-                                    raise Exception('Lists in field \'source\' may not contain `None`')
-                                elif isinstance(elem, str):
-                                    raise Exception('Lists in field \'source\' is restricted to str elements')
-                            if len(element[0]):
-                                raise Exception('Source file in field \'source\' may not be empty')
-                            element = element[1]
-                        if element == '':
-                            raise Exception('Destination file in field \'source\' may not be empty')
-                        if element in elements:
-                            raise Exception('Duplicate destination file \'%s\' in field \'source\'', element)
-                        else:
-                            elements.add(element)
-                    
-                    scrollmagick.check_is_list_format('sha3sums', True, str, lambda x : len(x) == 144 and ishex(x))
-                    if len(sha3sums) != len(source):
-                        raise Exception('Fields \'sha3sums\' and \'source\' must be of same size')
-                    
-                    for field in ('noextract', 'backup'):
-                        have = set()
-                        value = globals()[field]
-                        for element in value:
-                            if element not in elements:
-                                raise Exception('Field \'%s\' may only contain destination files from \'source\'' % field)
-                            if element in have:
-                                raise Exception('Field \'%s\' contains duplicate file \'%s\'', (field, element))
-                            have.add(element)
-                    
-                    scrollmagick.check_is_list_elements('options', False, str, allowed_options)
-                    
-                    # Proofread scroll methods
-                    if ride is None:
-                        raise Exception('Method \'ride\' should be default, in worst case just echo some information')
-                    if package is None:
-                        raise Exception('Method \'package\' must be default, even if does nothing')
-                    
-                    for method in method_specs.keys():
-                        if globals()[method] is None:
-                            continue
-                        (args, varargs, keywords, defaults) = inspect.getargspec(globals()[method])
-                        if varargs  is not None:  raise Exception('Methods should not use varargs (i.e. *variables)')
-                        if keywords is not None:  raise Exception('Methods should not use keywords (i.e. **variables)')
-                        if defaults is not None:  raise Exception('Methods should specify default values for parameters')
-                        params_str = '(%s)' % method_specs[method].replace(' ', ', ')
-                        params_list = list(method_specs[method].split(' '))
-                        if list(args) != params_list:
-                            raise Exception('Method \'%s\' should have the parameters %s with those exact names', (method, params_str))
-                    
-                    # Proofread using extensions
-                    scrollmagick.addon_proofread(scroll, scrollfile)
-                    
-                except Exception as err:
-                    error = max(error, 22)
-                    if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
-                        import traceback
-                        traceback.print_exc()
-                    aggregator(scroll, 1, str(err))
-        return error
+                elements.add(element)
+        
+        scrollmagick.check_is_list_format('sha3sums', True, str, lambda x : len(x) == 144 and ishex(x))
+        if len(globs['sha3sums']) != len(globs['source']):
+            raise Exception('Fields \'sha3sums\' and \'source\' must be of same size')
+        
+        for field in ('noextract', 'backup'):
+            have = set()
+            value = globs[field]
+            for element in value:
+                if element not in elements:
+                    raise Exception('Field \'%s\' may only contain destination files from \'source\'' % field)
+                if element in have:
+                    raise Exception('Field \'%s\' contains duplicate file \'%s\'', (field, element))
+                have.add(element)
+        
+        scrollmagick.check_is_list_elements('options', False, str, allowed_options)
+        
+        # Proofread scroll methods
+        if globs['ride'] is None:
+            raise Exception('Method \'ride\' should be default, in worst case just echo some information')
+        if globs['package'] is None:
+            raise Exception('Method \'package\' must be default, even if does nothing')
+        
+        for method in method_specs.keys():
+            if globs[method] is None:
+                continue
+            (args, varargs, keywords, defaults) = inspect.getfullargspec(globs[method])[:4]
+            if varargs  is not None:  raise Exception('Methods should not use varargs (i.e. *variables)')
+            if keywords is not None:  raise Exception('Methods should not use keywords (i.e. **variables)')
+            if defaults is not None:  raise Exception('Methods should specify default values for parameters')
+            params_str = '(%s)' % method_specs[method].replace(' ', ', ')
+            params_list = list(method_specs[method].split(' '))
+            if list(args) != params_list:
+                raise Exception('Method \'%s\' should have the parameters %s with those exact names', (method, params_str))
+        
+        # Proofread using extensions
+        scrollmagick.addon_proofread(scroll, scrollfile)
     
     
     @staticmethod
@@ -1456,14 +1565,16 @@ class LibSpike(LibSpikeHelper):
         @return  :byte         Exit value, see description of `LibSpike`, the possible ones are: 0, 6, 7, 14(internal bug), 20, 23, 27, 28, 255
         '''
         global SPIKE_PATH
-        LibSpike.lock(True)
+        tables = [(DB_PONY_NAME, DB_PONY_ID), (DB_PONY_ID, DB_PONY_NAME), (DB_PONY_ID, DB_PONY_DEPS), (DB_PONY_DEPS, DB_PONY_ID),
+                  (DB_PONY_ID, DB_FILE_ID), (DB_FILE_ID, DB_PONY_ID), (DB_FILE_ID, DB_FILE_ENTIRE),
+                  (DB_FILE_NAME(-1), DB_FILE_ID), (DB_FILE_ID, DB_FILE_NAME(-1))]
+        LibSpike.lock(True, tables, private) # The same as for `erase`
         # TODO do not clean optionally required packages
         
         # Create id → scroll map
         DB = DBCtrl(SPIKE_PATH)
-        sink = DB.open_db(private, DB_PONY_NAME, DB_PONY_ID).list([])
         id_scroll = {}
-        for (scroll, id) in sink:
+        for (scroll, id) in DB.open_db(private, DB_PONY_NAME, DB_PONY_ID).iter_items():
             id_scroll[id] = scroll
         
         # Queues for removable ponies
@@ -1475,9 +1586,8 @@ class LibSpike(LibSpikeHelper):
             aggregator(id_scroll[id], 0, 1)
         
         # Get all ponies mapped to which packages have those as a dependency
-        sink = DB.open_db(private, DB_PONY_DEP, DB_PONY_ID).list([])
         deps_id = {}
-        for (deps, id) in sink:
+        for (deps, id) in DB.open_db(private, DB_PONY_DEP, DB_PONY_ID).iter_items():
             if deps not in id_scroll:
                 return 27
             if deps not in deps_id:
@@ -1552,25 +1662,57 @@ class LibSpike(LibSpikeHelper):
     
     
     @staticmethod
-    def sha3sum(aggregator, files):
+    def convert_database(aggregator, engine, tables, private = False):
         '''
-        Look for errors in a scrolls
+        Convert databases to another storage engine
+        
+        @param   aggregator:(str, str)→void
+                     Feed a database and its storage engine when the database has been converted.
+        
+        @param   engine:str        The storage engine: ‘int’ for databases keyed by integers, otherwise ‘spike’ or ‘hash’
+        @param   tables:list<str>  The databases, ‘<key type name>_<value type name>’, for example ‘fileid_id’
+        @param   private:bool      Whether to convert private databases rather than shared databases
+        @return  :byte             Exit value, see description of `LibSpike`, the possible ones are: 0, 4
+        '''
+        global SPIKE_PATH
+        if engine not in DB_ENGINE_ALL:
+            return 4
+        types = [DBCtrl.types(table) for table in tables]
+        for type in types:
+            if (type is None) or ((engine == DB_ENGINE_INT) != (type[0][2] == CONVERT_INT)):
+                return 4
+        LibSpike.lock(True)
+        DB = DBCtrl(SPIKE_PATH)
+        for (table, (key, value)) in zip(tables, types):
+            DB.convert(private, key, value, engine)
+            aggregator(table, engine)
+        return 0
+    
+    
+    @staticmethod
+    def sha3sum(aggregator, files, jobs = None, cached = True):
+        '''
+        Calculate the checksums of files, cached checksums are fed to the aggregator first,
+        the other files are hashed in parallel, largest file first, and are fed in that order
         
         @param   aggregator:(str, str?)→void
                      Feed a file and its checksum when one has been calculated.
                      `None` is returned as the checksum if it is not a regular file or does not exist.
         
         @param   files:list<str>  Files for which to calculate the checksum
+        @param   jobs:int?        The highest number of files to hash at the same time, `None` for the default
+        @param   cached:bool      Whether to use cached checksums for files that have not been modified
         @return  :byte            Exit value, see description of `LibSpike`, the possible ones are: 0, 12, 26
         '''
-        (error, sha3) = (0, SHA3())
+        (error, pending) = (0, [])
         for filename in files:
             if (not os.path.exists(filename)) or (not os.path.isfile(filename)):
                 aggregator(filename, None)
                 if error == 0:
                     error = 12 if not os.path.exists(filename) else 26
             else:
-                aggregator(filename, sha3.digest_file(filename));
-                sha3.reinitialise()
+                pending.append(filename)
+        for (filename, checksum) in Checksummer.sha3sum(pending, jobs, cached):
+            aggregator(filename, checksum)
         return error
 
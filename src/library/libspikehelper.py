@@ -19,6 +19,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import urllib.parse
 
 from database.spikedb import *
 from database.dbctrl import *
@@ -54,31 +55,46 @@ class LibSpikeHelper():
         @param   spike_path:str  Spike's location
         @return  :str            The lock file's file name
         '''
-        return '/dev/shm/spike.lock'
-        # /dev/shm/spike.lock is used so all users have access
-        ## FIXME private locks must be supported for non-root
+        return '/dev/shm/spike.%s.lock' % urllib.parse.quote(os.path.realpath(spike_path), safe = '')
+        # /dev/shm is used so all users have access, each Spike location has its own lock file
+        # so that installations to different roots do not wait for each other
     
     
     @staticmethod
-    def lock(exclusive):
+    def lock(exclusive, tables = None, private = False, spike_path = None):
         '''
         Lock concurrent database access lock file
         
-        @param  exclusive:bool  Whether the lock should be exclusive, that is, you are about to do modifications
+        Only modifications lock the lock file, readers are not blocked as they read a
+        snapshot of the databases. If the databases that will be modified are specified,
+        the lock file is shared, and the databases are locked, so that writers that
+        modify different databases do not wait for each other
+        
+        @param  exclusive:bool                                   Whether the lock should be exclusive, that is, you are about to do modifications
+        @param  tables:itr<((str, int, int), (str, int, int))>?  The key type and value type of the databases that will be modified,
+                                                                 `None` for all databases and everything else in Spike's location
+        @param  private:bool                                     Whether `tables` are private databases rather than shared databases
+        @param  spike_path:str?                                  Spike's location, `None` for `SPIKE_PATH`
         '''
+        spike_path = SPIKE_PATH if spike_path is None else spike_path
+        prefixes = DBCtrl.prefixes(spike_path)
+        if not exclusive:
+            for prefix in prefixes:
+                DBSnapshot.begin(prefix, False)
+            return
         import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
-        lockfile = LibSpikeHelper.get_lockfile(SPIKE_PATH)
+        lockfile = LibSpikeHelper.get_lockfile(spike_path)
         if LibSpikeHelper.lock_file is None:
             lockdir = os.path.dirname(lockfile)
             if not os.path.exists(lockdir):
                 mkdir_p(lockdir)
             LibSpikeHelper.lock_file = open(lockfile, 'r' if os.path.exists(lockfile) else 'a')
             LibSpikeHelper.lock_file.flush()
-        locktype = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        locktype = fcntl.LOCK_EX if tables is None else fcntl.LOCK_SH
         try:
             fcntl.flock(LibSpikeHelper.lock_file.fileno(), locktype | fcntl.LOCK_NB)
         except BlockingIOError:
-            if exclusive:
+            if tables is None:
                 print('%s is currently locked.' % lockfile)
             else:
                 print('%s is currently locked for modifications.' % lockfile)
@@ -91,14 +107,22 @@ class LibSpikeHelper():
                     print('    \n'.join(msg.split('\n')))
             print('\nWaiting until all incompatible locks have been relased...')
         fcntl.flock(LibSpikeHelper.lock_file.fileno(), locktype)
+        if tables is None:
+            for prefix in prefixes:
+                DBSnapshot.begin(prefix, True)
+        else:
+            names = [DBCtrl.lock_name(key, value) for (key, value) in tables]
+            DBSnapshot.begin(prefixes[1 if private else 0], True, names)
+            DBSnapshot.begin(prefixes[0 if private else 1], False)
     
     
     @staticmethod
     def unlock():
         '''
-        Unlock concurrent database access lock file
+        Unlock concurrent database access lock file, modifications to the databases are published
         '''
         import fcntl ## We are importing here so other systems do not run into problems and can use a plug-in to implement file locking
+        DBSnapshot.end()
         if LibSpikeHelper.lock_file is not None:
             fcntl.flock(LibSpikeHelper.lock_file.fileno(), fcntl.LOCK_UN)
             LibSpikeHelper.lock_file.close()
@@ -182,16 +206,15 @@ class LibSpikeHelper():
     
     
     @staticmethod
-    def locate_all_scrolls(installed = False, private = None):
+    def locate_all_repositories(installed = False, private = None):
         '''
-        Locate the file for each and every scroll
+        Locate each and every scroll repository
         
         @parm    installed:bool  Whether the scrolls are installed
         @parm    private:bool?   Whether the scrolls are installed privately, `None` for whatever
-        @return  :list<str>      The file of each scroll
+        @return  :list<str>      The real path of each repository
         '''
-        # Get repository paths
-        repositories = set()
+        repositories = []
         superrepo = 'installed' if installed else 'repositories'
         home = os.environ['HOME'].replace(os.sep, '/') + '/'
         while '//' in home:
@@ -204,15 +227,24 @@ class LibSpikeHelper():
                 for repo in os.listdir(file):
                     repo = os.path.realpath(file + '/' + repo)
                     if os.path.isdir(repo) and (repo not in repositories):
-                        repositories.add(repo)
+                        repositories.append(repo)
+        return repositories
+    
+    
+    @staticmethod
+    def locate_repository_scrolls(repository):
+        '''
+        Locate the file for each scroll in a repository
         
+        @param   repository:str  The repository
+        @return  :list<str>      The file of each scroll
+        '''
         # Get category paths
         paths = []
-        for repo in repositories:
-            for cat in os.listdir(repo):
-                path = '%s/%s' % (repo, cat)
-                if os.path.isdir(path):
-                    paths.append(path)
+        for cat in os.listdir(repository):
+            path = '%s/%s' % (repository, cat)
+            if os.path.isdir(path):
+                paths.append(path)
         
         # Get scrolls
         rc = []
@@ -224,6 +256,21 @@ class LibSpikeHelper():
         return rc
     
     
+    @staticmethod
+    def locate_all_scrolls(installed = False, private = None):
+        '''
+        Locate the file for each and every scroll
+        
+        @parm    installed:bool  Whether the scrolls are installed
+        @parm    private:bool?   Whether the scrolls are installed privately, `None` for whatever
+        @return  :list<str>      The file of each scroll
+        '''
+        rc = []
+        for repo in LibSpikeHelper.locate_all_repositories(installed, private):
+            rc += LibSpikeHelper.locate_repository_scrolls(repo)
+        return rc
+    
+    
     @staticmethod
     def locate_scroll(scroll, installed = False, private = None):
         '''
@@ -19,10 +19,22 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import sys
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from library.gitcord import *
 
 
+
+BOOTSTRAP_JOBS = 4
+'''
+The default number of repositories to update concurrently
+'''
+
+
+
 class Bootstrapper():
     '''
     Module for libspike for bootstrapping
@@ -64,11 +76,60 @@ class Bootstrapper():
     
     
     @staticmethod
-    def update(repository, verify_signatures):
+    def update(repository, verify_signatures, timeout = None, output = None):
         '''
         @param   repository:str          The repository to update
         @param   verify_signatures:bool  Whether to verify signatures
+        @param   timeout:float?          The number of seconds after which the update is aborted, `None` for no limit
+        @param   output:file?            The file to which to print the output of git, `None` for stderr
         @return  :bool                   Whether the update was successful
         '''
-        return Gitcord(repository).update_branch(verify_signatures)
+        return Gitcord(repository).update_branch(verify_signatures, timeout, output)
+    
+    
+    @staticmethod
+    def update_all(repositories, verify_signatures, aggregator, jobs = None, timeout = None):
+        '''
+        Update repositories concurrently, the updates are reported, and their output is printed, in order
+        
+        If an update fails, no more updates are started, but the updates that have already been started
+        are finished, and those that were successful are reported.
+        
+        @param   repositories:list<str>      The repositories to update
+        @param   verify_signatures:bool      Whether to verify signatures
+        @param   aggregator:(str, int)→void  Feed a repository and 1 when its update is reported as beginning, and 2 when it has ended
+        @param   jobs:int?                   The highest number of concurrent updates, `None` for `BOOTSTRAP_JOBS`
+        @param   timeout:float?              The number of seconds after which an update is aborted, `None` for no limit
+        @return  :bool                       Whether all updates were successful
+        '''
+        def update(repository):
+            output = tempfile.TemporaryFile()
+            try:
+                return (Bootstrapper.update(repository, verify_signatures, timeout, output), output)
+            except:
+                return (False, output)
+        
+        def report(repository, future):
+            aggregator(repository, 1)
+            (success, output) = future.result()
+            with output:
+                output.seek(0)
+                sys.stderr.flush()
+                shutil.copyfileobj(output, sys.stderr.buffer)
+                sys.stderr.buffer.flush()
+            if success:
+                aggregator(repository, 2)
+            return success
+        
+        with ThreadPoolExecutor(BOOTSTRAP_JOBS if jobs is None else jobs) as executor:
+            futures = [executor.submit(update, repository) for repository in repositories]
+            for i in range(len(repositories)):
+                if not report(repositories[i], futures[i]):
+                    for future in futures[i + 1:]:
+                        future.cancel()
+                    for (repository, future) in zip(repositories[i + 1:], futures[i + 1:]):
+                        if not future.cancelled():
+                            report(repository, future)
+                    return False
+        return True
 
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import marshal
+
+from auxiliary.scrollmagick import *
+from library.gitcord import *
+from library.libspikehelper import *
+from scales.evaluator import *
+
+
+
+CATALOGUE_FILE = 'var/cache/catalogue'
+'''
+The catalogue file, relative to Spike's location
+'''
+
+CATALOGUE_COMMITS_FILE = 'var/cache/catalogue-commits'
+'''
+The file with the commit each repository was catalogued at, relative to Spike's location
+'''
+
+CATALOGUE_UPDATES_FILE = 'var/cache/updates'
+'''
+The file with the installed ponies that have new scroll versions, relative to Spike's location
+'''
+
+
+
+class Catalogue():
+    '''
+    Module for libspike for cataloguing scrolls
+    
+    The catalogue holds the fields of scrolls, so that scrolls do not need to
+    be executed to read their fields. It maps from repository to category to
+    scroll file name to the modification time and size of the scroll file and
+    the fields of the scroll. An entry is only used if the scroll file has not
+    been modified since the entry was created.
+    '''
+    
+    def __init__(self, spike_path):
+        '''
+        Constructor
+        
+        @param  spike_path:str  Spike's location
+        '''
+        self.file = spike_path + CATALOGUE_FILE
+        self.commits_file = spike_path + CATALOGUE_COMMITS_FILE
+        self.updates_file = spike_path + CATALOGUE_UPDATES_FILE
+        self.repositories = None
+    
+    
+    def get(self, scrollfile):
+        '''
+        Gets the fields of a scroll from the catalogue
+        
+        @param   scrollfile:str    The scroll file
+        @return  :dict<str, ¿E?>?  The fields of the scroll, `None` if it is not catalogued or has been modified
+        '''
+        if self.repositories is None:
+            self.repositories = Catalogue.__load(self.file)
+        (repo, cat, scroll) = Catalogue.__split(scrollfile)
+        entry = self.repositories.get(repo, {}).get(cat, {}).get(scroll, None)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(scrollfile)
+        except:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != entry[:2]:
+            return None
+        return entry[2]
+    
+    
+    def build(self, scrollfiles):
+        '''
+        Create the catalogue, scrolls that have not been modified since they were catalogued are not executed again
+        
+        @param  scrollfiles:itr<str>  The scroll files to catalogue
+        '''
+        repositories = {}
+        Catalogue.__add(repositories, Catalogue.__load(self.file), scrollfiles)
+        self.__save(repositories, {})
+    
+    
+    def refresh(self, repositories, scrollfiles):
+        '''
+        Update the catalogue with the changes in git repositories since they were last catalogued,
+        a repository is only searched for scrolls if it has not been catalogued before or is not
+        a git repository
+        
+        @param   repositories:itr<str>  The repositories whose scrolls to catalogue
+        @param   scrollfiles:itr<str>   Additional scroll files to catalogue, these are catalogued as by `build`
+        @return  :list<str>             The scroll files in the repositories that have been added or modified, and all scroll files in searched repositories
+        '''
+        old = Catalogue.__load(self.file)
+        commits = Catalogue.__load(self.commits_file)
+        (catalogue, new_commits, changed) = ({}, {}, [])
+        for repo in repositories:
+            repo = os.path.realpath(repo)
+            gitcord = Gitcord(repo)
+            commit = gitcord.where_am_i()
+            (since, changes) = (commits.get(repo, None), None)
+            if (commit is not None) and (since is not None) and (repo in old):
+                changes = [] if since == commit else gitcord.what_changed(since, commit)
+            if commit is not None:
+                new_commits[repo] = commit
+            if changes is None:
+                changed += LibSpikeHelper.locate_repository_scrolls(repo)
+                continue
+            # Keep the unchanged scrolls without looking at them, and forget removed scrolls
+            catalogue[repo] = dict((cat, dict(scrolls)) for (cat, scrolls) in old[repo].items())
+            for (filename, _old_mode, new_mode) in changes:
+                parts = filename.split('/')
+                if (len(parts) != 2) or (not parts[1].endswith('.scroll')) or (parts[1][:1] in ('.', '-', '')):
+                    continue
+                (cat, scroll) = parts
+                catalogue[repo].get(cat, {}).pop(scroll, None)
+                if new_mode is not None:
+                    changed.append('%s/%s/%s' % (repo, cat, scroll))
+        Catalogue.__add(catalogue, old, changed + list(scrollfiles))
+        self.__save(catalogue, new_commits)
+        return [scrollfile for scrollfile in changed if os.path.exists(scrollfile)]
+    
+    
+    def get_updates(self):
+        '''
+        Gets the installed ponies that have new scroll versions, as found by the last bootstrap
+        
+        @return  :dict<str, str>  Map from pony name to the file of the new scroll
+        '''
+        return Catalogue.__load(self.updates_file)
+    
+    
+    def set_updates(self, updates):
+        '''
+        Sets the installed ponies that have new scroll versions
+        
+        @param  updates:dict<str, str>  Map from pony name to the file of the new scroll
+        '''
+        if not os.path.exists(os.path.dirname(self.updates_file)):
+            os.makedirs(os.path.dirname(self.updates_file))
+        with open(self.updates_file + '~', 'wb') as file:
+            marshal.dump(updates, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.rename(self.updates_file + '~', self.updates_file)
+    
+    
+    @staticmethod
+    def execute(scrollfile):
+        '''
+        Get the fields of a scroll, the scroll is only executed if its fields cannot be extracted without executing it
+        
+        @param   scrollfile:str   The scroll file
+        @return  :dict<str, ¿E?>  The fields of the scroll
+        '''
+        rc = ScrollMagick.extract_fields(scrollfile)
+        if rc is not None:
+            return rc
+        ScrollMagick.export_environment()
+        fields = {}
+        ScrollMagick.init_fields(fields)
+        globs = dict(globals())
+        globs.update(fields)
+        ScrollMagick.execute_scroll(scrollfile, globs)
+        return dict((field, globs[field]) for field in fields)
+    
+    
+    
+    def __save(self, repositories, commits):
+        '''
+        Write the catalogue
+        
+        @param  repositories:dict<str, dict<str, dict<str, (int, int, dict<str, ¿E?>)>>>  The catalogue
+        @param  commits:dict<str, str>                                                    The commit each repository was catalogued at
+        '''
+        if not os.path.exists(os.path.dirname(self.file)):
+            os.makedirs(os.path.dirname(self.file))
+        # The catalogue is written first, so that a repository is not
+        # thought to have been catalogued if writing the catalogue failed
+        for (file, data) in ((self.file, repositories), (self.commits_file, commits)):
+            with open(file + '~', 'wb') as wfile:
+                marshal.dump(data, wfile)
+                wfile.flush()
+                os.fsync(wfile.fileno())
+            os.rename(file + '~', file)
+        self.repositories = repositories
+    
+    
+    @staticmethod
+    def __add(repositories, old, scrollfiles):
+        '''
+        Add scrolls to a catalogue, scrolls that have not been modified since they were catalogued
+        are not executed again, the others are executed in parallel
+        
+        @param  repositories:dict<str, dict<str, dict<str, (int, int, dict<str, ¿E?>)>>>  The catalogue to fill
+        @param  old:dict<str, dict<str, dict<str, (int, int, dict<str, ¿E?>)>>>           The old catalogue
+        @param  scrollfiles:itr<str>                                                      The scroll files to catalogue
+        '''
+        (entries, pending) = ([], [])
+        for scrollfile in scrollfiles:
+            (repo, cat, scroll) = Catalogue.__split(scrollfile)
+            try:
+                stat = os.stat(scrollfile)
+            except:
+                continue
+            entry = old.get(repo, {}).get(cat, {}).get(scroll, None)
+            if (entry is None) or ((stat.st_mtime_ns, stat.st_size) != entry[:2]):
+                entry = (stat.st_mtime_ns, stat.st_size, None)
+                pending.append((len(entries), scrollfile))
+            entries.append([repo, cat, scroll, entry])
+        results = Evaluator.map(Catalogue.execute, [scrollfile for (_, scrollfile) in pending])
+        for ((i, scrollfile), (fields, err)) in zip(pending, results):
+            entries[i][3] = entries[i][3][:2] + (fields,)
+            try:
+                if err is not None:
+                    raise err
+                marshal.dumps(entries[i][3]) # Scrolls with fields that cannot be stored are not catalogued
+            except:
+                if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
+                    import traceback
+                    traceback.print_exc()
+                entries[i][3] = None
+        for (repo, cat, scroll, entry) in entries:
+            if entry is None:
+                continue
+            if repo not in repositories:
+                repositories[repo] = {}
+            if cat not in repositories[repo]:
+                repositories[repo][cat] = {}
+            repositories[repo][cat][scroll] = entry
+    
+    
+    @staticmethod
+    def __load(file):
+        '''
+        Read the catalogue
+        
+        @param   file:str                                                      The catalogue file
+        @return  :dict<str, dict<str, dict<str, (int, int, dict<str, ¿E?>)>>>  The catalogue, empty if it cannot be read
+        '''
+        try:
+            with open(file, 'rb') as rfile:
+                return marshal.load(rfile)
+        except:
+            return {}
+    
+    
+    @staticmethod
+    def __split(scrollfile):
+        '''
+        Split the file name of a scroll into its repository, category and file name
+        
+        @param   scrollfile:str    The scroll file
+        @return  :(str, str, str)  The repository, the category and the file name of the scroll
+        '''
+        (path, scroll) = os.path.split(scrollfile)
+        (repo, cat) = os.path.split(path)
+        return (os.path.realpath(repo), cat, scroll)
+
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import marshal
+
+from algorithmic.sha3sum import *
+from scales.evaluator import *
+
+
+
+CHECKSUM_CACHE_FILE = 'var/cache/checksums'
+'''
+The checksum cache file, relative to Spike's location
+'''
+
+CHECKSUM_CACHE_SIZE = 4096
+'''
+The highest number of checksums to keep in the checksum cache, the least recently used are dropped first
+'''
+
+
+
+class Checksummer():
+    '''
+    Module for libspike for calculating checksums of files
+    
+    The files are hashed in parallel, and the checksums are cached by the
+    device, inode, size, modification time and status change time of the
+    files, so that a file is not read again as long as it is not modified.
+    '''
+    
+    @staticmethod
+    def sha3sum(files, jobs = None, cached = True):
+        '''
+        Calculate the checksums of files, cached checksums are returned first,
+        the other files are hashed in parallel, largest file first
+        
+        @param   files:itr<str>    The files, they must be regular files
+        @param   jobs:int?         The highest number of files to hash at the same time, `None` for the default
+        @param   cached:bool       Whether to use cached checksums, the cache is updated either way
+        @return  :itr<(str, str)>  The files and their checksums, in uppercase hexadecimal, in the order they were calculated
+        '''
+        cache = Checksummer.__load()
+        (pending, dirty) = ([], False)
+        for filename in files:
+            identity = Checksummer.__identity(filename)
+            checksum = cache.pop(identity, None) if cached else None
+            if checksum is None:
+                pending.append((identity, filename))
+            else:
+                cache[identity] = checksum # Mark as most recently used
+                dirty = True
+                yield (filename, checksum)
+        # A file cannot be split between workers, so the largest files are started first
+        pending.sort(key = lambda item : -item[0][2])
+        try:
+            results = Evaluator.map(Checksummer.digest_file, [filename for (_, filename) in pending], jobs, 1)
+            for ((identity, filename), (checksum, err)) in zip(pending, results):
+                if err is not None:
+                    raise err
+                # The checksum is not cached if the file was modified while it was hashed
+                if Checksummer.__identity(filename) == identity:
+                    cache.pop(identity, None)
+                    cache[identity] = checksum
+                    dirty = True
+                yield (filename, checksum)
+        finally:
+            if dirty:
+                Checksummer.__save(cache)
+    
+    
+    @staticmethod
+    def digest_file(filename):
+        '''
+        Calculate the checksum of a file, this is performed by the worker processes
+        
+        @param   filename:str  The file
+        @return  :str          The checksum in uppercase hexadecimal
+        '''
+        return SHA3().digest_file(filename)
+    
+    
+    
+    @staticmethod
+    def __identity(filename):
+        '''
+        Gets the key of a file in the checksum cache
+        
+        @param   filename:str                The file
+        @return  :(int, int, int, int, int)  The device, inode, size, modification time and status change time of the file
+        '''
+        stat = os.stat(filename)
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+    
+    
+    @staticmethod
+    def __load():
+        '''
+        Read the checksum cache
+        
+        @return  :dict<(int, int, int, int, int), str>  The checksum cache, least recently used first, empty if it cannot be read or is disabled
+        '''
+        if Checksummer.cache_file is None:
+            return {}
+        try:
+            with open(Checksummer.cache_file, 'rb') as file:
+                return marshal.load(file)
+        except:
+            return {}
+    
+    
+    @staticmethod
+    def __save(cache):
+        '''
+        Write the checksum cache, unless it is disabled
+        
+        @param  cache:dict<(int, int, int, int, int), str>  The checksum cache, least recently used first
+        '''
+        if Checksummer.cache_file is None:
+            return
+        for identity in list(cache.keys())[:max(0, len(cache) - CHECKSUM_CACHE_SIZE)]:
+            del cache[identity]
+        try:
+            if not os.path.exists(os.path.dirname(Checksummer.cache_file)):
+                os.makedirs(os.path.dirname(Checksummer.cache_file))
+            with open(Checksummer.cache_file + '~', 'wb') as file:
+                marshal.dump(cache, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.rename(Checksummer.cache_file + '~', Checksummer.cache_file)
+        except:
+            pass # The cache is only an optimisation, the checksums are still correct
+
+
+Checksummer.cache_file = None
+
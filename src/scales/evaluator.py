@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+spike – a package manager running on top of git
+
+Copyright © 2012, 2013, 2014  Mattias Andrée (maandree@member.fsf.org)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import pickle
+
+
+
+class Evaluator():
+    '''
+    Module for libspike for evaluating scrolls, and other work, in parallel
+    
+    The scrolls are evaluated by a pool of worker processes, so the evaluation
+    of a scroll cannot affect the evaluation of another scroll or the caller.
+    The results are returned as plain data, in the order of the scrolls.
+    '''
+    
+    @staticmethod
+    def map(function, items, jobs = None, chunksize = None):
+        '''
+        Apply a function to items in worker processes
+        
+        @param   function:(¿I?)→¿O?                    The function, it must be possible to pickle it, so it should be a static method or a module level function
+        @param   items:list<¿I?>                       The items
+        @param   jobs:int?                             The highest number of worker processes, `None` for `Evaluator.jobs`
+        @param   chunksize:int?                        The number of items to send to a worker at a time, `None` to choose from the number of items
+        @return  :itr<(¿O?, (Exception|SystemExit)?)>  The result of the function and the raised exception, if any, for each item, in the order of the items
+        '''
+        jobs = Evaluator.jobs if jobs is None else jobs
+        if jobs is None:
+            jobs = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+        jobs = min(jobs, len(items))
+        context = None
+        if jobs > 1:
+            try:
+                import multiprocessing
+                # Forking lets the workers inherit the loaded add-ons
+                context = multiprocessing.get_context('fork')
+            except (ImportError, ValueError):
+                pass
+        if context is None:
+            for item in items:
+                yield Evaluator.apply((function, item))
+        else:
+            with context.Pool(jobs) as pool:
+                if chunksize is None:
+                    chunksize = max(1, len(items) // (jobs << 4))
+                for rc in pool.imap(Evaluator.apply, [(function, item) for item in items], chunksize):
+                    yield rc
+    
+    
+    @staticmethod
+    def apply(task):
+        '''
+        Apply a function to an item, this is performed by the worker processes
+        
+        @param   task:((¿I?)→¿O?, ¿I?)            The function and the item
+        @return  :(¿O?, (Exception|SystemExit)?)  The result of the function and the raised exception, if any
+        '''
+        (function, item) = task
+        try:
+            return (function(item), None)
+        except (Exception, SystemExit) as err: # Even `SystemExit`, or the worker would die and its result never come, but not interruptions
+            if os.getenv('SPIKE_DEBUG', '').lower() == 'yes':
+                import traceback
+                traceback.print_exc()
+            try:
+                pickle.dumps(err)
+            except Exception:
+                err = Exception(str(err)) # The exception cannot be sent to the caller
+            return (None, err)
+
+
+Evaluator.jobs = None
+
@@ -22,12 +22,14 @@ from algorithmic.algospike import *
 from algorithmic.scrlver import *
 from auxiliary.scrollmagick import *
 from auxiliary.auxfunctions import *
+from scales.catalogue import *
+from scales.evaluator import *
 
 
 
 # Constants
 store_fields = 'pkgname pkgver pkgrel epoch arch freedom private conflicts replaces'
-store_fields += ' provides extension variant patch patchbefore patchafter groups'
+store_fields += ' provides extension variant patches patchbefore patchafter groups'
 store_fields += ' depends makedepends checkdepends optdepends'
 store_fields = store_fields.split(' ')
 
@@ -57,7 +59,7 @@ class Installer():
             Constructor
             
             @param  scrollfile:str          The scroll file
-            @param  globals:dict<str, any>  Should be `globals()`
+            @param  globals:dict<str, any>  Should be `globals()`, or the fields of the scroll from the catalogue
             '''
             # Store fields
             self.fields = {}
@@ -93,13 +95,20 @@ class Installer():
     
     
     @staticmethod
-    def load_information(scrollfile):
+    def load_information(scrollfile, catalogue = None):
         '''
         Load information about a scroll
         
-        @param   scrollfile:str  The scroll file
-        @return  :Scroll         The scroll information
+        @param   scrollfile:str        The scroll file
+        @param   catalogue:Catalogue?  The catalogue of scrolls, the scroll is only executed if it is not in the catalogue
+        @return  :Scroll               The scroll information
         '''
+        fields = None if catalogue is None else catalogue.get(scrollfile)
+        if fields is None:
+            fields = ScrollMagick.extract_fields(scrollfile)
+        if fields is not None:
+            return Installer.Scroll(scrollfile, fields)
+        
         ScrollMagick.export_environment()
         
         globs = globals()
@@ -110,7 +119,27 @@ class Installer():
     
     
     @staticmethod
-    def load_all_information(private, installed_info, installed_versions, field_installed):
+    def load_multiple_information(scrollfiles, catalogue = None):
+        '''
+        Load information about scrolls, scrolls that are not in the catalogue are executed in parallel by worker processes
+        
+        An exception is raised if any of the scrolls cannot be loaded.
+        
+        @param   scrollfiles:list<str>  The scroll files
+        @param   catalogue:Catalogue?   The catalogue of scrolls, only scrolls that are not in the catalogue are executed
+        @return  :list<Scroll>          The scroll information, in the same order as the scroll files
+        '''
+        fields = [None if catalogue is None else catalogue.get(scrollfile) for scrollfile in scrollfiles]
+        pending = [i for i in range(len(scrollfiles)) if fields[i] is None]
+        for (i, (rc, err)) in zip(pending, Evaluator.map(Catalogue.execute, [scrollfiles[i] for i in pending])):
+            if err is not None:
+                raise err
+            fields[i] = rc
+        return [Installer.Scroll(scrollfiles[i], fields[i]) for i in range(len(scrollfiles))]
+    
+    
+    @staticmethod
+    def load_all_information(private, installed_info, installed_versions, field_installed, catalogue = None):
         '''
         Load and map informastion about all installed scrolls
         
@@ -118,9 +147,10 @@ class Installer():
         @param  installed_info:dict<ScrollVersion, Scroll>   Mapping from scroll version to scroll information, to fill
         @param  installed_versions:dict<str, ScrollVersion>  Mapping from scroll name to scroll version, to fill
         @param  dict<str, dict<¿E?, list<Scroll>>>           Field → value → scroll mapping, to fill
+        @param  catalogue:Catalogue?                         The catalogue of scrolls, only scrolls that are not in the catalogue are executed
         '''
-        for scrollfile in LibSpikeHelper.locate_all_scrolls(True, None if private else False):
-            scrollinfo = Installer.load_information(scrollfile)
+        scrollfiles = LibSpikeHelper.locate_all_scrolls(True, None if private else False)
+        for scrollinfo in Installer.load_multiple_information(scrollfiles, catalogue):
             Installer.transpose_fields(scrollinfo, field_installed)
             installed_info[scrollinfo.scroll] = scrollinfo
             installed_versions[scrollinfo.name] = scrollinfo.scroll
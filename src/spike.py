@@ -126,7 +126,8 @@ class Spike():
         opts.add_argumentless(['-c', '--copyright'],                  help = 'Print copyright information')
         
         opts.add_argumentless(['-B', '--bootstrap'],                  help = 'Update spike and scroll repositories\n'
-                                                             'slaves: [--no-verify]')
+                                                             'slaves: [--no-verify] [--jobs=] [--timeout=]')
+        opts.add_argumentless([      '--repack'],                     help = 'Make repositories share objects and repack the shared objects')
         opts.add_argumentless(['-F', '--find'],                       help = 'Find a scroll either by name or by ownership\n'
                                                              'slaves: [--owner | --written=]')
         opts.add_argumentless(['-W', '--write'],                      help = 'Install a pony (package) from scroll\n'
@@ -160,7 +161,11 @@ class Spike():
                                                                              '(supports installation and uninstallation only)\n'
                                                                              'slaves: [--shred]')
         opts.add_argumentless(['-3', '--sha3sum'],                    help = 'Calculate the SHA3 checksums for files\n'
-                                                                             '(do not expect files to be listed in order)')
+                                                                             '(do not expect files to be listed in order)\n'
+                                                             'slaves: [--jobs=] [--no-cache]')
+        opts.add_argumented(  ['--convert-database'], arg = 'ENGINE', help = 'Convert databases (FILE is ‘<key>_<value>’, e.g. ‘fileid_id’)\n'
+                                                                             'to the storage engine ‘spike’ or ‘hash’, or ‘int’ if keyed by integers\n'
+                                                             'slaves: [--private]')
         
         opts.add_argumentless(['-o', '--owner'],                      help = 'Find owner pony for file')
         opts.add_argumented(  ['-w', '--written'],   arg = 'boolean', help = 'Search only for installed (\'yes\' or \'y\') or not installed (\'no\' or \'n\') ponies')
@@ -183,6 +188,9 @@ class Spike():
         opts.add_argumentless([      '--upgrade'],                    help = 'Do only perform pony upgrades')
         opts.add_argumentless([      '--shred'],                      help = 'Perform secure removal with `shred` when removing old files')
         opts.add_argumentless([      '--no-verify'],                  help = 'Skip verification of signatures')
+        opts.add_argumentless([      '--no-cache'],                   help = 'Hash every file, even if its checksum is cached')
+        opts.add_argumented(  [      '--jobs'],      arg = 'JOBS',    help = 'Number of repositories to update, or files to hash, concurrently')
+        opts.add_argumented(  [      '--timeout'],   arg = 'SECONDS', help = 'Abort the update of a repository after a number of seconds')
         opts.add_argumentless(['-a', '--all-at-once'],                help = 'Display all example shots in one single process instance')
         opts.add_argumented(  [      '--viewer'],    arg = 'VIEWER',  help = 'Select image viewer for example shots')
         
@@ -222,6 +230,8 @@ class Spike():
         for opt in 'vhcBFWUEXRCDANPSI3':
             exclusives.add('-' + opt)
         exclusives.add('--restore-archive')
+        exclusives.add('--convert-database')
+        exclusives.add('--repack')
         exclusives.add('--demote')
         exclusives.add('--promote')
         opts.test_exclusiveness(self.execprog, exclusives, longmap, True)
@@ -262,17 +272,57 @@ class Spike():
                 self.print_copyright()
             
             elif opts.opts['-3'] is not None:
+                allowed.add('--jobs')
+                allowed.add('--no-cache')
+                opts.test_allowed(self.execprog, allowed, longmap, True)
+                jobs = None
+                try:
+                    if opts.opts['--jobs'] is not None:
+                        jobs = int(opts.opts['--jobs'][0])
+                        if jobs < 1:
+                            raise ValueError()
+                except ValueError:
+                    printerr(self.execprog + ': --jobs must be a positive integer')
+                    exit(4)
+                LibSpike.initialise()
+                exit_value = self.sha3sum(opts.files, jobs, opts.opts['--no-cache'] is None)
+            
+            elif opts.opts['--convert-database'] is not None:
+                allowed.add('--private')
                 opts.test_allowed(self.execprog, allowed, longmap, True)
+                opts.test_files(self.execprog, 1, None, True)
                 LibSpike.initialise()
-                exit_value = self.sha3sum(opts.files)
+                exit_value = self.convert_database(opts.opts['--convert-database'][0], opts.files,
+                                                   private = opts.opts['--private'] is not None)
             
             elif opts.opts['-B'] is not None:
                 allowed.add('--no-verify')
+                allowed.add('--jobs')
+                allowed.add('--timeout')
                 opts.test_allowed(self.execprog, allowed, longmap, True)
                 opts.test_files(self.execprog, 0, 0, True)
+                (jobs, timeout) = (None, None)
+                try:
+                    if opts.opts['--jobs'] is not None:
+                        jobs = int(opts.opts['--jobs'][0])
+                        if jobs < 1:
+                            raise ValueError()
+                    if opts.opts['--timeout'] is not None:
+                        timeout = float(opts.opts['--timeout'][0])
+                        if timeout <= 0:
+                            raise ValueError()
+                except ValueError:
+                    printerr(self.execprog + ': --jobs must be a positive integer and --timeout a positive number')
+                    exit(4)
                 LibSpike.initialise()
-                exit_value = self.bootstrap(opts.opts['--no-verify'] is None)
-            
+                exit_value = self.bootstrap(opts.opts['--no-verify'] is None, jobs, timeout)
+                
+            elif opts.opts['--repack'] is not None:
+                opts.test_allowed(self.execprog, allowed, longmap, True)
+                opts.test_files(self.execprog, 0, 0, True)
+                LibSpike.initialise()
+                exit_value = self.repack()
+                
             elif opts.opts['-F'] is not None:
                 exclusives.add('-o')
                 exclusives.add('-w')
@@ -363,7 +413,7 @@ class Spike():
             #    LibSpike.initialise()
             #    exit_value = self.demote(opts.files,
             #                             private = opts.opts['-u'] is not None)
-                
+                    
             #elif opts.opts['--promote'] is not None: ### TODO: implement promote
             #    allowed.add('-u')
             #    opts.test_allowed(self.execprog, allowed, longmap, True)
@@ -396,7 +446,7 @@ class Spike():
                     else:
                         LibSpike.initialise()
                         exit_value = self.read_info(opts.files, field = opts.opts['-f'])
-                    
+                
             elif opts.opts['-C'] is not None:
                 exclusives.add('--recursive')
                 exclusives.add('--entire')
@@ -468,7 +518,7 @@ class Spike():
                 opts.test_files(self.execprog, 1, None, True)
                 LibSpike.initialise(shred = opts.opts['--shred'] is not None)
                 exit_value = self.clean(private = opts.opts['--private'] is not None)
-                
+            
             elif opts.opts['-S'] is not None:
                 allowed.add('--viewer')
                 allowed.add('-a')
@@ -480,7 +530,7 @@ class Spike():
                 exit_value = self.example_shot(opts.files,
                                                viewer      = opts.opts['--viewer'][0] if opts.opts['--viewer'] is not None else default_viewer,
                                                all_at_once = opts.opts['-a'] is not None)
-                
+            
             elif opts.opts['-I'] is not None:
                 allowed.add('--shred')
                 opts.test_allowed(self.execprog, allowed, longmap, True)
@@ -539,12 +589,14 @@ class Spike():
     
     
     
-    def bootstrap(self, verify):
+    def bootstrap(self, verify, jobs = None, timeout = None):
         '''
         Update the spike and the scroll archives
         
-        @parma   verify:bool  Whether to verify signatures
-        @return  :byte        Exit value, see description of `mane` 
+        @parma   verify:bool     Whether to verify signatures
+        @param   jobs:int?       The highest number of repositories to update concurrently, `None` for the default
+        @param   timeout:float?  The number of seconds after which the update of a repository is aborted, `None` for no limit
+        @return  :byte           Exit value, see description of `mane` 
         '''
         class Agg:
             '''
@@ -552,14 +604,38 @@ class Spike():
                 Feed a directory path and 0 when a directory is enqueued for bootstraping.
                 Feed a directory path and 1 when a directory bootstrap process is beginning.
                 Feed a directory path and 2 when a directory bootstrap process has ended.
+                Feed a pony and 3 if it is installed and has a new scroll version.
+            '''
+            def __init__(self):
+                self.colour_map = (3, 4, 2, 5)
+                self.message_map = ('QUEUED', 'WORKING', 'DONE', 'UPDATABLE')
+            def __call__(self, directory, state):
+                print('\033[01;3%im%s [%s]\033[00m' % (self.colour_map[state], directory, self.message_map[state]))
+        
+        return LibSpike.bootstrap(Agg(), verify, jobs, timeout)
+    
+    
+    def repack(self):
+        '''
+        Make Spike and the scroll repositories share objects, and repack the shared objects
+        
+        @return  :byte  Exit value, see description of `mane`
+        '''
+        class Agg:
+            '''
+            aggregator:(str, int)→void
+                Feed a directory path and 0 when a repository begins using the shared object store.
+                Feed a directory path and 1 when a repository is using the shared object store.
+                Feed the shared object store and 2 when it is being repacked.
+                Feed the shared object store and 3 when it has been repacked.
             '''
             def __init__(self):
-                self.colour_map = (3, 4, 2)
-                self.message_map = ('QUEUED', 'WORKING', 'DONE')
+                self.colour_map = (4, 2, 4, 2)
+                self.message_map = ('SHARING', 'SHARED', 'REPACKING', 'DONE')
             def __call__(self, directory, state):
                 print('\033[01;3%im%s [%s]\033[00m' % (self.colour_map[state], directory, self.message_map[state]))
         
-        return LibSpike.bootstrap(Agg(), verify)
+        return LibSpike.repack(Agg())
     
     
     def find_scroll(self, patterns, installed = True, notinstalled = True):
@@ -1321,11 +1397,35 @@ class Spike():
         return 0
     
     
-    def sha3sum(self, files):
+    def convert_database(self, engine, tables, private = False):
+        '''
+        Convert databases to another storage engine
+        
+        @param   engine:str        The storage engine
+        @param   tables:list<str>  The databases to convert
+        @param   private:bool      Whether to convert private databases rather than shared databases
+        @return  :byte             Exit value, see description of `mane`
+        '''
+        class Agg:
+            '''
+            aggregator:(str, str)→void
+                Feed a database and its storage engine when the database has been converted.
+            '''
+            def __init__(self):
+                pass
+            def __call__(self, table, engine):
+                print('%s: %s' % (table, engine))
+        
+        return LibSpike.convert_database(Agg(), engine, tables, private)
+    
+    
+    def sha3sum(self, files, jobs = None, cached = True):
         '''
         Calculate the SHA3 checksum for files to be used in scrolls
         
         @param   files:list<str>  Files for which to calculate the checksum
+        @param   jobs:int?        The highest number of files to hash at the same time, `None` for the default
+        @param   cached:bool      Whether to use cached checksums for files that have not been modified
         @return  :byte            Exit value, see description of `mane`
         '''
         class Agg:
@@ -1345,7 +1445,7 @@ class Spike():
                 else:
                     print('\033[01m%s\033[21m  %s' % (checksum, filename));
         
-        return LibSpike.sha3sum(Agg(), files)
+        return LibSpike.sha3sum(Agg(), files, jobs, cached)
         
 
 